@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+索引后端基准测试：以 flat 的精确结果为基准，比较各后端的 recall@k、单条查询延迟、构建耗时和索引体积
+    python -m unit_test_gen.data_preparation.ann_bench --synthetic 100000
+    python -m unit_test_gen.data_preparation.ann_bench --index_dir unit_test_gen/data_preparation/db_data_nasa
+--index_dir 读取已有知识库（flat 后端）里的向量；查询为随机抽取的库内向量加噪声
+"""
+import argparse
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+from unit_test_gen.data_preparation.ann_index import INDEX_BACKENDS, build_index, effective_backend
+
+
+def synthetic_vectors(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    """带簇结构的归一化向量，比均匀随机更接近真实文本 embedding 的分布"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, n // 200), dim)).astype("float32")
+    x = centers[rng.integers(0, len(centers), n)] + 0.5 * rng.standard_normal((n, dim)).astype("float32")
+    faiss.normalize_L2(x)
+    return x
+
+
+def load_vectors(index_dir: Path) -> np.ndarray:
+    index = faiss.read_index(str(Path(index_dir) / "index.faiss"))
+    inner = faiss.downcast_index(index.index if hasattr(index, "id_map") else index)
+    if not isinstance(inner, faiss.IndexFlat):
+        raise ValueError("只能从 flat 后端的知识库读取原始向量")
+    return inner.reconstruct_n(0, inner.ntotal)
+
+
+def make_queries(data: np.ndarray, n: int, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    q = data[rng.integers(0, len(data), n)] + 0.1 * rng.standard_normal((n, data.shape[1])).astype("float32")
+    q = q.astype("float32")
+    faiss.normalize_L2(q)
+    return q
+
+
+def bench(data: np.ndarray, queries: np.ndarray, top_k: int, backends=INDEX_BACKENDS):
+    ids = np.arange(len(data))
+    exact = None
+    rows = []
+    for backend in backends:
+        start = time.perf_counter()
+        index = build_index(backend, data, ids)
+        build_s = time.perf_counter() - start
+
+        _, found = index.search(queries, top_k)
+        if exact is None:
+            exact = found          # backends 的第一个必须是 flat
+        recall = np.mean([len(set(a) & set(b)) / top_k for a, b in zip(found, exact)])
+
+        latency = []
+        for q in queries:
+            start = time.perf_counter()
+            index.search(q[None, :], top_k)
+            latency.append((time.perf_counter() - start) * 1000)
+        size_mb = len(faiss.serialize_index(index)) / 2 ** 20
+        rows.append((backend, effective_backend(backend, len(data)), recall,
+                     float(np.mean(latency)), float(np.percentile(latency, 95)), build_s, size_mb))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="向量索引后端基准测试")
+    parser.add_argument("--index_dir", type=Path, default=None, help="已有知识库目录（flat 后端）")
+    parser.add_argument("--synthetic", type=int, default=20000, help="未指定 --index_dir 时生成的向量数")
+    parser.add_argument("--dim", type=int, default=512, help="合成向量维度（bge-small-zh 为 512）")
+    parser.add_argument("--queries", type=int, default=200, help="查询条数")
+    parser.add_argument("--top_k", type=int, default=5)
+    args = parser.parse_args()
+
+    data = load_vectors(args.index_dir) if args.index_dir else synthetic_vectors(args.synthetic, args.dim)
+    queries = make_queries(data, args.queries)
+    print(f"向量数 {len(data)}，维度 {data.shape[1]}，查询 {len(queries)} 条，top_k={args.top_k}")
+    print(f"{'backend':<10}{'实际':<10}{'recall@k':>10}{'平均ms':>10}{'p95 ms':>10}{'构建s':>10}{'体积MB':>10}")
+    for backend, actual, recall, mean_ms, p95_ms, build_s, size_mb in bench(data, queries, args.top_k):
+        print(f"{backend:<10}{actual:<10}{recall:>10.3f}{mean_ms:>10.3f}{p95_ms:>10.3f}{build_s:>10.2f}{size_mb:>10.1f}")
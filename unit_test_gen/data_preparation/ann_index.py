@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+知识库向量索引的后端选择
+- flat     : IndexFlatIP，精确检索（默认，"faiss" 是它的别名）
+- ivf_flat : 倒排 + 原始向量，检索时只扫 nprobe 个簇
+- hnsw     : 图索引，不需要训练，但不支持删除，知识库有变化时整体重建
+- ivf_pq   : 倒排 + 乘积量化，每个向量压缩到 dim/8 字节，适合多个项目合并后的大语料
+所有后端外面都包一层 IndexIDMap2，id 与 record 存储（record_store.py）中的 id 对应；检索参数（nprobe / efSearch）写进索引文件
+IVF 类索引需要足够的训练点，向量数少于 IVF_MIN_POINTS 时退回 flat
+"""
+import math
+from typing import Dict, Tuple
+
+import faiss
+import numpy as np
+
+INDEX_BACKENDS = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+_ALIASES = {"faiss": "flat", "ivf": "ivf_flat", "ivfpq": "ivf_pq"}
+
+IVF_MIN_POINTS = 1000
+# IVF/PQ 训练最多使用的向量数（随机抽样），大语料下训练耗时不随库大小线性增长
+IVF_TRAIN_POINTS = 50000
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 128
+
+
+def normalize_backend(backend: str) -> str:
+    name = _ALIASES.get(backend, backend)
+    if name not in INDEX_BACKENDS:
+        raise ValueError(f"未知的索引后端: {backend}（可选 {', '.join(('faiss',) + INDEX_BACKENDS)}）")
+    return name
+
+
+def supports_remove(backend: str) -> bool:
+    return normalize_backend(backend) != "hnsw"
+
+
+def effective_backend(backend: str, n: int) -> str:
+    """向量太少时 IVF 聚类没有意义，退回 flat"""
+    backend = normalize_backend(backend)
+    if backend.startswith("ivf") and n < IVF_MIN_POINTS:
+        return "flat"
+    return backend
+
+
+def _pq_m(dim: int) -> int:
+    """子量化器个数：每 8 维一个，且必须整除 dim"""
+    m = max(1, dim // 8)
+    while dim % m:
+        m -= 1
+    return m
+
+
+def index_params(backend: str, n: int, dim: int) -> Tuple[str, Dict[str, int]]:
+    """返回 (index_factory 描述串, 检索参数)"""
+    backend = effective_backend(backend, n)
+    if backend == "flat":
+        return "IDMap2,Flat", {}
+    if backend == "hnsw":
+        return f"IDMap2,HNSW{HNSW_M},Flat", {"efSearch": HNSW_EF_SEARCH}
+    # 每个簇至少 39 个训练点（faiss 的建议值）
+    nlist = max(1, min(int(4 * math.sqrt(n)), n // 39))
+    nprobe = min(nlist, max(8, nlist // 8))
+    if backend == "ivf_flat":
+        return f"IDMap2,IVF{nlist},Flat", {"nprobe": nprobe}
+    return f"IDMap2,IVF{nlist},PQ{_pq_m(dim)}", {"nprobe": nprobe}
+
+
+def set_search_params(index, params: Dict[str, int]):
+    if "nprobe" in params:
+        faiss.extract_index_ivf(index).nprobe = params["nprobe"]
+    if "efSearch" in params:
+        faiss.downcast_index(index.index).hnsw.efSearch = params["efSearch"]
+
+
+def build_index(backend: str, vectors: np.ndarray, ids: np.ndarray):
+    """vectors 需已归一化（内积即余弦相似度）"""
+    n, dim = vectors.shape
+    spec, params = index_params(backend, n, dim)
+    index = faiss.index_factory(dim, spec, faiss.METRIC_INNER_PRODUCT)
+    if "HNSW" in spec:
+        faiss.downcast_index(index.index).hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    if not index.is_trained:
+        sample = vectors
+        if n > IVF_TRAIN_POINTS:
+            sample = vectors[np.random.default_rng(0).choice(n, IVF_TRAIN_POINTS, replace=False)]
+        index.train(sample)
+    if n:
+        index.add_with_ids(vectors, np.asarray(ids, dtype="int64"))
+    set_search_params(index, params)
+    return index
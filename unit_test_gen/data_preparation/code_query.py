@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+直接由源码构造知识库检索的查询文本，不经过 CODE_ABS 的 LLM 调用
+- abs     : 原流程，先让 LLM 生成摘要再以摘要检索（需要调用方提供摘要）
+- code    : 去掉 package / import 后的源码本身
+- summary : 本地摘要：类名、Javadoc、方法签名、字段名，以及拆开驼峰后的标识符
+code / summary 都是纯本地计算（tree-sitter 解析，毫秒级），检索可以与 CODE_ABS 的 LLM 调用并行
+"""
+import re
+from typing import List
+
+from unit_test_gen.data_preparation.mcdc_case_gen import get_parser
+
+RETRIEVAL_MODES = ("abs", "code", "summary")
+# 查询文本的最大字符数，超出部分 embedding 模型也会截断
+MAX_QUERY_CHARS = 2000
+
+_TYPE_DECLS = {"class_declaration", "interface_declaration", "enum_declaration", "record_declaration"}
+_CALLABLE_DECLS = {"method_declaration", "constructor_declaration"}
+_CAMEL_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+
+def _text(node, code: bytes) -> str:
+    return code[node.start_byte:node.end_byte].decode("utf-8", errors="ignore")
+
+
+def _javadoc(raw: str) -> str:
+    """去掉注释符号和 @ 标签行，只保留描述文字"""
+    lines = []
+    for line in raw[3:-2].splitlines():
+        line = line.strip().lstrip("*").strip()
+        if line.startswith("@"):
+            break
+        if line:
+            lines.append(re.sub(r"<[^>]+>|\{@\w+\s+([^}]*)\}", r"\1", line))
+    return " ".join(lines)
+
+
+def split_identifier(name: str) -> List[str]:
+    return [w.lower() for w in _CAMEL_RE.findall(name)]
+
+
+def code_summary(code: str, max_chars: int = MAX_QUERY_CHARS) -> str:
+    code_bytes = code.encode("utf-8")
+    root = get_parser().parse(code_bytes).root_node
+    types: List[str] = []
+    docs: List[str] = []
+    signatures: List[str] = []
+    fields: List[str] = []
+    words: List[str] = []
+
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node.type == "block_comment" and _text(node, code_bytes).startswith("/**"):
+            doc = _javadoc(_text(node, code_bytes))
+            if doc:
+                docs.append(doc)
+        elif node.type in _TYPE_DECLS:
+            name = node.child_by_field_name("name")
+            if name is not None:
+                types.append(_text(name, code_bytes))
+        elif node.type in _CALLABLE_DECLS:
+            body = node.child_by_field_name("body")
+            end = body.start_byte if body is not None else node.end_byte
+            # 签名不带注解，空白压成一个空格
+            sig = code_bytes[node.start_byte:end].decode("utf-8", errors="ignore")
+            sig = re.sub(r"@\w+(\([^)]*\))?", "", sig)
+            signatures.append(re.sub(r"\s+", " ", sig).strip())
+            name = node.child_by_field_name("name")
+            if name is not None:
+                words.extend(split_identifier(_text(name, code_bytes)))
+            continue            # 方法体内部的内容不进摘要
+        elif node.type == "field_declaration":
+            for child in node.children:
+                if child.type == "variable_declarator":
+                    name = child.child_by_field_name("name")
+                    if name is not None:
+                        fields.append(_text(name, code_bytes))
+                        words.extend(split_identifier(_text(name, code_bytes)))
+            continue
+        stack.extend(reversed(node.children))
+
+    for t in types:
+        words.extend(split_identifier(t))
+    parts = []
+    if types:
+        parts.append("类 " + ", ".join(types))
+    if docs:
+        parts.append("说明：" + " ".join(docs))
+    if signatures:
+        parts.append("方法：\n" + "\n".join(signatures))
+    if fields:
+        parts.append("字段：" + ", ".join(fields))
+    if words:
+        parts.append("关键词：" + " ".join(dict.fromkeys(words)))
+    return "\n".join(parts)[:max_chars]
+
+
+def strip_code(code: str, max_chars: int = MAX_QUERY_CHARS) -> str:
+    """code 模式：去掉 package / import 行，避免查询被样板代码占满"""
+    lines = [line for line in code.splitlines() if not re.match(r"\s*(package|import)\s", line)]
+    return "\n".join(lines).strip()[:max_chars]
+
+
+def build_query(code: str, mode: str) -> str:
+    if mode == "code":
+        return strip_code(code)
+    if mode == "summary":
+        return code_summary(code)
+    raise ValueError(f"检索模式 {mode} 无法由源码直接构造查询（可选 {', '.join(RETRIEVAL_MODES[1:])}）")
@@ -1,13 +1,19 @@
+import hashlib
 import json
-import pickle
-import re
+import io
 import os
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import glob
+from unit_test_gen.data_preparation.retrieval import (DEFAULT_NAMESPACE, get_embed_model, get_retriever,
+                                                       invalidate_retriever, namespace_index_dir, namespace_source_dir)
+from unit_test_gen.data_preparation.embed_cache import get_embedding_cache
+from unit_test_gen.data_preparation.ann_index import build_index, normalize_backend
+from unit_test_gen.data_preparation.record_store import RecordStore, current_files, export_records, write_records
+from unit_test_gen.data_preparation.md_chunker import MarkdownChunker, chunk_text, make_token_counter
+from unit_test_gen.data_preparation.onnx_embed import model_spec
 
 class DataBaseConstructor:
     """
@@ -15,116 +21,215 @@ class DataBaseConstructor:
     """
     def __init__(self, backend: str = "faiss", 
                  embed_model: str = "BAAI/bge-small-zh-v1.5", 
-                 chunk_size: int = 4096):
+                 chunk_size: int = 4096,
+                 chunk_overlap: int = 64,
+                 min_chunk_size: int = 32,
+                 embed_backend: str = "torch",
+                 embed_threads: Optional[int] = None,
+                 embed_batch_size: int = 32,
+                 namespace: str = DEFAULT_NAMESPACE):
         '''Input:
         src_proj_dir: 待测项目根目录（不包含test目录）
-        backend: 向量数据库后端
+        backend: 向量索引后端，faiss(=flat) / ivf_flat / hnsw / ivf_pq，见 ann_index.py
         model: 使用的模型名称
+        chunk_size: 每个 chunk（含 tags 路径）的最大 token 数，超过模型的 max_seq_length 时以后者为准
+        chunk_overlap: 长章节切块时相邻块重叠的 token 数
+        min_chunk_size: 小于该 token 数的块与相邻块合并
+        embed_backend: torch（SentenceTransformer fp32）/ onnx（int8 量化，CPU 上更快，见 onnx_embed.py）
+        embed_threads: onnx 后端的推理线程数
+        embed_batch_size: 建库时 embedding 的批大小
+        namespace: 项目命名空间，输入 reverse_data_<namespace>/*.md，输出 db_data_<namespace>/
         prompt_template_path: prompt模板文件路径
         '''
         
-        self.md_files = glob.glob(str(Path(__file__).resolve().parent / "reverse_data_nasa" / "*.md"))
-        self.index_dir = Path(__file__).resolve().parent / "db_data_nasa"
+        self.namespace = namespace
+        self.md_files = glob.glob(str(namespace_source_dir(namespace) / "*.md"))
+        self.index_dir = namespace_index_dir(namespace)
         os.makedirs(self.index_dir, exist_ok=True)
-        self.embed_model = SentenceTransformer(embed_model)
+        self.backend = normalize_backend(backend)
+        # 两种后端的向量不能混用，后端并入模型名，manifest / embedding 缓存 / Retriever 都以它为准
+        self.embed_model_name = model_spec(embed_model, embed_backend)
+        self.embed_batch_size = embed_batch_size
+        self.embed_model = get_embed_model(self.embed_model_name, threads=embed_threads, batch_size=embed_batch_size)     # 同一进程内只加载一次
         self.dim = self.embed_model.get_sentence_embedding_dimension()
+        self.embed_cache = get_embedding_cache(self.embed_model_name, self.dim)
+        max_tokens = min(chunk_size, getattr(self.embed_model, "max_seq_length", None) or chunk_size)
+        self.chunker = MarkdownChunker(max_tokens, chunk_overlap, min_chunk_size, make_token_counter(self.embed_model))
     
-    def construct_faiss(self):
-        raw = ''
-        for md_file in self.md_files:
-            with open(md_file, encoding="utf-8") as f:
-                raw += f.read() + '\n\n'
+    def construct_faiss(self, full: bool = False, export: Optional[str] = None):
+        """
+        增量构建：manifest.json 记录每个文件的内容哈希和其中每个 chunk 的 (哈希, id)
+        - 文件未改动：什么都不做
+        - 文件改动：只对新增/改动的 chunk 做 embedding，删掉消失的 chunk
+        - 文件删除：删掉它的全部 chunk
+        full=True、首次构建、换了 embedding 模型/索引后端或旧版索引（无 manifest）时全量重建
+        非 flat 后端有变化时按全部 chunk 重新训练索引，未改动 chunk 的向量来自 embedding 缓存
+        export: "json" / "pkl" 时额外导出 records.json / records.pkl 供人工查看
+        """
+        manifest = None if full else self.load_manifest()
+        if manifest is None:
+            manifest = {"embed_model": self.embed_model_name, "backend": self.backend,
+                        "chunker": self.chunker.config(), "next_id": 0, "files": {}}
+            index = faiss.IndexIDMap2(faiss.IndexFlatIP(self.dim))
+            records: Dict[int, Dict] = {}
+        else:
+            index = None if self.backend != "flat" else faiss.read_index(os.path.join(self.index_dir, "index.faiss"))
+            store = RecordStore(self.index_dir)
+            records = store.to_dict()
+            store.close()
+
+        files = manifest["files"]
+        current = {Path(md).name: md for md in self.md_files}
+        removed: List[int] = []
+        added: List[Dict] = []
+        added_ids: List[int] = []
+        changed = 0
+
+        # 已删除的文件
+        for name in [n for n in files if n not in current]:
+            removed.extend(cid for _, cid in files.pop(name)["chunks"])
+            changed += 1
+
+        for name, md_file in sorted(current.items()):
+            file_hash = self.file_hash(md_file)
+            old = files.get(name)
+            if old is not None and old["hash"] == file_hash:
+                continue
+            changed += 1
+            # 同一文件内内容相同的 chunk 沿用原来的 id，不重新 embedding
+            reuse: Dict[str, List[int]] = {}
+            for h, cid in (old["chunks"] if old else []):
+                reuse.setdefault(h, []).append(cid)
+            chunks = []
+            with open(md_file, "r", encoding="utf-8") as f:
+                parsed = list(self.chunker.chunks(f))
+            for record in parsed:
+                h = self.chunk_hash(record)
+                if reuse.get(h):
+                    cid = reuse[h].pop(0)
+                else:
+                    cid = manifest["next_id"]
+                    manifest["next_id"] += 1
+                    added.append(record)
+                    added_ids.append(cid)
+                records[cid] = {**record, "source": name}
+                chunks.append([h, cid])
+            removed.extend(cid for ids in reuse.values() for cid in ids)
+            files[name] = {"hash": file_hash, "chunks": chunks}
+
+        if not changed:
+            print(f"✅ 知识库未改动，共 {len(records)} 个 chunk")
+            return
+
+        for cid in removed:
+            records.pop(cid, None)
+        if self.backend != "flat":
+            ids = sorted(records)
+            index = build_index(self.backend, self.embed_records([records[cid] for cid in ids]), np.asarray(ids, dtype="int64"))
+        else:
+            if removed:
+                index.remove_ids(np.asarray(removed, dtype="int64"))
+            if added:
+                index.add_with_ids(self.embed_records(added), np.asarray(added_ids, dtype="int64"))
+        self.save_index(index, records, manifest)
+        print(f"✅ 增量构建完成：{changed} 个文件有变化，新增 {len(added)} 个 chunk，删除 {len(removed)} 个，共 {index.ntotal} 个")
 
-            chunks = self.parse_markdown(raw)
-            self.build_faiss_index(chunks)
+        # 测试知识库
+        print("正在测试知识库...")
+        query = "如何根据历史轨迹数据，预测未来的轨迹？"
+        self.search_index(query)
 
-            # 测试知识库
-            print("正在测试知识库...")
-            query = "如何根据历史轨迹数据，预测未来的轨迹？"
-            self.search_index(query)
+        if export:
+            self.dump_records(export)
 
-            self.dump_records()
+    @staticmethod
+    def file_hash(path: str) -> str:
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        return h.hexdigest()
+
+    @staticmethod
+    def chunk_hash(record: Dict) -> str:
+        return hashlib.sha1(json.dumps([record["tags"], record["text"]], ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def load_manifest(self):
+        path = os.path.join(self.index_dir, "manifest.json")
+        try:
+            manifest = json.load(open(path, "r", encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if manifest.get("embed_model") != self.embed_model_name:
+            return None
+        if manifest.get("backend", "flat") != self.backend:
+            return None
+        if manifest.get("chunker") != self.chunker.config():
+            return None
+        if not os.path.exists(os.path.join(self.index_dir, "index.faiss")):
+            return None
+        if current_files(self.index_dir) is None and not os.path.exists(os.path.join(self.index_dir, "records.pkl")):
+            return None
+        return manifest
+
+    def embed_records(self, records: List[Dict]) -> np.ndarray:
+        """命中 embedding 缓存的 chunk 不再过模型"""
+        texts = [chunk_text(r) for r in records]
+        return self.embed_cache.encode(texts, self._encode)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        vectors = self.embed_model.encode(texts, batch_size=self.embed_batch_size, convert_to_numpy=True, normalize_embeddings=True)
+        return vectors.astype("float32")
+
+    def save_index(self, index, records: Dict[int, Dict], manifest: Optional[Dict]):
+        faiss.write_index(index, os.path.join(self.index_dir, "index.faiss"))
+        write_records(self.index_dir, records)
+        invalidate_retriever(self.index_dir)
+        # manifest 最后写：中途失败时下次会按旧 manifest 重新处理这些文件；
+        # 不经过增量流程建的索引不写 manifest，下次增量构建时全量重建
+        manifest_path = os.path.join(self.index_dir, "manifest.json")
+        if manifest is None:
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+            return
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
     
-    def dump_records(self):
-        records = pickle.load(open(os.path.join(self.index_dir, "records.pkl"), "rb"))
-        with open(os.path.join(self.index_dir, "records.json"), "w", encoding="utf-8") as f:
-            json.dump(records, f, ensure_ascii=False, indent=2)
+    def dump_records(self, fmt: str = "json"):
+        """从列式存储导出 records.json / records.pkl（仅供查看，检索不读取）"""
+        export_records(self.index_dir, fmt)
     
     def search_index(self, query: str, top_k: int = 5):
-        index = faiss.read_index(os.path.join(self.index_dir, "index.faiss"))
-        meta = json.load(open(os.path.join(self.index_dir, "meta.json"), "r", encoding="utf-8"))
-        records = pickle.load(open(os.path.join(self.index_dir, "records.pkl"), "rb"))
-
-        query_vector = self.embed_model.encode([query], convert_to_numpy=True, normalize_embeddings=True).astype("float32")
-        distances, indices = index.search(query_vector, top_k)
+        # 索引和 records 由进程内常驻的 Retriever 持有，不再每次查询都读盘
+        hits = get_retriever(self.index_dir, self.embed_model_name).search(query, top_k)
         
         ans = []
-        for i in range(top_k):
-            record = records[indices[0][i]]
-            print(f"距离: {distances[0][i]:.4f}")
+        for hit in hits:
+            record = {k: v for k, v in hit.items() if k != "score"}
+            print(f"距离: {hit['score']:.4f}")
             print(f"路径: {' / '.join(record['tags'])}")
             print(f"内容: {record['text']}")
             print("="*50)
             ans.append(record)
         return ans
     
-    def build_faiss_index(self, records: List[Dict]):
-        texts = [f"{' / '.join(r['tags'])}\n\n{r['text']}" for r in records]
-        vectors = self.embed_model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
-        vectors = vectors.astype("float32")
-        index = faiss.IndexFlatIP(self.dim)
-        index.add(vectors)
+    def search_many(self, queries: List[str], top_k: int = 5) -> List[List[Dict]]:
+        """批量检索，不打印；每条查询返回 top_k 条记录（附带 score）"""
+        return get_retriever(self.index_dir, self.embed_model_name).search_many(queries, top_k)
 
-        faiss.write_index(index, os.path.join(self.index_dir, "index.faiss"))
-        with open(os.path.join(self.index_dir, "meta.json"), "w", encoding="utf-8") as f:
-            json.dump([{"tags": r["tags"]} for r in records], f, ensure_ascii=False, indent=2)
-        pickle.dump(records, open(os.path.join(self.index_dir, "records.pkl"), "wb"))
+    def build_faiss_index(self, records: List[Dict]):
+        """不走增量，直接用给定的 chunk 全量建索引（id 为下标）"""
+        index = build_index(self.backend, self.embed_records(records), np.arange(len(records)))
+        self.save_index(index, dict(enumerate(records)), None)
         print(f"✅ 已索引 {len(records)} 个 chunk")
         
     def parse_markdown(self, raw: str) -> List[Dict]:
         """
         返回 List[Dict]:
             {
-                "text": 当前标题下的正文（不含父标题文本）,
+                "text": 当前标题下的正文（不含父标题文本），过长时切成多块,
                 "tags": [父标题1, 父标题2, ..., 当前标题],
             }
+        大文件请直接对文件句柄调用 self.chunker.chunks(f)
         """
-        lines = raw.splitlines()
-        chunks: List[Dict] = []
-
-        stack: List[tuple] = []
-        buffer: List[str] = []   # 当前标题下的正文行
-
-        def emit():
-            """把当前标题之前的内容封装为 chunk"""
-            if not stack:
-                return
-            levels, titles = zip(*stack)
-            tags = list(titles)
-            body = "\n".join(buffer).strip()
-            chunks.append({
-                "text": body,
-                "tags": tags
-            })
-            buffer.clear()
-
-        for line in lines:
-            m = re.match(r'^(#{1,6})\s+(.*)', line)
-            if m:
-                level = len(m.group(1))
-                title = m.group(2).strip()
-                emit()
-                while stack and stack[-1][0] >= level:
-                    stack.pop()
-                stack.append((level, title))
-            else:
-                buffer.append(line)
-
-        emit()
-
-        # 返回text不为空的chunk
-        return [chunk for chunk in chunks if chunk['text']]
-
-
-
-
+        return list(self.chunker.chunks(io.StringIO(raw)))
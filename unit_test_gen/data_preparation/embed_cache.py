@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+按内容寻址的 embedding 缓存
+- key = sha1(模型名 + 规范化后的文本)，同一段文本在任意知识库、任意次重建中只做一次前向
+- 持久化部分（每个模型一个目录）：
+    vectors.f32 : float32 矩阵，按行追加，读取时以 np.memmap 映射
+    keys.bin    : 每行 20 字节的 sha1，与 vectors.f32 的行一一对应（即偏移索引）
+    stamps.u32  : 每行最近一次被用到的时间（秒），压缩时按它淘汰
+    meta.json   : {"model": ..., "dim": ..., "generation": ...}，维度或模型不符时整体作废
+- 查询向量只放在进程内的 LRU 里（条数有上限），重复查询不再过模型
+- 写入顺序：先追加向量再追加 key；中途中断时加载阶段按两者较短的行数截断
+- 大小上限 UTGEN_EMBED_CACHE_MB（默认 2048）：追加后超过上限时压缩，按最近使用时间保留到上限的
+  COMPACT_RATIO，写成下一代文件（vectors.<代>.f32 等）后原子替换 meta.json 切换过去；
+  文档改动留下的旧 chunk 向量不会无限累积
+- 同一目录被多个进程共用（多个知识库、test_db 与 test_gen 批处理、检索守护进程），
+  读写磁盘都在 .lock 文件锁内进行：追加的起始行号取自锁内 keys.bin 的实际大小，
+  其他进程追加的行在锁内从 keys.bin 补读后才会使用，其他进程压缩过（代数变化）时全部重读
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:             # Windows
+    fcntl = None
+    import msvcrt
+
+DEFAULT_CACHE_DIR = Path(__file__).resolve().parent / "embed_cache"
+QUERY_CACHE_SIZE = 1024
+CACHE_MB_ENV = "UTGEN_EMBED_CACHE_MB"
+DEFAULT_CACHE_MB = 2048
+COMPACT_RATIO = 0.8             # 压缩后保留到上限的这个比例，避免每次追加都压缩
+_KEY_BYTES = 20
+_STAMP_BYTES = 4
+_COPY_ROWS = 65536              # 压缩时分块复制，内存占用不随缓存大小增长
+
+Encoder = Callable[[List[str]], np.ndarray]
+
+
+@contextmanager
+def _file_lock(path: Path):
+    """跨进程的排他锁"""
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _now_stamp() -> int:
+    return int(time.time())
+
+
+def normalize_text(text: str) -> str:
+    """只抹掉不影响语义的差异：Unicode 规范形式、换行符、行尾空白和首尾空白"""
+    text = unicodedata.normalize("NFC", text).replace("\r\n", "\n").replace("\r", "\n")
+    return re.sub(r"[ \t]+\n", "\n", text).strip()
+
+
+class EmbeddingCache:
+    def __init__(self, model_name: str, dim: int, cache_dir: Path = DEFAULT_CACHE_DIR,
+                 query_cache_size: int = QUERY_CACHE_SIZE, max_mb: Optional[float] = None):
+        """max_mb: 磁盘上向量文件的大小上限，默认读 UTGEN_EMBED_CACHE_MB，<= 0 表示不限"""
+        self.model_name = model_name
+        self.dim = dim
+        self.dir = Path(cache_dir) / re.sub(r"[^\w.-]+", "_", model_name)
+        self.query_cache_size = query_cache_size
+        max_mb = float(os.getenv(CACHE_MB_ENV, DEFAULT_CACHE_MB)) if max_mb is None else max_mb
+        self.max_bytes = int(max_mb * 2 ** 20) if max_mb > 0 else None
+        self._lock = threading.Lock()
+        self._rows: Dict[bytes, int] = {}
+        self._n = 0                     # 已读入 _rows 的磁盘行数
+        self._gen = 0                   # 已读入的文件代数，压缩后加一
+        self._mm: Optional[np.ndarray] = None
+        self._queries: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self.hits = self.misses = 0
+        self._load()
+
+    # --------------------------------------------------
+    # 持久化
+    # --------------------------------------------------
+    def _paths(self, gen: Optional[int] = None) -> Tuple[Path, Path, Path]:
+        """第 gen 代的 (向量, key, 使用时间) 文件；第 0 代沿用不带代数的文件名"""
+        gen = self._gen if gen is None else gen
+        suffix = f".{gen}" if gen else ""
+        return (self.dir / f"vectors{suffix}.f32", self.dir / f"keys{suffix}.bin",
+                self.dir / f"stamps{suffix}.u32")
+
+    def _meta_path(self) -> Path:
+        return self.dir / "meta.json"
+
+    def _read_meta(self) -> Optional[dict]:
+        try:
+            return json.loads(self._meta_path().read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, gen: int):
+        tmp = self.dir / "meta.json.tmp"
+        tmp.write_text(json.dumps({"model": self.model_name, "dim": self.dim, "generation": gen}), encoding="utf-8")
+        os.replace(tmp, self._meta_path())
+
+    def _load(self):
+        os.makedirs(self.dir, exist_ok=True)
+        with _file_lock(self.dir / ".lock"):
+            self._check_meta()
+            self._refresh()
+
+    def _check_meta(self):
+        """调用方持有文件锁"""
+        meta = self._read_meta()
+        if meta is None or meta.get("model") != self.model_name or meta.get("dim") != self.dim:
+            gen = int((meta or {}).get("generation", 0))
+            for p in self._paths(gen) + self._paths(0):
+                p.unlink(missing_ok=True)
+            self._write_meta(0)
+
+    def _refresh(self):
+        """
+        调用方持有文件锁：截掉中断留下的半行，再把磁盘上还没读入的行（包括其他进程追加的）补进 _rows
+        代数变化（其他进程压缩过）或行数变少（其他进程重置过）时全部重读
+        """
+        gen = int((self._read_meta() or {}).get("generation", 0))
+        if gen != self._gen:
+            self._rows, self._n, self._mm, self._gen = {}, 0, None, gen
+        vec_path, key_path, stamp_path = self._paths()
+        row_bytes = 4 * self.dim
+        n = min(os.path.getsize(vec_path) // row_bytes if vec_path.exists() else 0,
+                os.path.getsize(key_path) // _KEY_BYTES if key_path.exists() else 0)
+        for p, size in ((vec_path, n * row_bytes), (key_path, n * _KEY_BYTES), (stamp_path, n * _STAMP_BYTES)):
+            # 使用时间文件可能比行数短（旧版本的缓存没有这个文件），截断时补 0
+            if p.exists() or p == stamp_path:
+                with open(p, "ab"):
+                    pass
+                if os.path.getsize(p) != size:
+                    os.truncate(p, size)
+        if n < self._n:
+            self._rows, self._n, self._mm = {}, 0, None
+        if n > self._n:
+            with open(key_path, "rb") as f:
+                f.seek(self._n * _KEY_BYTES)
+                keys = f.read((n - self._n) * _KEY_BYTES)
+            for i in range(n - self._n):
+                self._rows[keys[i * _KEY_BYTES:(i + 1) * _KEY_BYTES]] = self._n + i
+            self._n = n
+
+    def _matrix(self) -> np.ndarray:
+        """调用方持有文件锁，保证映射的是与 _rows 同一代的文件"""
+        if self._mm is None or len(self._mm) < self._n:
+            vec_path = self._paths()[0]
+            self._mm = np.memmap(vec_path, dtype="float32", mode="r", shape=(self._n, self.dim))
+        return self._mm
+
+    def _touch(self, rows: List[int]):
+        """调用方持有文件锁：记录这些行的最近使用时间"""
+        if not rows:
+            return
+        stamps = np.memmap(self._paths()[2], dtype="<u4", mode="r+", shape=(self._n,))
+        stamps[rows] = _now_stamp()
+        stamps.flush()
+        del stamps
+
+    def _append(self, keys: Sequence[bytes], vectors: np.ndarray):
+        """调用方持有文件锁并刚刚 _refresh 过，磁盘行数即 self._n"""
+        vec_path, key_path, stamp_path = self._paths()
+        with open(vec_path, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype="float32").tobytes())
+        with open(key_path, "ab") as f:
+            f.write(b"".join(keys))
+        with open(stamp_path, "ab") as f:
+            f.write(np.full(len(keys), _now_stamp(), dtype="<u4").tobytes())
+        for i, k in enumerate(keys):
+            self._rows[k] = self._n + i
+        self._n += len(keys)
+
+    def _compact(self, protect: Set[int] = frozenset()):
+        """
+        调用方持有文件锁：向量文件超过上限时按最近使用时间保留到上限的 COMPACT_RATIO，
+        写成下一代文件后原子替换 meta.json；其他进程下次 _refresh 时看到代数变化全部重读
+        """
+        row_bytes = 4 * self.dim
+        if self.max_bytes is None or self._n * row_bytes <= self.max_bytes:
+            return
+        keep_n = max(len(protect), int(self.max_bytes * COMPACT_RATIO) // row_bytes)
+        vec_path, key_path, stamp_path = self._paths()
+        stamps = np.fromfile(stamp_path, dtype="<u4", count=self._n)
+        # protect 的行排最前，其余最近用过的在前、同一时间的保留较新的行；保留的行按原顺序写出
+        rank = stamps.astype(np.int64) * (self._n + 1) + np.arange(self._n)
+        rank[list(protect)] = np.iinfo(np.int64).max
+        keep = np.sort(np.argsort(-rank, kind="stable")[:keep_n])
+        with open(key_path, "rb") as f:
+            keys = np.frombuffer(f.read(self._n * _KEY_BYTES), dtype=f"V{_KEY_BYTES}")
+        gen = self._gen + 1
+        new_vec, new_key, new_stamp = self._paths(gen)
+        src = np.memmap(vec_path, dtype="float32", mode="r", shape=(self._n, self.dim))
+        with open(new_vec, "wb") as f:
+            for start in range(0, len(keep), _COPY_ROWS):
+                f.write(np.ascontiguousarray(src[keep[start:start + _COPY_ROWS]]).tobytes())
+        del src
+        new_key.write_bytes(keys[keep].tobytes())
+        new_stamp.write_bytes(stamps[keep].astype("<u4").tobytes())
+        self._write_meta(gen)
+        self._rows, self._n, self._mm, self._gen = {}, 0, None, gen
+        self._refresh()
+        current = set(self._paths())
+        for p in list(self.dir.glob("vectors*.f32")) + list(self.dir.glob("keys*.bin")) + list(self.dir.glob("stamps*.u32")):
+            if p not in current:
+                try:
+                    p.unlink()
+                except OSError:
+                    pass    # Windows 上仍被其他进程映射的文件删不掉，下次压缩时再删
+
+    # --------------------------------------------------
+    # 查询
+    # --------------------------------------------------
+    def key(self, text: str) -> bytes:
+        return hashlib.sha1((self.model_name + "\0" + normalize_text(text)).encode("utf-8")).digest()
+
+    def encode(self, texts: Sequence[str], encoder: Encoder) -> np.ndarray:
+        """知识库 chunk：命中的直接从 memmap 取，未命中的去重后一次性交给 encoder 并写回缓存"""
+        keys = [self.key(t) for t in texts]
+        if not keys:
+            return np.zeros((0, self.dim), dtype="float32")
+        lock_path = self.dir / ".lock"
+        with self._lock:
+            with _file_lock(lock_path):
+                self._refresh()
+                missing: Dict[bytes, str] = {}
+                for k, t in zip(keys, texts):
+                    if k not in self._rows and k not in missing:
+                        missing[k] = t
+                self.misses += len(missing)
+                self.hits += len(texts) - len(missing)
+                # 命中的向量在锁内取出：之后其他进程可能压缩掉这些行
+                hit = [k for k in dict.fromkeys(keys) if k not in missing]
+                found = dict(zip(hit, self._gather(hit))) if hit else {}
+            if missing:
+                # 编码期间不占文件锁；写回前再补读一次，其他进程在此期间写入的 key 不再重复追加
+                vectors = np.asarray(encoder(list(missing.values())), dtype="float32")
+                found.update(zip(missing, vectors))
+                with _file_lock(lock_path):
+                    self._refresh()
+                    fresh = [i for i, k in enumerate(missing) if k not in self._rows]
+                    if fresh:
+                        self._append([list(missing)[i] for i in fresh], vectors[fresh])
+                    self._compact(protect={self._rows[k] for k in missing if k in self._rows})
+            return np.stack([found[k] for k in keys])
+
+    def _gather(self, keys: List[bytes]) -> np.ndarray:
+        """调用方持有文件锁：按 key 取向量并记录使用时间"""
+        rows = [self._rows[k] for k in keys]
+        self._touch(sorted(set(rows)))
+        return np.array(self._matrix()[rows])
+
+    def encode_query(self, query: str, encoder: Encoder) -> np.ndarray:
+        """查询向量：进程内 LRU，返回形状 (1, dim)"""
+        return self.encode_queries([query], encoder)
+
+    def encode_queries(self, queries: Sequence[str], encoder: Encoder) -> np.ndarray:
+        """一批查询：未命中 LRU 的去重后一次前向，返回形状 (len(queries), dim)"""
+        keys = [self.key(q) for q in queries]
+        found: Dict[bytes, np.ndarray] = {}
+        missing: Dict[bytes, str] = {}
+        with self._lock:
+            for k, q in zip(keys, queries):
+                vec = self._queries.get(k)
+                if vec is not None:
+                    self._queries.move_to_end(k)
+                    found[k] = vec
+                elif k not in missing:
+                    missing[k] = q
+            self.hits += len(queries) - len(missing)
+        if missing:
+            vectors = np.asarray(encoder(list(missing.values())), dtype="float32").reshape(len(missing), self.dim)
+            with self._lock:
+                self.misses += len(missing)
+                for k, vec in zip(missing, vectors):
+                    found[k] = self._queries[k] = vec
+                while len(self._queries) > self.query_cache_size:
+                    self._queries.popitem(last=False)
+        if not keys:
+            return np.zeros((0, self.dim), dtype="float32")
+        return np.stack([found[k] for k in keys])
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+
+_CACHES: Dict[tuple, EmbeddingCache] = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def get_embedding_cache(model_name: str, dim: int, cache_dir: Path = DEFAULT_CACHE_DIR) -> EmbeddingCache:
+    """同一进程内同一模型共用一个缓存实例"""
+    key = (str(Path(cache_dir).resolve()), model_name, dim)
+    with _CACHE_LOCK:
+        cache = _CACHES.get(key)
+        if cache is None:
+            cache = _CACHES[key] = EmbeddingCache(model_name, dim, cache_dir)
+        return cache
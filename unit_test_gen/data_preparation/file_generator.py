@@ -1,9 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from dotenv import load_dotenv
 import glob
 from openai import OpenAI
 import os
+import re
+from typing import Callable, Dict, List, Optional
 import yaml
+from unit_test_gen.data_preparation.md_chunker import approx_token_count
+from unit_test_gen.llm_gateway import RateLimiter, complete, stream
 
 
 load_dotenv()
@@ -14,11 +19,75 @@ load_dotenv()
 # OUT_REQ_FILE  = "../data/req_doc.md"                 
 # MODEL     = "kimi-latest"                            
 # PROMPT_TEMPLATE_PATH = "../prompt_template.yaml"
+
+
+REQ_MODES = ("single", "map_reduce")
+
+
+MERGE_FAN_IN = 2     # 每次合并的份数；按下标固定分组，某一份变了只影响它这一支的上层合并
+MERGE_SEP = "\n\n---\n\n"
+
+
+def split_text(text: str, budget: int) -> List[str]:
+    """按行把文本切成不超过 budget 个 token 的若干段；单行超限时按字符切开"""
+    pieces: List[str] = []
+    lines: List[str] = []
+    size = 0
+    for line in text.splitlines(keepends=True):
+        while approx_token_count(line) > budget:
+            cut = budget * 4
+            while cut > 1 and approx_token_count(line[:cut]) > budget:
+                cut //= 2
+            pieces.extend(["".join(lines)] if lines else [])
+            pieces.append(line[:cut])
+            lines, size, line = [], 0, line[cut:]
+        tokens = approx_token_count(line)
+        if lines and size + tokens > budget:
+            pieces.append("".join(lines))
+            lines, size = [], 0
+        lines.append(line)
+        size += tokens
+    if lines:
+        pieces.append("".join(lines))
+    return [piece.strip() for piece in pieces if piece.strip()]
+
+
+def pack_parts(texts: List[str], budget: int) -> List[List[str]]:
+    """按顺序把相邻文本装进不超过 budget 个 token 的组；单个超限的文本先按行切开"""
+    groups: List[List[str]] = []
+    size = 0
+    for text in texts:
+        for piece in split_text(text, budget) if approx_token_count(text) > budget else [text]:
+            tokens = approx_token_count(piece)
+            if groups and size + tokens <= budget:
+                groups[-1].append(piece)
+                size += tokens
+            else:
+                groups.append([piece])
+                size = tokens
+    return groups
+
+
+def _appender(f) -> Callable[[str], None]:
+    """流式回调：文本片段追加写入已打开的文件并立即落盘"""
+    def append(text: str):
+        f.write(text)
+        f.flush()
+    return append
+
+
 class FileGenerator:
     def __init__(self, src_proj_dir, 
                  backend = "faiss", 
                  model = "kimi-latest", 
-                 prompt_template_path = Path(__file__).resolve().parent.parent / "prompt_template.yaml"):
+                 prompt_template_path = Path(__file__).resolve().parent.parent / "prompt_template.yaml",
+                 namespace = "nasa",
+                 concurrency = 1,
+                 rpm = None,
+                 llm_cache = True,
+                 req_mode = "single",
+                 req_part_tokens = 16000,
+                 stream = False):
         '''属性:
         src_proj_dir: 待测项目根目录（不包含test目录）
         api_file: 接口文档文件路径
@@ -26,33 +95,36 @@ class FileGenerator:
         backend: 向量数据库后端
         model: 使用的模型名称
         prompt_template_path: prompt模板文件路径
+        namespace: 项目命名空间，文档输出到 reverse_data_<namespace>/，供同名知识库使用
+        concurrency: 生成接口文档时同时进行的 LLM 请求数
+        rpm: 每分钟最多发出的 LLM 请求数，None 表示不限
+        llm_cache: 相同请求复用 LLM 响应缓存（见 llm_cache.py），命中缓存时不占用 rpm 配额
+        req_mode: 需求文档的生成方式
+            single     整份接口文档一次请求
+            map_reduce 接口文档按包切分（包太大时再按类切），各部分并发生成需求文档后逐层合并；
+                       各部分的结果走 LLM 响应缓存，重跑时只有内容变了的包会重新请求
+        req_part_tokens: map_reduce 模式下每一部分（以及每次合并的输入）的 token 上限；
+                         map 步与中间合并的输出限制在它的 1/MERGE_FAN_IN 左右，保证两两合并放得下
+        stream: 流式请求，接口文档（以及 single 模式的需求文档）边收边追加写入文件；
+            为保证文件顺序，接口文档逐个文件生成，concurrency 不生效
         '''
         self.src_proj_dir = src_proj_dir
-        os.makedirs(Path(__file__).resolve().parent / "reverse_data_nasa", exist_ok=True)
-        self.api_file = Path(__file__).resolve().parent / "reverse_data_nasa" / "api_doc.md"
-        self.req_file = Path(__file__).resolve().parent / "reverse_data_nasa" / "req_doc.md"
+        out_dir = Path(__file__).resolve().parent / f"reverse_data_{namespace}"
+        os.makedirs(out_dir, exist_ok=True)
+        self.api_file = out_dir / "api_doc.md"
+        self.req_file = out_dir / "req_doc.md"
         self.model = model
-        if "kimi" in model:
-            self.client = OpenAI(
-                api_key=os.getenv("MOONSHOT_API_KEY"),
-                base_url="https://api.moonshot.cn/v1"
-            )
-        # 测试client 连通性
-
-        resp =self.client.chat.completions.create(
-            model=self.model,
-            messages=[{"role": "system", "content": "测试连接"}],
-            temperature=0.2,
-            max_tokens=10
-        )
-        print("模型连接测试结果:")
-        print(resp)
-        print(resp.choices[0].message.content.strip())
-        print("✅ 模型连接成功")
-
         with open(prompt_template_path, "r", encoding="utf-8") as f:
             self.prompt_template = yaml.safe_load(f)
         self.backend = backend
+        self.concurrency = max(1, concurrency)
+        self.rate_limiter = RateLimiter(rpm)
+        self.llm_cache = llm_cache
+        if req_mode not in REQ_MODES:
+            raise ValueError(f"未知的需求文档生成方式: {req_mode}（可选 {', '.join(REQ_MODES)}）")
+        self.req_mode = req_mode
+        self.req_part_tokens = req_part_tokens
+        self.stream = stream
     
 
     def begin_file_gen(self):
@@ -66,32 +138,130 @@ class FileGenerator:
         print("需求文档:", self.req_file)
     
     def file_intention_extraction(self):
-        java_files = glob.glob(f"{self.src_proj_dir}/**/*.java", recursive=True)
+        # 排序保证 api_doc.md 中各文件的顺序固定，与并发完成的先后无关
+        java_files = sorted(glob.glob(f"{self.src_proj_dir}/**/*.java", recursive=True))
         # print(f"在src_dir: {self.src_proj_dir}共找到以下文件：{java_files}")
-        with open(self.api_file, "w", encoding="utf-8") as doc:
-            for idx, path in enumerate(java_files, 1):
-                rel_path = Path(path).relative_to(self.src_proj_dir)
-                print(f"正在处理文件 {idx}/{len(java_files)}: {rel_path}")
-                try:
-                    if "kimi" in self.model:
-                        with open(path, "r", encoding="utf-8") as f:
-                            code_txt = f.read()
-                        # code_txt = self.upload_and_extract_kimi(path, self.client)
-                        desc = self.describe_code(code_txt)
-                        print(desc)
-                    doc.write(f"{desc}\n\n")
-                except Exception as e:
-                    doc.write(f"> ⚠️ 解析失败：{e}\n\n")
+        total = len(java_files)
+
+        def describe_file(idx, path, on_text: Optional[Callable[[str], None]] = None) -> str:
+            """单个文件的接口文档；流式时正文已经依次交给 on_text，只返回还要写入的结尾"""
+            rel_path = Path(path).relative_to(self.src_proj_dir)
+            print(f"正在处理文件 {idx}/{total}: {rel_path}")
+            try:
+                if "kimi" not in self.model:
+                    raise ValueError(f"接口文档生成目前只支持 kimi 系列模型，当前为 {self.model}")
+                with open(path, "r", encoding="utf-8") as f:
+                    code_txt = f.read()
+                # code_txt = self.upload_and_extract_kimi(path, get_gateway().client)
+                desc = self.describe_code(code_txt, on_text=on_text)
+                if on_text is not None:
+                    return "\n\n"
+                print(desc)
+                return f"{desc}\n\n"
+            except Exception as e:
+                # 流式时正文可能已经写了一半，先换行再记失败
+                lead = "" if on_text is None else "\n"
+                return f"{lead}> ⚠️ 解析失败：{e}\n\n"
+
+        if self.stream:
+            if self.concurrency > 1:
+                print("[warn] 流式生成按顺序逐个文件写入接口文档，忽略 concurrency")
+            with open(self.api_file, "w", encoding="utf-8") as doc:
+                append = _appender(doc)
+                for idx, path in enumerate(java_files, 1):
+                    append(describe_file(idx, path, on_text=append))
+            print("✅ 接口文档已生成：", self.api_file)
+            return
+
+        # 最多 concurrency 个请求同时进行；按输入顺序依次写出，前面的文件没完成时后面的结果先在内存里等待
+        with open(self.api_file, "w", encoding="utf-8") as doc, \
+                ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            futures = [pool.submit(describe_file, idx, path) for idx, path in enumerate(java_files, 1)]
+            for fut in futures:
+                doc.write(fut.result())
+                doc.flush()
         print("✅ 接口文档已生成：", self.api_file)
     
     def req_extraction(self):
         print("开始反向生成需求描述")
-        with open(self.api_file, "r", encoding="utf-8") as f:
-            api_doc = f.read()
-        req_desc = self.describe_req(api_doc)
+        if self.req_mode == "map_reduce":
+            req_desc = self.req_map_reduce()
+        elif self.stream:
+            with open(self.api_file, "r", encoding="utf-8") as f:
+                api_doc = f.read()
+            with open(self.req_file, "w", encoding="utf-8") as f:
+                self.describe_req(api_doc, on_text=_appender(f))
+            return
+        else:
+            with open(self.api_file, "r", encoding="utf-8") as f:
+                api_doc = f.read()
+            req_desc = self.describe_req(api_doc)
         with open(self.req_file, "w", encoding="utf-8") as f:
             f.write(req_desc)
 
+    def split_api_doc(self) -> List[List[str]]:
+        """
+        接口文档按一级标题切成每个文件一节（PROMPT_API_GEN 要求每个文件以 "# 文件名" 开头），
+        由标题中的类名找到源文件所在的包，同一个包的节按顺序装进不超过 req_part_tokens 的部分
+        （单节超限时按行切开），按包的出现顺序返回每个包的部分列表；
+        标题里找不到类名的节归到前一节所在的包
+        """
+        packages: Dict[str, str] = {}
+        for path in glob.glob(f"{self.src_proj_dir}/**/*.java", recursive=True):
+            rel = Path(path).relative_to(self.src_proj_dir)
+            packages[rel.stem] = rel.parent.as_posix()
+        # 长类名优先匹配，避免 Foo 抢先匹配到 FooBar 的标题
+        patterns = [(re.compile(rf"(?<![A-Za-z0-9_$]){re.escape(stem)}(?![A-Za-z0-9_$])"), pkg)
+                    for stem, pkg in sorted(packages.items(), key=lambda kv: -len(kv[0]))]
+        sections: Dict[str, List[str]] = {}
+        current, lines = "", []
+
+        def flush():
+            text = "".join(lines).strip()
+            if text:
+                sections.setdefault(current, []).append(text)
+            lines.clear()
+
+        with open(self.api_file, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("# "):
+                    flush()
+                    current = next((pkg for pattern, pkg in patterns if pattern.search(line)), current)
+                lines.append(line)
+        flush()
+        return [["\n\n".join(group) for group in pack_parts(secs, self.req_part_tokens)]
+                for secs in sections.values()]
+
+    def req_map_reduce(self) -> str:
+        packages = self.split_api_doc()
+        parts = [part for pkg_parts in packages for part in pkg_parts]
+        print(f"接口文档切分为 {len(packages)} 个包、{len(parts)} 部分，分别生成需求文档")
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            results = iter(pool.map(self.describe_req_part, parts))
+            per_package = [[next(results) for _ in pkg_parts] for pkg_parts in packages]
+            # 先把每个包合并成一份，再按包的顺序合并；分组只看下标，不看文档长短，
+            # 某个包的文档变了，其他包（以及同一包里的其他分支）的合并结果仍能命中缓存
+            package_docs = [docs[0] for docs in self._merge_levels(pool, per_package, len(packages) == 1) if docs]
+            docs = self._merge_levels(pool, [package_docs], True)[0]
+        return docs[0] if docs else ""
+
+    def _merge_levels(self, pool: ThreadPoolExecutor, lists: List[List[str]], final: bool) -> List[List[str]]:
+        """
+        逐层合并每个列表，相邻 MERGE_FAN_IN 份一组，直到每个列表只剩一份；
+        final 表示这次合并出的唯一一份就是最终的需求文档
+        """
+        while any(len(docs) > 1 for docs in lists):
+            jobs = [(i, docs[j:j + MERGE_FAN_IN])
+                    for i, docs in enumerate(lists) for j in range(0, len(docs), MERGE_FAN_IN)]
+            print(f"合并 {sum(map(len, lists))} 份需求文档 → {len(jobs)} 份")
+            last = final and len(jobs) == 1
+            docs = pool.map(lambda group: self.merge_req(group, last), [group for _, group in jobs])
+            merged: List[List[str]] = [[] for _ in lists]
+            for (i, _), doc in zip(jobs, docs):
+                merged[i].append(doc)
+            lists = merged
+        return lists
+
     # 非纯文本文件，使用模型提取
     def upload_and_extract_kimi(file_path: str, client: OpenAI) -> str:
         """上传文件 -> 抽取内容 -> 返回可直接喂给模型的纯文本"""
@@ -101,32 +271,95 @@ class FileGenerator:
         client.files.delete(file_obj.id)
         return content
     
-    def describe_code(self, code: str) -> str:
+    def describe_code(self, code: str, on_text: Optional[Callable[[str], None]] = None) -> str:
 
-        """调用聊天接口，生成API描述"""
-        resp = self.client.chat.completions.create(
+        """调用聊天接口，生成API描述；给了 on_text 时流式请求，文本片段到达时依次传给 on_text"""
+        content = self._chat(
+            on_text,
             model=self.model,
             messages=[
                 {"role": "system", "content": self.prompt_template["PROMPT_API_GEN"]},
 
                 {"role": "user",   "content": f"```java\n{code}\n```"}
             ],
+            cache=self.llm_cache,
+            rate_limiter=self.rate_limiter,
             temperature=0.2,
             max_tokens=4096
         )
-        return resp.choices[0].message.content.strip()
+        return content.strip()
     
-    def describe_req(self, req: str) -> str:
+    def describe_req(self, req: str, on_text: Optional[Callable[[str], None]] = None) -> str:
         """调用 Kimi 聊天接口，生成需求描述"""
-        resp = self.client.chat.completions.create(
+        content = self._chat(
+            on_text,
             model=self.model,
             messages=[
                 {"role": "system", "content": self.prompt_template["PROMPT_REQ_GEN"]},
 
                 {"role": "user",   "content": f"{req}"}
             ],
+            cache=self.llm_cache,
+            rate_limiter=self.rate_limiter,
             temperature=0.9,
             max_tokens=49152
         )
-        return resp.choices[0].message.content.strip()
+        return content.strip()
+
+    @staticmethod
+    def _chat(on_text, **kwargs) -> str:
+        if on_text is None:
+            return complete(**kwargs)
+        return stream(on_text=on_text, **kwargs)
+
+    def merge_input_tokens(self) -> int:
+        """
+        每份待合并文档的 token 上限：MERGE_FAN_IN 份加上分隔符不超过 req_part_tokens；
+        map 步和中间合并的输出用它限制 max_tokens，输入从不截断，每次合并也都放得下
+        """
+        sep = approx_token_count(MERGE_SEP) * (MERGE_FAN_IN - 1)
+        return max(1, (self.req_part_tokens - sep) // MERGE_FAN_IN)
+
+    @staticmethod
+    def _length_hint(prompt: str, max_tokens: int) -> str:
+        """输出会参与合并时在系统提示词后注明长度上限，让模型自己压缩，而不是在 max_tokens 处被截断"""
+        return f"{prompt}\n\n输出控制在 {max_tokens} 个 token 以内，内容较多时合并相似的需求、精简描述，不要遗漏接口。"
+
+    def describe_req_part(self, part: str) -> str:
+        """map 步：一部分接口文档 → 这部分的需求文档"""
+        max_tokens = min(16384, self.merge_input_tokens())
+        content = complete(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": self._length_hint(self.prompt_template["PROMPT_REQ_GEN"], max_tokens)},
+                {"role": "user",   "content": part}
+            ],
+            cache=self.llm_cache,
+            rate_limiter=self.rate_limiter,
+            temperature=0.9,
+            max_tokens=max_tokens
+        )
+        return content.strip()
+
+    def merge_req(self, docs: List[str], final: bool = True) -> str:
+        """reduce 步：多份需求文档合并成一份；只有一份时原样返回。final 为 False 时输出还要参与下一次合并"""
+        if len(docs) == 1:
+            return docs[0]
+        prompt = self.prompt_template["PROMPT_REQ_MERGE"]
+        max_tokens = 49152
+        if not final:
+            max_tokens = min(max_tokens, self.merge_input_tokens())
+            prompt = self._length_hint(prompt, max_tokens)
+        content = complete(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": prompt},
+                {"role": "user",   "content": MERGE_SEP.join(docs)}
+            ],
+            cache=self.llm_cache,
+            rate_limiter=self.rate_limiter,
+            temperature=0.9,
+            max_tokens=max_tokens
+        )
+        return content.strip()
     
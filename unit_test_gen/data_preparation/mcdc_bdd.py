@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+基于约简有序 BDD（ROBDD）的 MC/DC 求解
+- 复用真值表引擎的编译结果，把 to_z3 的表达式构造成 BDD，变量序为 AT0 < AT1 < ...
+- unique-cause：对原子求布尔差分 f|a=1 XOR f|a=0，沿 BDD 取字典序最小的满足路径
+- masking：在 BDD 中找到测试该原子的节点，共享前缀，后缀在 f|a=1 ≠ f|a=0 的赋值里各取一条路径，
+  保证两个向量里原子都可观测；两个向量取值不同的其他原子都被屏蔽，路径上没有出现的原子填 False
+- 构造与求解受 MCDCBudget 限制（节点数 + 时间），超限时退化为随机采样并报告部分覆盖
+"""
+import time
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import z3
+
+from unit_test_gen.data_preparation.mcdc_truth_table import compile_expr, evaluate
+
+Pair = Tuple[Dict[str, bool], Dict[str, bool]]
+
+BDD_VERSION = 2     # 求解逻辑变化时递增，作废形状缓存里的旧结果
+
+_AND, _OR, _XOR = 0, 1, 2
+
+
+class BudgetExceeded(Exception):
+    """单个条件的 BDD 节点数或求解时间超出预算"""
+
+
+class MCDCBudget:
+    """
+    单个条件的求解预算
+    max_nodes : BDD 节点上限
+    time_limit: 秒，None 表示不限时
+    samples   : 超限后随机采样的赋值个数
+    """
+
+    def __init__(self, max_nodes: int = 200_000, time_limit: Optional[float] = 5.0, samples: int = 4096):
+        self.max_nodes = max_nodes
+        self.time_limit = time_limit
+        self.samples = samples
+        self._deadline = None
+
+    def start(self) -> "MCDCBudget":
+        self._deadline = None if self.time_limit is None else time.monotonic() + self.time_limit
+        return self
+
+    def expired(self) -> bool:
+        return self._deadline is not None and time.monotonic() > self._deadline
+
+    def check(self, nodes: int):
+        if nodes > self.max_nodes:
+            raise BudgetExceeded(f"BDD 节点数超过 {self.max_nodes}")
+        if self.expired():
+            raise BudgetExceeded(f"求解时间超过 {self.time_limit}s")
+
+
+# --------------------------------------------------
+# ROBDD：节点按 struct-of-arrays 存放，0/1 为终端
+# --------------------------------------------------
+class BDD:
+    __slots__ = ("num_vars", "var", "low", "high", "unique", "memo", "budget", "_ops")
+
+    def __init__(self, num_vars: int, budget: Optional[MCDCBudget] = None):
+        self.num_vars = num_vars
+        self.var = [num_vars, num_vars]     # 终端的层号排在所有变量之后
+        self.low = [0, 1]
+        self.high = [0, 1]
+        self.unique: Dict[Tuple[int, int, int], int] = {}
+        self.memo: Dict[tuple, int] = {}
+        self.budget = budget
+        self._ops = 0
+
+    def mk(self, v: int, lo: int, hi: int) -> int:
+        if lo == hi:
+            return lo
+        key = (v, lo, hi)
+        u = self.unique.get(key)
+        if u is None:
+            u = len(self.var)
+            self.var.append(v); self.low.append(lo); self.high.append(hi)
+            self.unique[key] = u
+        return u
+
+    def _tick(self):
+        self._ops += 1
+        if self.budget is not None and (self._ops & 0x3FF) == 0:
+            self.budget.check(len(self.var))
+
+    def apply(self, op: int, f: int, g: int) -> int:
+        if op == _AND:
+            if f == 0 or g == 0: return 0
+            if f == 1: return g
+            if g == 1 or f == g: return f
+        elif op == _OR:
+            if f == 1 or g == 1: return 1
+            if f == 0: return g
+            if g == 0 or f == g: return f
+        else:
+            if f == 0: return g
+            if g == 0: return f
+            if f == g: return 0
+            if f == 1 and g == 1: return 0
+        if f > g:
+            f, g = g, f                     # 三种运算都可交换
+        key = (op, f, g)
+        r = self.memo.get(key)
+        if r is not None:
+            return r
+        self._tick()
+        v = min(self.var[f], self.var[g])
+        f0, f1 = (self.low[f], self.high[f]) if self.var[f] == v else (f, f)
+        g0, g1 = (self.low[g], self.high[g]) if self.var[g] == v else (g, g)
+        r = self.mk(v, self.apply(op, f0, g0), self.apply(op, f1, g1))
+        self.memo[key] = r
+        return r
+
+    def neg(self, f: int) -> int:
+        return self.apply(_XOR, f, 1)
+
+    def restrict(self, f: int, v: int, val: bool) -> int:
+        key = ("r", f, v, val)
+        r = self.memo.get(key)
+        if r is not None:
+            return r
+        fv = self.var[f]
+        if fv > v:
+            r = f
+        elif fv == v:
+            r = self.high[f] if val else self.low[f]
+        else:
+            self._tick()
+            r = self.mk(fv, self.restrict(self.low[f], v, val), self.restrict(self.high[f], v, val))
+        self.memo[key] = r
+        return r
+
+    def build(self, program: List[Tuple[str, tuple]]) -> int:
+        regs: List[int] = []
+        for op, args in program:
+            if op == "var":
+                r = self.mk(args[0], 0, 1)
+            elif op == "const":
+                r = 1 if args[0] else 0
+            elif op == "not":
+                r = self.neg(regs[args[0]])
+            elif op in ("and", "or", "xor"):
+                code = {"and": _AND, "or": _OR, "xor": _XOR}[op]
+                r = regs[args[0]]
+                for a in args[1:]:
+                    r = self.apply(code, r, regs[a])
+            elif op == "implies":
+                r = self.apply(_OR, self.neg(regs[args[0]]), regs[args[1]])
+            elif op == "ite":
+                c = regs[args[0]]
+                r = self.apply(_OR, self.apply(_AND, c, regs[args[1]]),
+                               self.apply(_AND, self.neg(c), regs[args[2]]))
+            else:   # iff
+                r = self.neg(self.apply(_XOR, regs[args[0]], regs[args[1]]))
+            regs.append(r)
+        return regs[-1]
+
+    # ------------------------------------------
+    # 按字典序（AT0 为最高位，False 在前）枚举满足赋值，skip 层固定为 False
+    # ------------------------------------------
+    def sat_assignments(self, f: int, skip: int, limit: int) -> Iterator[List[bool]]:
+        n = self.num_vars
+        vals = [False] * n
+        stack = [(f, 0, None)]
+        found = 0
+        while stack and found < limit:
+            u, level, choice = stack.pop()
+            if u == 0:
+                continue
+            if choice is not None:
+                vals[level - 1] = choice
+            if level == n:
+                found += 1
+                yield list(vals)
+                continue
+            if level == skip:
+                stack.append((u, level + 1, False))
+                continue
+            if self.var[u] == level:
+                lo, hi = self.low[u], self.high[u]
+            else:
+                lo = hi = u
+            stack.append((hi, level + 1, True))
+            stack.append((lo, level + 1, False))
+
+    def path_to(self, u: int, t: int, out: Dict[int, bool], prefer: bool = False):
+        """
+        从节点 u 走到终端 t，把经过的变量取值写入 out（优先 prefer 分支）；
+        约简后的非终端节点必然能到达两个终端，所以走非终端子节点总能到 t
+        """
+        while u > 1:
+            first, second = (self.high[u], self.low[u]) if prefer else (self.low[u], self.high[u])
+            if first == t or first > 1:
+                out[self.var[u]] = prefer
+                u = first
+            else:
+                out[self.var[u]] = not prefer
+                u = second
+
+
+# --------------------------------------------------
+# BDD 上求独立影响对
+# --------------------------------------------------
+def _ctx(var_names: Sequence[str], fixed: Dict[int, bool]) -> Dict[str, bool]:
+    return {name: fixed.get(i, False) for i, name in enumerate(var_names)}
+
+
+def _unique_cause(bdd: BDD, f: int, var_names: Sequence[str], i: int, max_pairs: int) -> List[Pair]:
+    diff = bdd.apply(_XOR, bdd.restrict(f, i, True), bdd.restrict(f, i, False))
+    pairs = []
+    for vals in bdd.sat_assignments(diff, i, max_pairs):
+        ctx_false = dict(zip(var_names, vals))
+        pairs.append(({**ctx_false, var_names[i]: True}, ctx_false))
+    return pairs
+
+
+def _masking(bdd: BDD, f: int, var_names: Sequence[str], i: int, max_pairs: int) -> List[Pair]:
+    # 原子 i 在某个赋值下可观测 ⇔ f|i=1 ≠ f|i=0；两个向量的其余原子都要落在
+    # f|i=1 ∧ ¬f|i=0（i 为真时结果为真）或 f|i=0 ∧ ¬f|i=1（i 为真时结果为假）里，
+    # 这样两个向量里变化的其他原子都被屏蔽，结果只由原子 i 决定
+    f1, f0 = bdd.restrict(f, i, True), bdd.restrict(f, i, False)
+    sides = (bdd.apply(_AND, f1, bdd.neg(f0)), bdd.apply(_AND, f0, bdd.neg(f1)))
+    # BFS 找测试原子 i 的节点，前缀取最短路径，前缀之外排在 i 之前的原子填 False
+    pairs: List[Pair] = []
+    queue = [(f, {})]
+    seen = {f}
+    while queue and len(pairs) < max_pairs:
+        nxt = []
+        for u, prefix in queue:
+            v = bdd.var[u]
+            if v == i:
+                for side in sides:
+                    g = side
+                    for j in range(i):
+                        g = bdd.restrict(g, j, prefix.get(j, False))
+                    if g == 0:
+                        continue
+                    # 共享前缀，后缀在可观测的赋值里各取一条路径，True 向量优先高分支，
+                    # 尽量让被屏蔽的原子在两个向量里取不同的值
+                    a, b = dict(prefix), dict(prefix)
+                    a[i] = False; bdd.path_to(g, 1, a)
+                    b[i] = True;  bdd.path_to(g, 1, b, prefer=True)
+                    pair = (_ctx(var_names, b), _ctx(var_names, a))
+                    if pair not in pairs:
+                        pairs.append(pair)
+                    break
+                if len(pairs) >= max_pairs:
+                    break
+                continue
+            if v > i:
+                continue                    # 变量序保证更深处不会再测试原子 i
+            for child, val in ((bdd.low[u], False), (bdd.high[u], True)):
+                if child > 1 and child not in seen:
+                    seen.add(child)
+                    nxt.append((child, {**prefix, v: val}))
+        queue = nxt
+    return pairs
+
+
+def bdd_independence_pairs(z3_expr: z3.BoolRef, var_names: Sequence[str],
+                           mcdc_type: str = "unique",
+                           budget: Optional[MCDCBudget] = None,
+                           max_pairs: int = 1) -> Tuple[Dict[str, List[Pair]], bool, str]:
+    """
+    返回 (pairs, complete, reason)
+    complete 为 False 时 pairs 只包含预算内找到的部分原子，reason 说明原因
+    """
+    budget = (budget or MCDCBudget()).start()
+    program = compile_expr(z3_expr, var_names)
+    finder = _masking if mcdc_type == "masking" else _unique_cause
+
+    pairs: Dict[str, List[Pair]] = {}
+    try:
+        bdd = BDD(len(var_names), budget)
+        f = bdd.build(program)
+        for i, a in enumerate(var_names):
+            budget.check(len(bdd.var))
+            pairs[a] = finder(bdd, f, var_names, i, max_pairs)
+        return pairs, True, ""
+    except BudgetExceeded as e:
+        reason = str(e)
+    # 预算耗尽：对还没处理的原子退化为随机采样
+    todo = [a for a in var_names if a not in pairs]
+    pairs.update(sampled_independence_pairs(program, var_names, todo, budget))
+    return pairs, False, reason
+
+
+# --------------------------------------------------
+# 退化模式：随机采样若干赋值，逐个翻转原子看结果是否改变
+# --------------------------------------------------
+def sampled_independence_pairs(program: List[Tuple[str, tuple]], var_names: Sequence[str],
+                               todo: Sequence[str], budget: MCDCBudget,
+                               seed: int = 0) -> Dict[str, List[Pair]]:
+    rng = np.random.default_rng(seed)
+    nbytes = max(1, budget.samples >> 3)
+    columns = [rng.integers(0, 256, nbytes, dtype=np.uint8) for _ in var_names]
+    base = evaluate(program, columns, nbytes)
+    index = {a: i for i, a in enumerate(var_names)}
+
+    pairs: Dict[str, List[Pair]] = {}
+    for a in todo:
+        i = index[a]
+        flipped = list(columns)
+        flipped[i] = np.invert(columns[i])
+        diff = base ^ evaluate(program, flipped, nbytes)
+        nz = np.flatnonzero(diff)
+        if nz.size == 0:
+            pairs[a] = []
+            continue
+        byte = int(nz[0])
+        bit = (int(diff[byte]) & -int(diff[byte])).bit_length() - 1
+        ctx = {name: bool((int(columns[m][byte]) >> bit) & 1) for m, name in enumerate(var_names)}
+        pairs[a] = [({**ctx, a: True}, {**ctx, a: False})]
+    return pairs
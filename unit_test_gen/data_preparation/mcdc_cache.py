@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+MC/DC 结果缓存
+- 以 Z3 表达式的结构形状为键：to_z3 已把原子按出现顺序重命名为 AT0..ATn，
+  因此 `x == null || x.isEmpty()` 与 `s == null || s.isEmpty()` 共享同一条缓存
+- 内存中 LRU 淘汰，磁盘上用 SQLite 持久化（默认 mcdc_output/mcdc_cache.sqlite）
+- 只缓存预算内完整求解的结果，部分覆盖的结果与预算/时间相关，不落盘
+"""
+import hashlib
+import json
+import os
+import sqlite3
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import z3
+
+DEFAULT_CACHE_PATH = Path(__file__).resolve().parent / "mcdc_output" / "mcdc_cache.sqlite"
+
+
+def shape_key(z3_expr: z3.BoolRef, num_atoms: int, *config: Any) -> str:
+    """结构形状 + 求解配置 → 缓存键"""
+    raw = "|".join([str(num_atoms), *map(str, config), z3_expr.sexpr()])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class MCDCCache:
+    def __init__(self, path: Optional[Path] = DEFAULT_CACHE_PATH, capacity: int = 4096):
+        '''
+        path: SQLite 文件路径，None 表示只用内存
+        capacity: 内存 LRU 的条目上限
+        '''
+        self.capacity = capacity
+        self._lru: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._db = None
+        if path is not None:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            # 多进程并发写时等待锁，WAL 模式下读写互不阻塞
+            self._db = sqlite3.connect(str(path), timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS mcdc_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._db.commit()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self._lru.get(key)
+        if value is not None:
+            self._lru.move_to_end(key)
+            return value
+        if self._db is None:
+            return None
+        row = self._db.execute("SELECT value FROM mcdc_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value = json.loads(row[0])
+        self._remember(key, value)
+        return value
+
+    def put(self, key: str, value: Dict[str, Any]):
+        self._remember(key, value)
+        if self._db is not None:
+            self._db.execute("INSERT OR REPLACE INTO mcdc_cache (key, value) VALUES (?, ?)",
+                             (key, json.dumps(value, ensure_ascii=False)))
+            self._db.commit()
+
+    def _remember(self, key: str, value: Dict[str, Any]):
+        self._lru[key] = value
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.capacity:
+            self._lru.popitem(last=False)
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+_DEFAULT_CACHE: Optional[MCDCCache] = None
+_DEFAULT_PID: Optional[int] = None
+
+
+def get_mcdc_cache() -> MCDCCache:
+    """进程内共享的默认缓存；fork 出的子进程不能复用父进程的 SQLite 连接，需重新打开"""
+    global _DEFAULT_CACHE, _DEFAULT_PID
+    if _DEFAULT_CACHE is None or _DEFAULT_PID != os.getpid():
+        _DEFAULT_CACHE = MCDCCache()
+        _DEFAULT_PID = os.getpid()
+    return _DEFAULT_CACHE
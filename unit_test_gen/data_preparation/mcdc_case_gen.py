@@ -4,184 +4,160 @@
 - 把条件节点拆成原子条件
 - 把 Java 条件转成 Z3 布尔表达式
 - 利用Z3求解器在CFG上枚举 MCDC 100 % 输入
-- 输出 JSON + .dot 图
+- 按方法流式输出 JSON / NDJSON / 二进制结果，可选导出 .dot 图
 """
+import hashlib
 import json
+import logging
+import os
 import re
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from collections import defaultdict, deque
 from pathlib import Path
-from typing import List, Dict, Any, Tuple, Set, Optional
+from typing import List, Dict, Any, Tuple, Set, Optional, Callable
 from tree_sitter import Language, Parser, Node
 import tree_sitter_java as tsjava
-import javalang
-from javalang import tree
 import z3
-from anytree import Node as ANode, RenderTree, PreOrderIter
 import argparse
-from anytree.exporter import DotExporter
+import itertools
+from unit_test_gen.data_preparation.mcdc_truth_table import independence_pairs, UnsupportedExpr, MAX_TRUTH_TABLE_ATOMS
+from unit_test_gen.data_preparation.mcdc_bdd import BDD_VERSION, bdd_independence_pairs, MCDCBudget
+from unit_test_gen.data_preparation.mcdc_cache import MCDCCache, get_mcdc_cache, shape_key
+from unit_test_gen.data_preparation.mcdc_cfg import CFG, CFG_VERSION, build_cfg as _build_cfg
+from unit_test_gen.data_preparation.mcdc_select import select_vectors, first_pair_vectors
+from unit_test_gen.data_preparation.mcdc_concrete import ConcreteSynthesizer, declared_types, fields_hash
+from unit_test_gen.data_preparation.mcdc_writer import MCDC_FORMATS, SummaryWriter, load_summary, summary_path
+
+logger = logging.getLogger(__name__)
+MCDC_OUTPUT_DIR = Path(__file__).resolve().parent / "mcdc_output"
 
 # --------------------------------------------------
 # AST 遍历：找到树中所有函数体
 # --------------------------------------------------
+def method_key(method: Node, code: bytes) -> str:
+    """方法名 + 参数类型列表，如 add(int,double[])，区分重载；类型去掉空白，不含注解和参数名"""
+    name = method.child_by_field_name("name")
+    types = []
+    params = method.child_by_field_name("parameters")
+    for p in (params.named_children if params is not None else []):
+        if p.type == "formal_parameter":
+            t = p.child_by_field_name("type")
+            dims = p.child_by_field_name("dimensions")          # int a[] 与 int[] a 视为同一类型
+            text = code[t.start_byte:t.end_byte].decode() + (code[dims.start_byte:dims.end_byte].decode() if dims else "")
+        elif p.type == "spread_parameter":
+            t = next(c for c in p.named_children if c.type not in ("modifiers", "variable_declarator"))
+            text = code[t.start_byte:t.end_byte].decode() + "..."
+        else:                                                   # receiver_parameter 不算参数
+            continue
+        types.append(re.sub(r"\s+", "", text))
+    return f"{code[name.start_byte:name.end_byte].decode()}({','.join(types)})"
+
+
 def all_methods(root: Node, code: bytes) -> List[Tuple[str, Node]]:
+    """返回 [(方法键, 方法体)]，方法键见 method_key；不同内部类中键相同的方法依次加 #2、#3 后缀"""
     methods = []
-
-    def walk(n: Node):
+    seen: Dict[str, int] = {}
+    stack = [root]
+    while stack:
+        n = stack.pop()
         if n.type == "method_declaration":
-            name = n.child_by_field_name("name")
-            sig = code[name.start_byte:name.end_byte].decode()
             body = n.child_by_field_name("body")
             if body:
-                methods.append((sig, body))
-        for c in n.children:
-            walk(c)
-
-    walk(root)
+                key = method_key(n, code)
+                seen[key] = seen.get(key, 0) + 1
+                methods.append((key if seen[key] == 1 else f"{key}#{seen[key]}", body))
+        stack.extend(reversed(n.children))
     return methods
 
-# --------------------------------------------------
-# 条件表达式收集（含短路处理）
-# --------------------------------------------------
-def collect_conditions_with_position(node: Node, code: bytes):
-    """
-    返回 (条件字符串, 起始字节, 结束字节)
-    会递归进入 && / ||，找到所有原子条件
-    """
-    conds = []
-
-    def walk(n: Node):
-        if n.type in {"if_statement", "while_statement", "do_statement"}:
-            cond = n.child_by_field_name("condition")
-            if cond:
-                conds.append((code[cond.start_byte:cond.end_byte].decode(),
-                              cond.start_byte, cond.end_byte))
-        elif n.type == "for_statement":
-            cond = n.child_by_field_name("condition")
-            if cond:
-                conds.append((code[cond.start_byte:cond.end_byte].decode(),
-                              cond.start_byte, cond.end_byte))
-        elif n.type == "conditional_expression":
-            cond = n.child_by_field_name("condition")
-            if cond:
-                conds.append((code[cond.start_byte:cond.end_byte].decode(),
-                              cond.start_byte, cond.end_byte))
-        elif n.type in {"binary_expression", "parenthesized_expression"}:
-            # 继续深入找 &&/||
-            for c in n.children:
-                walk(c)
-        for c in n.children:
-            walk(c)
-
-    walk(node)
-    return conds
-
-# --------------------------------------------------
-# CFG 节点定义
-# --------------------------------------------------
-class CFGNode:
-    _id = 0
-
-    def __init__(self, label: str = "", cond: str = "", parent = None):
-        self.id   = CFGNode._id; CFGNode._id += 1
-        self.label = label
-        self.cond  = cond
-        self.succ  : List[Tuple[str, CFGNode]] = []   # (edge_label, node)
-        self.mcdc_inputs : List[Dict[str, bool]] = []
-        self.parent = parent
-    
-    @property
-    def children(self):
-        return [n for _, n in self.succ]
-
-    def add_succ(self, label: str, node: "CFGNode"):
-        self.succ.append((label, node))
-
-    def to_dot(self):
-        lines = [f'{self.id} [label="{self.label}\\n{self.cond}"]']
-        for lab, nxt in self.succ:
-            lines.append(f'{self.id} -> {nxt.id} [label="{lab}"]')
-        return lines
-
 # --------------------------------------------------
 # 把 Java 条件转成 Z3 布尔表达式 + 原子，原子用于MCDC 求解
-# --------------------------------------------------
-
-
-# 把 AST 节点还原成源码片段（去掉多余空格）
-def _node_src(expr: str, node) -> str:
-    if node.position is None:
-        return str(node)
-    start, end = node.position
-    return expr[start:end].strip()
-
-# --------------------------------------------------
-# 把 Java 条件表达式 →  Z3 布尔表达式
+# 直接在 tree-sitter 语法树上转换：&& / || / ! / 三目 / 括号展开，其余子式整体作为原子
 # 返回值:
 #   z3_expr : z3.BoolRef        例如 Or(AT0, AT1, AT2)
-#   atoms   : List[str]         例如 ['point.getLatitude()==Double.NaN', ...]
+#   atoms   : List[str]         例如 ['point.getLatitude() == Double.NaN', ...]
 #   z3_vars : Dict[str, Bool]   例如 {'AT0': Bool('AT0'), 'AT1': ...}
 # --------------------------------------------------
-def to_z3(expr: str) -> Tuple[z3.BoolRef, List[str], Dict[str, z3.BoolRef]]:
-    # 1. 先收集所有需要独立成原子的布尔子式
-    def collect_atoms(node) -> List[str]:
-        atoms = []
-        if isinstance(node, tree.BinaryOperation) and node.operator in {"==", "!=", "<", "<=", ">", ">="}:
-            atoms.append(_node_src(expr, node))
-        # elif isinstance(node, tree.UnaryExpression) and node.operator == "!":
-        #     atoms.extend(collect_atoms(node.operand))
-        elif isinstance(node, tree.BinaryOperation) and node.operator in {"&&", "||"}:
-            atoms.extend(collect_atoms(node.operandl))
-            atoms.extend(collect_atoms(node.operandr))
-        elif isinstance(node, tree.TernaryExpression):
-            atoms.extend(collect_atoms(node.expression))
-        else:
-            # 其它表达式整体当成一个原子
-            atoms.append(_node_src(expr, node))
-        return atoms
+_TERNARY_TYPES = {"ternary_expression", "conditional_expression"}
+
+
+def _bool_structure(n: Node) -> Tuple[str, List[Node]]:
+    """返回 (运算, 子节点)；运算为 atom 时该节点整体作为原子"""
+    t = n.type
+    if t == "parenthesized_expression" and n.named_child_count == 1:
+        return "paren", [n.named_children[0]]
+    if t == "binary_expression":
+        op = n.child_by_field_name("operator").type
+        if op in ("&&", "||"):
+            # 左结合的同一运算符链展平成一个 n 元 And / Or
+            rights = []
+            cur = n
+            while cur.type == "binary_expression" and cur.child_by_field_name("operator").type == op:
+                rights.append(cur.child_by_field_name("right"))
+                cur = cur.child_by_field_name("left")
+            return op, [cur] + rights[::-1]
+    if t == "unary_expression" and n.child_by_field_name("operator").type == "!":
+        return "!", [n.child_by_field_name("operand")]
+    if t in _TERNARY_TYPES:
+        return "?:", [n.child_by_field_name(f) for f in ("condition", "consequence", "alternative")]
+    if t in ("true", "false"):
+        return t, []
+    return "atom", []
+
+
+def ts_to_z3(node: Node, code: bytes) -> Tuple[z3.BoolRef, List[str], Dict[str, z3.BoolRef]]:
+    atoms: List[str] = []
+    z3_vars: Dict[str, z3.BoolRef] = {}
+    atom2z3: Dict[str, z3.BoolRef] = {}
+
+    # 后序遍历（显式栈），原子按从左到右的出现顺序编号，相同源码共用一个原子
+    values: List[z3.BoolRef] = []
+    stack = [(node, None, None)]
+    while stack:
+        n, op, kids = stack.pop()
+        if op is None:
+            op, kids = _bool_structure(n)
+            if op == "atom":
+                text = code[n.start_byte:n.end_byte].decode().strip()
+                if text not in atom2z3:
+                    name = f"AT{len(atoms)}"
+                    atoms.append(text)
+                    z3_vars[name] = atom2z3[text] = z3.Bool(name)
+                values.append(atom2z3[text])
+            elif op in ("true", "false"):
+                values.append(z3.BoolVal(op == "true"))
+            else:
+                stack.append((n, op, kids))
+                stack.extend((k, None, None) for k in reversed(kids))
+            continue
 
-    try:
-        ast = javalang.parse.parse_expression(expr)
-    except Exception:
-        # 容错：解析失败就把整个表达式当成一个原子
-        atoms = [expr.strip()]
-    else:
-        # 去重并保持出现顺序
-        atoms = list(dict.fromkeys(collect_atoms(ast)))
-
-    # 2. 建立变量映射 AT0, AT1, ...
-    z3_vars = {f"AT{i}": z3.Bool(f"AT{i}") for i in range(len(atoms))}
-    atom2z3 = {atom: z3_vars[f"AT{i}"] for i, atom in enumerate(atoms)}
-
-    # 3. 递归生成 Z3 表达式
-    def walk(node) -> z3.BoolRef:
-        if isinstance(node, tree.BinaryOperation):
-            if node.operator in {"&&", "||"}:
-                left, right = walk(node.operandl), walk(node.operandr)
-                return z3.And(left, right) if node.operator == "&&" else z3.Or(left, right)
-            elif node.operator in {"==", "!=", "<", "<=", ">", ">="}:
-                return atom2z3[_node_src(expr, node)]
-        # if isinstance(node, tree.UnaryOperation) and node.operator == "!":
-        #     return z3.Not(walk(node.operand))
-        if isinstance(node, tree.TernaryExpression):
-            return walk(node.expression)
-        # 其它节点 → 原子
-        return atom2z3[_node_src(expr, node)]
-
-    # 如果解析失败直接返回单个原子
-    if not atoms:
-        atoms = [expr.strip()]
-        z3_vars = {"AT0": z3.Bool("AT0")}
-        return z3_vars["AT0"], atoms, z3_vars
+        args = values[len(values) - len(kids):]
+        del values[len(values) - len(kids):]
+        if op == "&&":
+            values.append(z3.And(*args))
+        elif op == "||":
+            values.append(z3.Or(*args))
+        elif op == "!":
+            values.append(z3.Not(args[0]))
+        elif op == "?:":
+            values.append(z3.If(*args))
+        else:   # paren
+            values.append(args[0])
+
+    return values[0], atoms, z3_vars
 
-    try:
-        z3_expr = walk(ast)
-    except Exception:
-        # 兜底：把整个表达式当成一个原子
-        z3_expr = z3_vars["AT0"]
 
-    print(f"[debug] to_z3 called, expr={expr},\n atoms={atoms},\n z3_vars={z3_vars}")
-    return z3_expr, atoms, z3_vars
+def to_z3(expr: str) -> Tuple[z3.BoolRef, List[str], Dict[str, z3.BoolRef]]:
+    """条件字符串版本：把表达式当作顶层语句交给 tree-sitter 解析后再转换"""
+    code = f"{expr};".encode()
+    root = get_parser().parse(code).root_node
+    stmt = root.named_children[0] if root.named_child_count else None
+    if stmt is None or stmt.type != "expression_statement" or not stmt.named_child_count:
+        logger.warning("无法解析条件，整体作为单个原子: %s", expr)
+        z3_vars = {"AT0": z3.Bool("AT0")}
+        return z3_vars["AT0"], [expr.strip()], z3_vars
+    return ts_to_z3(stmt.named_children[0], code)
 
 
 
@@ -190,47 +166,162 @@ def to_z3(expr: str) -> Tuple[z3.BoolRef, List[str], Dict[str, z3.BoolRef]]:
 # 在 CFG 上枚举 MCDC
 # --------------------------------------------------
 
-def mcdc_on_cfg(root: CFGNode) -> Dict[int, List[Dict[str, bool]]]:
+def mcdc_on_cfg(cfg: CFG, solver: str = "auto", mcdc_type: str = "unique",
+                budget: Optional[MCDCBudget] = None,
+                cache: Optional[MCDCCache] = None, max_pairs: int = 1) -> Dict[int, "MCDCResult"]:
+    # 建 CFG 时已从语法树转换好的条件直接求解，不再回到字符串重新解析
     result = {}
-    visited = set()
-
-    def dfs(n: CFGNode):
-        if n in visited or not n.cond:
-            return
-        visited.add(n)
-        result[n.id] = mcdc_full(n.cond)
-        for _, nxt in n.succ:
-            dfs(nxt)
-
-    # 从 root 开始 DFS，但 root 可能是 entry，所以需要遍历所有节点
-    nodes_to_visit = [root]
-    seen_nodes = set()
-    while nodes_to_visit:
-        cur = nodes_to_visit.pop()
-        if cur in seen_nodes:
-            continue
-        seen_nodes.add(cur)
-        if cur.cond:                       # 只在有 cond 的节点上计算
-            result[cur.id] = mcdc_full(cur.cond)
-        for _, child in cur.succ:
-            if child not in seen_nodes:
-                nodes_to_visit.append(child)
+    for i in cfg.cond_ids():
+        if i in cfg.z3_cond:
+            z3_expr, _, z3_vars = cfg.z3_cond[i]
+            result[i] = mcdc_solve_z3(z3_expr, z3_vars, solver, mcdc_type, budget, cache, max_pairs)
+        else:
+            result[i] = mcdc_solve(cfg.cond[i], solver, mcdc_type, budget, cache, max_pairs)
     return result
 
+# --------------------------------------------------
+# 单条条件的求解结果
+# pairs    : {原子: [(原子取 True 的赋值, 原子取 False 的赋值), ...]}，每个原子可有多个候选对
+# complete : 预算内是否处理完所有原子
+# --------------------------------------------------
+class MCDCResult:
+    __slots__ = ("atoms", "pairs", "solver", "complete", "reason")
+
+    def __init__(self, atoms: List[str], pairs: Dict[str, List[Tuple[Dict[str, bool], Dict[str, bool]]]],
+                 solver: str, complete: bool = True, reason: str = ""):
+        self.atoms = atoms
+        self.pairs = pairs
+        self.solver = solver
+        self.complete = complete
+        self.reason = reason
+
+    def vectors(self) -> List[Dict[str, bool]]:
+        tests = [ctx for found in self.pairs.values() for pair in found for ctx in pair]
+        # 去重（排序保证输出稳定）
+        seen = set(tuple(sorted(d.items())) for d in tests)
+        return [dict(t) for t in sorted(seen)]
+
+    def minimal_vectors(self) -> List[Dict[str, bool]]:
+        """在候选对中挑出仍能覆盖所有原子的最少向量（见 mcdc_select）"""
+        return select_vectors(self.pairs, self.atoms)
+
+    def first_vectors(self) -> List[Dict[str, bool]]:
+        """每个原子只取第一组独立影响对时的向量，作为精简前的基准"""
+        return first_pair_vectors(self.pairs, self.atoms)
+
+    def coverage(self) -> Dict[str, Any]:
+        info = {
+            "solver": self.solver,
+            "covered": sum(1 for a in self.atoms if self.pairs.get(a)),
+            "total": len(self.atoms),
+            "complete": self.complete,
+        }
+        if self.reason:
+            info["reason"] = self.reason
+        return info
+
+    def to_json(self) -> Dict[str, Any]:
+        return {"atoms": self.atoms, "pairs": self.pairs, "solver": self.solver}
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "MCDCResult":
+        pairs = {a: [tuple(p) for p in found] for a, found in data["pairs"].items()}
+        return cls(data["atoms"], pairs, data["solver"])
+
 # --------------------------------------------------
 # 单条布尔表达式的完整 MCDC 用例
+# solver:
+#   auto        原子数不超过 MCDC_AUTO_TT_ATOMS 时走真值表，否则走 BDD
+#   truth_table 位并行真值表（超过 MAX_TRUTH_TABLE_ATOMS 时改走 BDD）
+#   bdd         约简有序 BDD，支持 masking MC/DC 和预算退化
+#   z3          逐个赋值调用 Z3（表达式无法编译时所有模式都回退到这里）
 # --------------------------------------------------
-import itertools
-def mcdc_full(expr: str) -> List[Dict[str, bool]]:
+MCDC_SOLVERS = ("auto", "truth_table", "bdd", "z3")
+MCDC_TYPES = ("unique", "masking")
+# 支持 masking MC/DC 的求解引擎（auto 在 masking 时总是选 BDD）
+MASKING_SOLVERS = ("auto", "bdd")
+MCDC_AUTO_TT_ATOMS = 16
+# 精简测试向量时每个原子最多取的候选独立影响对个数
+MCDC_CANDIDATE_PAIRS = 64
+
+
+def check_solver(solver: str, mcdc_type: str):
+    """求解引擎与 MC/DC 类型不匹配时报错，不静默退回 unique-cause"""
+    if solver not in MCDC_SOLVERS:
+        raise ValueError(f"未知的 MC/DC 求解引擎: {solver}（可选 {', '.join(MCDC_SOLVERS)}）")
+    if mcdc_type not in MCDC_TYPES:
+        raise ValueError(f"未知的 MC/DC 类型: {mcdc_type}（可选 {', '.join(MCDC_TYPES)}）")
+    if mcdc_type == "masking" and solver not in MASKING_SOLVERS:
+        raise ValueError(f"求解引擎 {solver} 不支持 masking MC/DC，请使用 {' / '.join(MASKING_SOLVERS)}")
+
+
+def mcdc_full(expr: str, solver: str = "auto", mcdc_type: str = "unique",
+              budget: Optional[MCDCBudget] = None) -> List[Dict[str, bool]]:
+    return mcdc_solve(expr, solver, mcdc_type, budget).vectors()
+
+
+def mcdc_solve(expr: str, solver: str = "auto", mcdc_type: str = "unique",
+               budget: Optional[MCDCBudget] = None,
+               cache: Optional[MCDCCache] = None, max_pairs: int = 1) -> MCDCResult:
     z3_expr, atoms, z3_vars = to_z3(expr)
+    return mcdc_solve_z3(z3_expr, z3_vars, solver, mcdc_type, budget, cache, max_pairs)
+
+
+def mcdc_solve_z3(z3_expr: z3.BoolRef, z3_vars: Dict[str, z3.BoolRef], solver: str = "auto",
+                  mcdc_type: str = "unique", budget: Optional[MCDCBudget] = None,
+                  cache: Optional[MCDCCache] = None, max_pairs: int = 1) -> MCDCResult:
+    check_solver(solver, mcdc_type)
     var_names = list(z3_vars.keys())
     if not var_names:
-        return []
+        return MCDCResult([], {}, solver)
+    if cache is None:
+        return _mcdc_solve_uncached(z3_expr, z3_vars, solver, mcdc_type, budget, max_pairs)
+
+    # 相同形状的条件（原子已重命名为 AT0..ATn）直接复用缓存结果
+    key = shape_key(z3_expr, len(var_names), solver, mcdc_type, max_pairs, f"bdd{BDD_VERSION}")
+    hit = cache.get(key)
+    if hit is not None:
+        return MCDCResult.from_json(hit)
+    res = _mcdc_solve_uncached(z3_expr, z3_vars, solver, mcdc_type, budget, max_pairs)
+    if res.complete:
+        cache.put(key, res.to_json())
+    return res
+
+
+def _mcdc_solve_uncached(z3_expr: z3.BoolRef, z3_vars: Dict[str, z3.BoolRef], solver: str,
+                         mcdc_type: str, budget: Optional[MCDCBudget], max_pairs: int = 1) -> MCDCResult:
+    var_names = list(z3_vars.keys())
 
-    tests: List[Dict[str, bool]] = []
+    if solver == "auto":
+        small = len(var_names) <= MCDC_AUTO_TT_ATOMS
+        solver = "truth_table" if small and mcdc_type == "unique" else "bdd"
+    try:
+        if solver == "truth_table" and len(var_names) <= MAX_TRUTH_TABLE_ATOMS:
+            return MCDCResult(var_names, independence_pairs(z3_expr, var_names, max_pairs), "truth_table")
+        if solver in ("truth_table", "bdd"):
+            pairs, complete, reason = bdd_independence_pairs(z3_expr, var_names, mcdc_type, budget, max_pairs)
+            return MCDCResult(var_names, pairs, "bdd", complete, reason)
+    except UnsupportedExpr:
+        if mcdc_type == "masking":
+            # unique-cause 的独立影响对同样满足 masking 的要求，只是向量可能更多
+            logger.warning("条件无法编译为 BDD，masking MC/DC 改用 Z3 求 unique-cause 独立影响对")
+    pairs, complete, reason = _independence_pairs_z3(z3_expr, z3_vars, budget)
+    return MCDCResult(var_names, pairs, "z3", complete, reason)
+
+
+def _independence_pairs_z3(z3_expr: z3.BoolRef, z3_vars: Dict[str, z3.BoolRef],
+                           budget: Optional[MCDCBudget] = None):
+    """Z3 逐个赋值求解，每个原子找到第一组独立影响对即停止；超出时间预算时返回已找到的部分"""
+    var_names = list(z3_vars.keys())
+    pairs = {}
+    if budget is not None:
+        budget.start()
 
     # 对每个原子变量做独立影响对
     for a in var_names:
+        if budget is not None and budget.expired():
+            return pairs, False, f"求解时间超过 {budget.time_limit}s"
+        pairs[a] = []
         others = [v for v in var_names if v != a]
         for mask_bits in itertools.product([False, True], repeat=len(others)):
             ctx_base = dict(zip(others, mask_bits))
@@ -254,135 +345,293 @@ def mcdc_full(expr: str) -> List[Dict[str, bool]]:
             val2 = z3.is_true(s.model().eval(z3_expr))
 
             if val1 != val2:            # 现在都是 Python bool，可直接比较
-                tests.append(ctx1)      # 保存两个情景的上下文
-                tests.append(ctx2)      # 保存两个情景的上下文
+                pairs[a].append((ctx1, ctx2))
                 break                   # 找到一组即可
-
-    # 去重
-    seen = set(tuple(sorted(d.items())) for d in tests)
-    return [dict(t) for t in seen]
+    return pairs, True, ""
 
 # --------------------------------------------------
 # 函数体 → CFG
 # --------------------------------------------------
-def build_cfg(body: Node, code: bytes) -> CFGNode:
-    """
-    CFG：每个语句/条件一个节点，遇到 if/while 产生分支
-    仅演示思路，真正工业级需完整语义
-    """
-    CFGNode._id = 0
-    entry = CFGNode("entry")
-    exit_ = CFGNode("exit")
-
-    # 收集所有条件
-    conds = collect_conditions_with_position(body, code)
-    print(f"[debug] build_cfg called, conds={conds}")
-
-    # 为每个条件建节点
-    prev = entry
-    for expr, _, _ in conds:
-        cond_node = CFGNode("cond", cond=expr)
-        prev.add_succ("", cond_node)
-        cond_node.add_succ("T", exit_)
-        cond_node.add_succ("F", exit_)
-        prev = cond_node
-
-    prev.add_succ("", exit_)
-    entry.succ.append(("", exit_))
-    return entry
+def build_cfg(body: Node, code: bytes) -> CFG:
+    """建 CFG（见 mcdc_cfg），并把每个条件节点直接从语法树转换成 Z3 表达式"""
+    cfg = _build_cfg(body, code)
+    for i in cfg.cond_ids():
+        cfg.z3_cond[i] = ts_to_z3(cfg.cond_node[i], code)
+    return cfg
+
+# --------------------------------------------------
+# tree-sitter 解析器：每个进程只构造一次
+# --------------------------------------------------
+_PARSER: Optional[Parser] = None
+
+
+def get_parser() -> Parser:
+    global _PARSER
+    if _PARSER is None:
+        _PARSER = Parser()
+        _PARSER.language = Language(tsjava.language())
+    return _PARSER
 
 # --------------------------------------------------
 # pipeline
 # --------------------------------------------------
-def solve_mcdc(java_file: Path):
-    JAVA_LANG = Language(tsjava.language())
+def _reusable(entry: Dict[str, Any], body_hash: str, config: str) -> bool:
+    """方法体哈希（concrete 时连同字段声明）与求解配置都没变、且上次在预算内完整求解，才能复用上次的结果"""
+    if entry.get("body_hash") != body_hash or entry.get("config") != config:
+        return False
+    return all((n.get("mcdc_coverage") or {}).get("complete", True) for n in entry.get("cfg_nodes", []))
+
+
+def dot_path(dot_dir: Path, java_name: str, sig: str) -> Path:
+    """<类名>.<方法键>.dot；方法键里文件名不允许的字符（泛型尖括号等）换成 _"""
+    return Path(dot_dir) / (java_name + "." + re.sub(r'[<>:"/\\|?*\s]', "_", sig) + ".dot")
+
+
+def _solve_method(sig: str, body: Node, code_bytes: bytes, body_hash: str, config: str,
+                  solver: str, mcdc_type: str, budget: Optional[MCDCBudget], cache: Optional[MCDCCache],
+                  minimize: bool, concrete: bool, dot_file: Optional[Path]) -> Dict[str, Any]:
+    """单个方法：建 CFG、求解 MC/DC，返回写入输出文件的方法记录"""
+    cfg = build_cfg(body, code_bytes)
+    logger.debug("%s: CFG %d 个节点，%d 条边，%d 个条件", sig, len(cfg), cfg.num_edges, len(cfg.z3_cond))
+    entry: Dict[str, Any] = {"body_hash": body_hash, "config": config}
+    if dot_file is not None:
+        dot_file.write_text(cfg.to_dot(), encoding="utf-8")
+        entry["dot"] = str(dot_file)
+
+    # MCDC
+    max_pairs = MCDC_CANDIDATE_PAIRS if minimize else 1
+    mcdc_map = mcdc_on_cfg(cfg, solver, mcdc_type, budget, cache, max_pairs)
+    for res in mcdc_map.values():
+        if not res.complete:
+            cov = res.coverage()
+            logger.warning("%s: 条件超出求解预算（%s），部分覆盖 %d/%d", sig, res.reason, cov["covered"], cov["total"])
+    before = sum(len(res.first_vectors()) for res in mcdc_map.values())
+    if concrete:
+        types, constants = declared_types(body.parent, code_bytes)
+        synth = ConcreteSynthesizer(types, constants, get_parser())
+        if minimize:
+            # 只在算术约束下可实现的候选对里挑选向量
+            for i, res in mcdc_map.items():
+                res.pairs = synth.feasible_pairs(cfg.z3_cond[i][1], res.pairs)
+    inputs = {i: (res.minimal_vectors() if minimize else res.vectors()) for i, res in mcdc_map.items()}
+    # 同一方法中源码相同的条件（如多个循环的 i < n）只向下游发送一次
+    distinct = {cfg.cond[i]: len(v) for i, v in inputs.items()} if minimize else {}
+    after = sum(distinct.values()) if minimize else sum(len(v) for v in inputs.values())
+    concrete_inputs = {}
+    if concrete:
+        for i, vecs in inputs.items():
+            values = synth.synthesize(cfg.z3_cond[i][1], vecs)
+            if values is not None:
+                concrete_inputs[i] = values
+        unrealizable = sum(v is None for values in concrete_inputs.values() for v in values)
+        if unrealizable:
+            logger.warning("%s: %d 个向量在整数/实数约束下不可实现", sig, unrealizable)
+
+    entry["mcdc_reduction"] = {
+        "before": before,
+        "after": after,
+        "ratio": round(1 - after / before, 4) if before else 0.0,
+    }
+    entry["cfg_nodes"] = [
+        {
+            "id": i,
+            "label": cfg.label[i],
+            "cond": cfg.cond[i],
+            "line": cfg.line[i],
+            "succ": [[j, lab] for j, lab in cfg.succ(i)],
+            "atoms": cfg.z3_cond[i][1] if i in cfg.z3_cond else [],
+            "mcdc_inputs": inputs.get(i, []),
+            "mcdc_coverage": mcdc_map[i].coverage() if i in mcdc_map else None,
+            **({"concrete_inputs": concrete_inputs[i]} if i in concrete_inputs else {})
+        }
+        for i in cfg.preorder()
+    ]
+    return entry
+
+
+def _filter_entry(entry: Dict[str, Any], minimize: bool) -> List[Dict[str, Any]]:
+    """仅返回 condition、mcdc_inputs 不为空的节点的 condition 和 mcdc_inputs"""
+    conds = []
+    sent = set()
+    for node in entry["cfg_nodes"]:
+        if node["cond"] and node["mcdc_inputs"]:
+            if minimize and node["cond"] in sent:
+                continue
+            sent.add(node["cond"])
+            conds.append({
+                "condition": node["cond"],
+                "mcdc_inputs": node["mcdc_inputs"],
+                **({"concrete_inputs": node["concrete_inputs"]} if "concrete_inputs" in node else {})
+            })
+    return conds
+
+
+def solve_mcdc(java_file: Path, solver: str = "auto", mcdc_type: str = "unique",
+               budget: Optional[MCDCBudget] = None, use_cache: bool = True,
+               incremental: bool = True, minimize: bool = True, concrete: bool = False,
+               fmt: str = "json", dot: bool = False, out_dir: Optional[Path] = None):
+    """
+    minimize: 为每个条件挑选覆盖所有原子的最少向量（候选对更多，求解稍慢），
+              mcdc_inputs 只输出精简后的向量，每个方法记录精简前后的向量数
+    concrete: 用 Z3 整数/实数理论为每个向量解出具体的参数/字段取值（见 mcdc_concrete），
+              与布尔向量一起输出为 concrete_inputs
+    fmt     : 输出格式 json / ndjson / bin（见 mcdc_writer），每算完一个方法就写出
+    dot     : 是否为每个方法导出 .dot 控制流图（<类名>.<方法键>.dot，与结果文件同目录）
+    out_dir : 输出目录，默认 mcdc_output/；目录模式下为 mcdc_output/<包路径>/
+    """
+    check_solver(solver, mcdc_type)
     java_name = java_file.stem
-    OUT_JSON = Path(__file__).resolve().parent / "mcdc_output" / f"{java_name}_mcdc_cfg.json"
-    OUT_DIR  = Path(__file__).resolve().parent / "mcdc_output"; 
-    OUT_DIR.mkdir(exist_ok=True)
+    OUT_DIR = Path(out_dir) if out_dir is not None else MCDC_OUTPUT_DIR
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    out_path = summary_path(OUT_DIR, java_name, fmt)
     code_bytes = java_file.read_bytes()
-    parser = Parser()
-    parser.language = JAVA_LANG
-    tree = parser.parse(code_bytes)
+    tree = get_parser().parse(code_bytes)
 
     methods = all_methods(tree.root_node, code_bytes)
-    summary = {}
-    print(f"[debug] 找到 {len(methods)} 个方法：{[sig for sig, _ in methods]}")
-
-    for sig, body in methods:
-        cfg_root = build_cfg(body, code_bytes)
-        # 输出 dot
-        lines = ["digraph CFG {"]
-        visited = set()
-
-        def dot(n: CFGNode):
-            if n in visited:
-                return
-            visited.add(n)
-            lines.extend(n.to_dot())
-            for _, nxt in n.succ:
-                dot(nxt)
-
-        dot(cfg_root)
-        lines.append("}")
-        dot_path = OUT_DIR / f"{sig}.dot"
-        visited = set()
-        lines = ["digraph CFG {"]
-
-        def dot(n: CFGNode):
-            if n.id in visited:
-                return
-            visited.add(n.id)
-            safe_label = n.label.replace('"', r'\"')
-            safe_cond = n.cond.replace('"', r'\"').replace('\n', r'\l')
-            lines.append(f'{n.id} [label="{safe_label}\\n{safe_cond}"]')
-            for lab, nxt in n.succ:
-                if nxt.id not in visited:
-                    dot(nxt)
-                lines.append(f'{n.id} -> {nxt.id} [label="{lab}"]')
-
-        dot(cfg_root)
-        lines.append("}")
-        dot_path.write_text("\n".join(lines), encoding="utf-8")
-
-
-        # MCDC
-        mcdc_map = mcdc_on_cfg(cfg_root)
-
-        summary[sig] = {
-            "dot": str(dot_path),
-            "cfg_nodes": [
-                {
-                    "id": n.id,
-                    "label": n.label,
-                    "cond": n.cond,
-                    "mcdc_inputs": mcdc_map.get(n.id, [])
-                }
-                for n in [cfg_root] + [n for n in PreOrderIter(cfg_root) if n != cfg_root]
-            ]
-        }
-
-    Path(OUT_JSON).write_text(json.dumps(summary, indent=2, ensure_ascii=False))
-    print(f"[✓] CFG + MCDC 完成 → {OUT_JSON} 和 {OUT_DIR}")
-    # 仅返回condintion、mcdc_inputs不为空的项目的condition和mcdc_inputs
+    cache = get_mcdc_cache() if use_cache else None
+    logger.debug("找到 %d 个方法：%s", len(methods), [sig for sig, _ in methods])
+
+    # 增量：按方法体源码哈希复用上次的结果，只重算新增或改动的方法
+    previous = load_summary(out_path, fmt) if incremental else {}
+    config = f"{solver}|{mcdc_type}|cfg{CFG_VERSION}|bdd{BDD_VERSION}" + ("|min" if minimize else "") + ("|concrete" if concrete else "")
+    recomputed = 0
+    before = after = 0
+    written: List[str] = []
     filtered_summary = {}
-    for sig, data in summary.items():
-        cfg_nodes = data["cfg_nodes"]
-        for node in cfg_nodes:
-            if node["cond"] and node["mcdc_inputs"]:
-                if sig not in filtered_summary:
-                    filtered_summary[sig] = []
-                filtered_summary[sig].append({
-                    "condition": node["cond"],
-                    "mcdc_inputs": node["mcdc_inputs"]
-                })
-    print(filtered_summary)
+    writer = SummaryWriter(out_path, fmt)
+
+    try:
+        for sig, body in methods:
+            body_hash = hashlib.sha1(code_bytes[body.start_byte:body.end_byte]).hexdigest()
+            if concrete:
+                # 具体取值还取决于字段类型和常量，字段声明改了也要重算
+                body_hash += ":" + fields_hash(body.parent, code_bytes)
+            entry = previous.get(sig)
+            if entry is None or not _reusable(entry, body_hash, config) or (dot and "dot" not in entry):
+                recomputed += 1
+                entry = _solve_method(sig, body, code_bytes, body_hash, config, solver, mcdc_type,
+                                      budget, cache, minimize, concrete,
+                                      dot_path(OUT_DIR, java_name, sig) if dot else None)
+            writer.write(sig, entry)
+            written.append(sig)
+            reduction = entry.get("mcdc_reduction", {})
+            before += reduction.get("before", 0)
+            after += reduction.get("after", 0)
+            conds = _filter_entry(entry, minimize)
+            if conds:
+                filtered_summary[sig] = conds
+            else:
+                filtered_summary.pop(sig, None)
+    except BaseException:
+        writer.discard()
+        raise
+
+    if recomputed or written != list(previous):
+        writer.commit()
+        logger.info("CFG + MCDC 完成（重算 %d/%d 个方法）→ %s", recomputed, len(methods), out_path)
+    else:
+        writer.discard()
+        logger.info("方法均未改动，沿用 %s", out_path)
+    if minimize and before:
+        logger.info("MC/DC 向量精简 %d → %d（减少 %.1f%%）", before, after, 100 * (1 - after / before))
+    logger.debug("%s", filtered_summary)
     return filtered_summary
 
+# --------------------------------------------------
+# 目录级并行：按文件分发到进程池，每个 worker 复用自己的解析器
+# --------------------------------------------------
+def _init_mcdc_worker():
+    get_parser()
+
+
+def _solve_one(java_file: Path, out_dir: Path, solver: str, mcdc_type: str, budget: Optional[MCDCBudget],
+               use_cache: bool, incremental: bool, minimize: bool, concrete: bool,
+               fmt: str, dot: bool) -> Dict[str, Any]:
+    filtered = solve_mcdc(java_file, solver, mcdc_type, budget, use_cache, incremental, minimize, concrete, fmt, dot, out_dir)
+    return {
+        "output": summary_path(out_dir, java_file.stem, fmt).relative_to(MCDC_OUTPUT_DIR).as_posix(),
+        "methods": len(filtered),
+        "conditions": sum(len(conds) for conds in filtered.values()),
+        "vectors": sum(len(c["mcdc_inputs"]) for conds in filtered.values() for c in conds),
+    }
+
+
+def solve_mcdc_dir(src_root: Path, workers: Optional[int] = None, solver: str = "auto",
+                   mcdc_type: str = "unique", budget: Optional[MCDCBudget] = None,
+                   use_cache: bool = True, incremental: bool = True, minimize: bool = True,
+                   concrete: bool = False, fmt: str = "json", dot: bool = False) -> Dict[str, Any]:
+    """
+    求解 src_root 下所有 .java 文件，每个文件输出到 mcdc_output/<相对 src_root 的包路径>/<类名>_mcdc_cfg.json，
+    不同包里的同名类互不覆盖；另外汇总一份 mcdc_output/mcdc_index.json（output 为相对 mcdc_output 的路径）
+    """
+    check_solver(solver, mcdc_type)
+    src_root = Path(src_root)
+    java_files = sorted(src_root.rglob("*.java"))
+    workers = workers or os.cpu_count() or 1
+    OUT_DIR = MCDC_OUTPUT_DIR
+    OUT_DIR.mkdir(exist_ok=True)
+    start = time.time()
+
+    files: Dict[str, Any] = {}
+    def out_dir(f: Path) -> Path:
+        return OUT_DIR / f.relative_to(src_root).parent
+
+    def collect(f: Path, result: Callable[[], Dict[str, Any]]):
+        # 单个文件失败只记到索引里，不影响其他文件（串行和并行一致）
+        rel = f.relative_to(src_root).as_posix()
+        try:
+            files[rel] = result()
+        except Exception as e:
+            logger.warning("%s 求解失败: %s", rel, e)
+            files[rel] = {"error": str(e)}
+
+    if workers == 1 or len(java_files) <= 1:
+        for f in java_files:
+            collect(f, lambda: _solve_one(f, out_dir(f), solver, mcdc_type, budget, use_cache, incremental, minimize, concrete, fmt, dot))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_mcdc_worker) as pool:
+            futures = {pool.submit(_solve_one, f, out_dir(f), solver, mcdc_type, budget, use_cache, incremental, minimize, concrete, fmt, dot): f for f in java_files}
+            for fut in as_completed(futures):
+                collect(futures[fut], fut.result)
+
+    index = {
+        "src_root": str(src_root),
+        "elapsed": round(time.time() - start, 3),
+        "files": dict(sorted(files.items())),
+    }
+    index_path = OUT_DIR / "mcdc_index.json"
+    index_path.write_text(json.dumps(index, indent=2, ensure_ascii=False), encoding="utf-8")
+    logger.info("%d 个文件求解完成，耗时 %ss → %s", len(java_files), index["elapsed"], index_path)
+    return index
+
 
 # --------------------------------------------------
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="生成 Java 函数的控制流图和 MCDC 测试用例")
     parser.add_argument("--java_file", type=Path, default=Path(__file__).resolve().parent.parent.parent / "java_project" / "src" / "main" / "java"/ "org" / "example" / "DataCleaner.java",  help="Java 源文件路径")
+    parser.add_argument("--solver", choices=MCDC_SOLVERS, default="auto", help="MC/DC 求解引擎")
+    parser.add_argument("--mcdc_type", choices=MCDC_TYPES, default="unique", help="MC/DC 类型（masking 仅 auto / bdd 求解引擎支持）")
+    parser.add_argument("--max_bdd_nodes", type=int, default=200_000, help="单个条件的 BDD 节点上限")
+    parser.add_argument("--time_budget", type=float, default=5.0, help="单个条件的求解时间上限（秒）")
+    parser.add_argument("--no_cache", action="store_true", help="不使用 mcdc_output 下的形状缓存")
+    parser.add_argument("--src_dir", type=Path, default=None, help="源码根目录，指定后并行求解目录下所有 .java 文件")
+    parser.add_argument("--workers", type=int, default=None, help="并行进程数，默认为 CPU 核数")
+    parser.add_argument("--full", action="store_true", help="忽略上次的结果，重算所有方法")
+    parser.add_argument("--no_minimize", action="store_true", help="不精简测试向量，输出所有独立影响对的并集")
+    parser.add_argument("--concrete", action="store_true", help="为每个向量求解具体的参数/字段取值")
+    parser.add_argument("--format", choices=MCDC_FORMATS, default="json", help="结果文件格式")
+    parser.add_argument("--dot", action="store_true", help="为每个方法导出 .dot 控制流图")
+    parser.add_argument("--log_level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="日志级别")
     args = parser.parse_args()
-    solve_mcdc(args.java_file)
+    if args.mcdc_type == "masking" and args.solver not in MASKING_SOLVERS:
+        parser.error(f"--solver {args.solver} 不支持 --mcdc_type masking，请使用 {' / '.join(MASKING_SOLVERS)}")
+    logging.basicConfig(level=args.log_level, format="[%(levelname)s] %(message)s")
+    budget = MCDCBudget(max_nodes=args.max_bdd_nodes, time_limit=args.time_budget)
+    if args.src_dir:
+        solve_mcdc_dir(args.src_dir, workers=args.workers, solver=args.solver, mcdc_type=args.mcdc_type,
+                       budget=budget, use_cache=not args.no_cache, incremental=not args.full,
+                       minimize=not args.no_minimize, concrete=args.concrete, fmt=args.format, dot=args.dot)
+    else:
+        solve_mcdc(args.java_file, solver=args.solver, mcdc_type=args.mcdc_type,
+                   budget=budget, use_cache=not args.no_cache, incremental=not args.full,
+                   minimize=not args.no_minimize, concrete=args.concrete, fmt=args.format, dot=args.dot)
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+Java 函数级控制流图（CFG）
+- 支持 if/else、while、do-while、for、增强 for、switch（含 -> 规则）、try/catch/finally、
+  break/continue（含标签）、return/throw、assert
+- 语句内部的三目运算符条件单独成为条件节点，T/F 两条边汇合到该语句
+- lambda / 匿名类内部的条件只作为独立条件节点，不展开其控制流
+- try 中的 return/break/continue 直接跳转，不经过 finally；异常边只从 try 节点连到各 catch
+- 节点与边按 struct-of-arrays 存放：节点属性为平行列表，边为 CSR 邻接（offsets/targets/labels）
+- 构造与遍历都用显式栈，不依赖递归，千行级方法也不会触发递归上限
+"""
+import logging
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+from tree_sitter import Node
+
+logger = logging.getLogger(__name__)
+
+# 输出格式版本：结构变化时递增，使增量模式下旧格式的结果失效
+CFG_VERSION = 2
+
+# 边标签。悬空边编码为一个整数 (src << 3) | label，不为每条边分配元组
+EDGE_LABELS = ("", "T", "F", "case", "default", "exception")
+_E, _T, _F, _CASE, _DEFAULT, _EXC = range(len(EDGE_LABELS))
+
+_LOOP_TYPES = {"while_statement", "do_statement", "for_statement", "enhanced_for_statement"}
+_COND_STMT_TYPES = {"if_statement", "while_statement", "do_statement", "for_statement"}
+_TERNARY_TYPES = {"ternary_expression", "conditional_expression"}
+_SKIP_TYPES = {"line_comment", "block_comment", ";"}
+
+
+class CFG:
+    """
+    label    : 节点类型（entry/exit/if/while/stmt/...）
+    cond     : 条件源码，非条件节点为空串
+    cond_node: 条件的语法树节点，供 ts_to_z3 直接转换
+    start/end: 节点对应源码的字节区间；line 为起始行号（从 1 开始）
+    offsets/targets/edge_label: CSR 邻接，节点 i 的后继为 targets[offsets[i]:offsets[i+1]]
+    z3_cond  : {节点 id: ts_to_z3 的结果}，由调用方填充
+    """
+    __slots__ = ("code", "label", "cond", "cond_node", "start", "end", "line",
+                 "offsets", "targets", "edge_label", "entry", "exit", "z3_cond")
+
+    def __init__(self, code: bytes):
+        self.code = code
+        self.label: List[str] = []
+        self.cond: List[str] = []
+        self.cond_node: List[Optional[Node]] = []
+        self.start: List[int] = []
+        self.end: List[int] = []
+        self.line: List[int] = []
+        self.offsets = np.zeros(1, dtype=np.int32)
+        self.targets = np.zeros(0, dtype=np.int32)
+        self.edge_label = np.zeros(0, dtype=np.int8)
+        self.entry = 0
+        self.exit = 0
+        self.z3_cond: Dict[int, tuple] = {}
+
+    def __len__(self) -> int:
+        return len(self.label)
+
+    @property
+    def num_edges(self) -> int:
+        return int(self.targets.size)
+
+    def succ(self, i: int) -> Iterator[tuple]:
+        """(后继节点, 边标签)"""
+        lo, hi = int(self.offsets[i]), int(self.offsets[i + 1])
+        for k in range(lo, hi):
+            yield int(self.targets[k]), EDGE_LABELS[self.edge_label[k]]
+
+    def cond_ids(self) -> List[int]:
+        return [i for i, c in enumerate(self.cond_node) if c is not None]
+
+    def text(self, i: int, width: int = 60) -> str:
+        """节点在 dot 中显示的文本：条件节点显示条件，其余显示源码首行"""
+        if self.cond[i]:
+            return self.cond[i]
+        if self.start[i] == self.end[i]:
+            return ""
+        first = self.code[self.start[i]:self.end[i]].decode(errors="replace").split("\n", 1)[0].strip()
+        return first if len(first) <= width else first[:width] + "..."
+
+    def preorder(self) -> List[int]:
+        """从 entry 出发的深度优先先序；不可达节点按 id 顺序追加在后面"""
+        order = []
+        seen = np.zeros(len(self), dtype=bool)
+        stack = [self.entry]
+        while stack:
+            u = stack.pop()
+            if seen[u]:
+                continue
+            seen[u] = True
+            order.append(u)
+            lo, hi = int(self.offsets[u]), int(self.offsets[u + 1])
+            stack.extend(int(v) for v in self.targets[lo:hi][::-1] if not seen[v])
+        order.extend(int(i) for i in np.flatnonzero(~seen))
+        return order
+
+    def to_dot(self) -> str:
+        lines = ["digraph CFG {"]
+        for i in range(len(self)):
+            safe_label = self.label[i].replace('"', r'\"')
+            safe_text = self.text(i).replace("\\", "\\\\").replace('"', r'\"').replace("\n", r"\l")
+            lines.append(f'{i} [label="{safe_label}\\n{safe_text}"]')
+        for i in range(len(self)):
+            for j, lab in self.succ(i):
+                lines.append(f'{i} -> {j} [label="{lab}"]')
+        lines.append("}")
+        return "\n".join(lines)
+
+
+# --------------------------------------------------
+# 构造器：把语句翻译成一串栈操作
+#   open  : 当前悬空的出边，会连到下一个产生的节点
+#   frames: break/continue 的目标作用域 [kind, 标签名, break 悬空边, continue 悬空边]
+# --------------------------------------------------
+class _Builder:
+    __slots__ = ("cfg", "code", "src", "dst", "lab", "open", "exits", "frames", "work")
+
+    def __init__(self, code: bytes):
+        self.cfg = CFG(code)
+        self.code = code
+        self.src: List[int] = []
+        self.dst: List[int] = []
+        self.lab: List[int] = []
+        self.open: List[int] = []
+        self.exits: List[int] = []
+        self.frames: List[list] = []
+        self.work: List[tuple] = []
+
+    # ---------------- 节点与边 ----------------
+    def node(self, label: str, n: Optional[Node] = None, cond: Optional[Node] = None) -> int:
+        cfg = self.cfg
+        i = len(cfg.label)
+        cfg.label.append(label)
+        cfg.cond_node.append(cond)
+        cfg.cond.append(self.code[cond.start_byte:cond.end_byte].decode() if cond is not None else "")
+        span = n if n is not None else cond
+        cfg.start.append(span.start_byte if span is not None else 0)
+        cfg.end.append(span.end_byte if span is not None else 0)
+        cfg.line.append(span.start_point[0] + 1 if span is not None else 0)
+        self.connect(self.open, i)
+        self.open = [i << 3]
+        return i
+
+    def connect(self, dangling: List[int], target: int):
+        for d in dangling:
+            self.src.append(d >> 3)
+            self.dst.append(target)
+            self.lab.append(d & 7)
+
+    def frame(self, kind: str, name: Optional[str] = None):
+        return [kind, name, [], []]
+
+    def find_frame(self, name: Optional[str], want_loop: bool) -> Optional[list]:
+        for f in reversed(self.frames):
+            if name is not None:
+                if f[1] == name:
+                    return f
+            elif not want_loop or f[0] == "loop":
+                if f[0] != "label":
+                    return f
+        return None
+
+    # ---------------- 入口 ----------------
+    def build(self, body: Node) -> CFG:
+        cfg = self.cfg
+        cfg.entry = self.node("entry")
+        self.work.append(("stmt", body, None))
+        work = self.work
+        while work:
+            op = work.pop()
+            kind = op[0]
+            if kind == "stmt":
+                self.stmt(op[1], op[2])
+            elif kind == "goto":            # 替换悬空边
+                self.open = list(op[1])
+            elif kind == "stash":           # 悬空边暂存到 box
+                op[1].extend(self.open)
+                self.open = []
+            elif kind == "merge":           # box 中的边并回悬空边
+                self.open.extend(op[1])
+            elif kind == "jump":            # 悬空边连到已存在的节点（回边）
+                self.connect(self.open, op[1])
+                self.open = []
+            elif kind == "node":
+                self.node(op[1], op[2])
+            elif kind == "simple":
+                self.simple(op[1], "stmt")
+            elif kind == "add_edge":        # switch 的 case/default 边
+                self.open.append(op[1])
+            elif kind == "do_cond":
+                self.do_cond(op[1], op[2], op[3])
+            elif kind == "push":
+                self.frames.append(op[1])
+            elif kind == "pop":
+                f = self.frames.pop()
+                self.open.extend(f[2])
+            elif kind == "continue_to":     # 弹出前把 continue 汇合到当前位置
+                self.open.extend(self.frames[-1][3])
+                self.frames[-1][3] = []
+        cfg.exit = self.node("exit")
+        self.connect(self.exits, cfg.exit)
+        self.finish()
+        return cfg
+
+    def finish(self):
+        # 边按 (起点, 标签) 排序得到 CSR，同一节点的出边按 T 在前、F 在后的顺序排列
+        cfg = self.cfg
+        n = len(cfg.label)
+        src = np.asarray(self.src, dtype=np.int32)
+        lab = np.asarray(self.lab, dtype=np.int8)
+        order = np.lexsort((lab, src))
+        cfg.targets = np.asarray(self.dst, dtype=np.int32)[order]
+        cfg.edge_label = lab[order]
+        cfg.offsets = np.zeros(n + 1, dtype=np.int32)
+        np.cumsum(np.bincount(src, minlength=n), out=cfg.offsets[1:])
+        self.src = self.dst = self.lab = []
+
+    # ---------------- 语句 ----------------
+    def stmt(self, n: Node, name: Optional[str]):
+        t = n.type
+        work = self.work
+        if t in _SKIP_TYPES:
+            return
+        if t == "block":
+            work.extend(("stmt", c, None) for c in reversed(n.named_children))
+        elif t == "labeled_statement":
+            inner = n.named_children[-1]
+            label = self.code[n.named_children[0].start_byte:n.named_children[0].end_byte].decode()
+            if inner.type in _LOOP_TYPES:
+                work.append(("stmt", inner, label))
+            else:
+                f = self.frame("label", label)
+                work.extend((("pop",), ("stmt", inner, None), ("push", f)))
+        elif t == "if_statement":
+            self.if_stmt(n)
+        elif t == "while_statement":
+            self.while_stmt(n, name)
+        elif t == "do_statement":
+            self.do_stmt(n, name)
+        elif t == "for_statement":
+            self.for_stmt(n, name)
+        elif t == "enhanced_for_statement":
+            self.foreach_stmt(n, name)
+        elif t == "switch_expression" or t == "switch_statement":
+            self.switch_stmt(n)
+        elif t in ("try_statement", "try_with_resources_statement"):
+            self.try_stmt(n)
+        elif t == "break_statement":
+            self.jump_stmt(n, want_loop=False)
+        elif t == "continue_statement":
+            self.jump_stmt(n, want_loop=True)
+        elif t in ("return_statement", "throw_statement"):
+            self.simple(n, t.split("_")[0])
+            self.exits.extend(self.open)
+            self.open = []
+        elif t == "assert_statement":
+            self.assert_stmt(n)
+        elif t == "synchronized_statement":
+            self.simple(n, "synchronized", n.child_by_field_name("body"))
+            work.append(("stmt", n.child_by_field_name("body"), None))
+        else:
+            self.simple(n, "stmt")
+
+    def simple(self, n: Node, label: str, skip: Optional[Node] = None) -> int:
+        """普通语句：先为内部的三目条件建条件节点，再建语句节点"""
+        for cond, cond_label in self.nested_conditions(n, skip):
+            c = self.node(cond_label, cond, cond)
+            self.open = [(c << 3) | _T, (c << 3) | _F]
+        return self.node(label, n)
+
+    def nested_conditions(self, n: Node, skip: Optional[Node]) -> List[tuple]:
+        """按源码顺序收集语句内部的条件（三目、lambda/匿名类中的 if/while/for），每个语法节点只访问一次"""
+        found = []
+        stack = list(reversed(n.children))
+        while stack:
+            c = stack.pop()
+            if skip is not None and c == skip:
+                continue
+            cond = None
+            if c.type in _TERNARY_TYPES:
+                cond, label = c.child_by_field_name("condition"), "ternary"
+            elif c.type in _COND_STMT_TYPES:
+                cond, label = c.child_by_field_name("condition"), "cond"
+            if cond is not None:
+                found.append((cond, label))
+            # 条件本身的布尔结构由 ts_to_z3 整体转换，不再深入
+            stack.extend(k for k in reversed(c.children) if cond is None or k != cond)
+        return found
+
+    def if_stmt(self, n: Node):
+        cond = n.child_by_field_name("condition")
+        c = self.node("if", n, cond)
+        cons = n.child_by_field_name("consequence")
+        alt = n.child_by_field_name("alternative")
+        box: List[int] = []
+        # 栈后进先出，按执行顺序的逆序压入
+        self.work.append(("merge", box))
+        if alt is not None:
+            self.work.append(("stmt", alt, None))
+        self.work.extend((("goto", [(c << 3) | _F]), ("stash", box),
+                          ("stmt", cons, None), ("goto", [(c << 3) | _T])))
+
+    def while_stmt(self, n: Node, name: Optional[str]):
+        cond = n.child_by_field_name("condition")
+        c = self.node("while", n, cond)
+        f = self.frame("loop", name)
+        f[2].append((c << 3) | _F)
+        self.work.extend((("pop",), ("jump", c), ("continue_to",),
+                          ("stmt", n.child_by_field_name("body"), None),
+                          ("push", f), ("goto", [(c << 3) | _T])))
+
+    def do_stmt(self, n: Node, name: Optional[str]):
+        head = self.node("do", n.child_by_field_name("body"))
+        f = self.frame("loop", name)
+        self.work.extend((("pop",), ("do_cond", n, head, f), ("continue_to",),
+                          ("stmt", n.child_by_field_name("body"), None), ("push", f)))
+
+    def do_cond(self, n: Node, head: int, f: list):
+        cond = n.child_by_field_name("condition")
+        c = self.node("do-while", n, cond)
+        self.connect([(c << 3) | _T], head)
+        f[2].append((c << 3) | _F)
+        self.open = []
+
+    def for_stmt(self, n: Node, name: Optional[str]):
+        for init in n.children_by_field_name("init"):
+            self.simple(init, "stmt")
+        cond = n.child_by_field_name("condition")
+        c = self.node("for", n, cond)
+        f = self.frame("loop", name)
+        if cond is not None:
+            f[2].append((c << 3) | _F)
+            body_entry = [(c << 3) | _T]
+        else:
+            body_entry = [c << 3]
+        work = self.work
+        work.extend((("pop",), ("jump", c)))
+        work.extend(("simple", u) for u in reversed(n.children_by_field_name("update")))
+        work.extend((("continue_to",), ("stmt", n.child_by_field_name("body"), None),
+                     ("push", f), ("goto", body_entry)))
+
+    def foreach_stmt(self, n: Node, name: Optional[str]):
+        c = self.node("foreach", n.child_by_field_name("value"))
+        f = self.frame("loop", name)
+        f[2].append((c << 3) | _F)
+        self.work.extend((("pop",), ("jump", c), ("continue_to",),
+                          ("stmt", n.child_by_field_name("body"), None),
+                          ("push", f), ("goto", [(c << 3) | _T])))
+
+    def switch_stmt(self, n: Node):
+        s = self.simple(n.child_by_field_name("condition"), "switch")
+        block = n.child_by_field_name("body")
+        f = self.frame("switch")
+        after: List[int] = []
+        work: List[tuple] = [("push", f)]
+        has_default = False
+        for g in block.named_children:
+            if g.type not in ("switch_block_statement_group", "switch_rule"):
+                continue
+            labels = [k for k in g.named_children if k.type == "switch_label"]
+            is_default = any(k.named_child_count == 0 for k in labels)
+            has_default |= is_default
+            edge = (s << 3) | (_DEFAULT if is_default else _CASE)
+            body = [k for k in g.named_children if k.type != "switch_label"]
+            if g.type == "switch_rule":
+                # case X -> ...：没有贯穿，执行完直接离开 switch
+                work.append(("goto", [edge]))
+                work.extend(("stmt", k, None) for k in body)
+                work.append(("stash", after))
+            else:
+                # 冒号形式：上一组末尾的悬空边贯穿到本组
+                work.append(("add_edge", edge))
+                work.extend(("stmt", k, None) for k in body)
+        if not has_default:
+            work.append(("add_edge", (s << 3) | _DEFAULT))
+        work.extend((("merge", after), ("pop",)))
+        self.open = []
+        self.work.extend(reversed(work))
+
+    def try_stmt(self, n: Node):
+        t = self.node("try", n.child_by_field_name("resources") or n.child_by_field_name("body"))
+        exits: List[int] = []
+        work: List[tuple] = [("stmt", n.child_by_field_name("body"), None), ("stash", exits)]
+        fin = None
+        for c in n.named_children:
+            if c.type == "catch_clause":
+                param = next((k for k in c.named_children if k.type == "catch_formal_parameter"), c)
+                work.extend((("goto", [(t << 3) | _EXC]), ("node", "catch", param),
+                             ("stmt", c.child_by_field_name("body"), None), ("stash", exits)))
+            elif c.type == "finally_clause":
+                fin = c
+        work.append(("merge", exits))
+        if fin is not None:
+            work.extend((("node", "finally", fin), ("stmt", fin.named_children[-1], None)))
+        self.work.extend(reversed(work))
+
+    def jump_stmt(self, n: Node, want_loop: bool):
+        ident = next((k for k in n.named_children if k.type == "identifier"), None)
+        name = self.code[ident.start_byte:ident.end_byte].decode() if ident is not None else None
+        f = self.find_frame(name, want_loop)
+        if f is None:
+            logger.warning("找不到 %s 的目标，按顺序执行处理: %s", n.type, self.code[n.start_byte:n.end_byte].decode())
+            return
+        (f[3] if want_loop else f[2]).extend(self.open)
+        self.open = []
+
+    def assert_stmt(self, n: Node):
+        cond = n.named_children[0]
+        c = self.node("assert", n, cond)
+        self.exits.append((c << 3) | _F)     # 断言失败抛出 AssertionError
+        self.open = [(c << 3) | _T]
+
+
+def build_cfg(body: Node, code: bytes) -> CFG:
+    return _Builder(code).build(body)
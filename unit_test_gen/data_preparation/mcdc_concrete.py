@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+MC/DC 向量的具体输入合成（可选）
+- 原子默认只是不透明的 z3.Bool，LLM 拿到 {"AT0": true} 后还要自己猜参数取值
+- 这里把比较类原子按声明类型建模：整型用 Int，浮点用 Real，数组/字符串/集合的长度用非负 Int，
+  x == null 用独立的布尔变量，常量字段直接代入字面值，与 Double.NaN 的 == 比较恒为 false
+- 其余子式（方法调用、数组元素等）当作一个不透明的数值项，解出的值表示 “该表达式需要取到的值”
+- 对每个向量求解一组使各原子取到指定真值的具体值；不可实现的向量（如 x > 5 与 x < 3 同真）返回 None
+"""
+import hashlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import z3
+from tree_sitter import Node, Parser
+
+_INT_TYPES = {"int", "long", "short", "byte", "char", "Integer", "Long", "Short", "Byte", "Character"}
+_BOOL_TYPES = {"boolean", "Boolean"}
+_COMPARE_OPS = {"<", "<=", ">", ">=", "==", "!="}
+_ARITH_OPS = {"+", "-", "*", "/", "%"}
+_NAN = object()     # Double.NaN / Float.NaN 的占位
+_KNOWN_CONSTANTS = {
+    "Integer.MAX_VALUE": 2 ** 31 - 1, "Integer.MIN_VALUE": -2 ** 31,
+    "Long.MAX_VALUE": 2 ** 63 - 1, "Long.MIN_VALUE": -2 ** 63,
+    "Double.MAX_VALUE": 1.7976931348623157e308, "Double.MIN_VALUE": 4.9e-324,
+    "Math.PI": 3.141592653589793, "Math.E": 2.718281828459045,
+}
+
+
+class _Unsupported(Exception):
+    """原子无法用算术理论建模，保持为自由布尔变量"""
+
+
+# --------------------------------------------------
+# 声明收集：参数、局部变量、所在类的字段
+# --------------------------------------------------
+def _base_type(type_text: str) -> str:
+    return type_text.split("<", 1)[0].strip()
+
+
+def _literal(n: Node, code: bytes):
+    text = code[n.start_byte:n.end_byte].decode().replace("_", "")
+    base = {"decimal_integer_literal": 10, "hex_integer_literal": 16,
+            "octal_integer_literal": 8, "binary_integer_literal": 2}.get(n.type)
+    try:
+        if base is not None:
+            text = text.rstrip("lL")
+            return int(text[2:] if base in (16, 2) else text, base)
+        if n.type == "decimal_floating_point_literal":
+            return float(text.rstrip("fFdD"))
+    except ValueError:
+        return None
+    return None
+
+
+def _field_declarations(method: Node) -> List[Node]:
+    """所在类的字段声明（由外向内，内层类的字段覆盖外层）"""
+    classes = []
+    p = method.parent
+    while p is not None:
+        if p.type in ("class_body", "enum_body_declarations", "interface_body"):
+            classes.append(p)
+        p = p.parent
+    return [c for body in reversed(classes) for c in body.named_children
+            if c.type in ("field_declaration", "constant_declaration")]
+
+
+def fields_hash(method: Node, code: bytes) -> str:
+    """所在类字段声明源码的哈希；具体取值依赖字段类型和常量，增量复用时与方法体哈希一起比较"""
+    h = hashlib.sha1()
+    for decl in _field_declarations(method):
+        h.update(code[decl.start_byte:decl.end_byte])
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def declared_types(method: Node, code: bytes) -> Tuple[Dict[str, str], Dict[str, Any]]:
+    """
+    返回 (types, constants)
+    types    : {变量名: 类型源码}，方法内的声明覆盖同名字段
+    constants: {final 变量名: 数值}，仅收集用数值字面量初始化的 final 字段/局部变量
+    """
+    types: Dict[str, str] = {}
+    constants: Dict[str, Any] = {}
+
+    def declare(decl: Node):
+        t = decl.child_by_field_name("type")
+        if t is None:
+            return
+        type_text = code[t.start_byte:t.end_byte].decode()
+        is_final = any(c.type == "modifiers" and b"final" in code[c.start_byte:c.end_byte] for c in decl.children)
+        for d in decl.children_by_field_name("declarator"):
+            name = d.child_by_field_name("name")
+            key = code[name.start_byte:name.end_byte].decode()
+            dims = d.child_by_field_name("dimensions")
+            types[key] = type_text + (code[dims.start_byte:dims.end_byte].decode() if dims else "")
+            value = d.child_by_field_name("value")
+            lit = _literal(value, code) if is_final and value is not None else None
+            if lit is not None:
+                constants[key] = lit
+            else:
+                constants.pop(key, None)        # 同名的非常量声明遮蔽外层常量
+
+    for decl in _field_declarations(method):
+        declare(decl)
+
+    stack = [method]
+    while stack:
+        n = stack.pop()
+        if n.type in ("formal_parameter", "spread_parameter", "catch_formal_parameter", "enhanced_for_statement"):
+            t = n.child_by_field_name("type")
+            name = n.child_by_field_name("name")
+            if t is not None and name is not None:
+                dims = n.child_by_field_name("dimensions")
+                types[code[name.start_byte:name.end_byte].decode()] = \
+                    code[t.start_byte:t.end_byte].decode() + (code[dims.start_byte:dims.end_byte].decode() if dims else "")
+        elif n.type == "local_variable_declaration":
+            declare(n)
+        stack.extend(n.named_children)
+    return types, constants
+
+
+# --------------------------------------------------
+# 原子 → 算术约束
+# --------------------------------------------------
+class ConcreteSynthesizer:
+    def __init__(self, types: Dict[str, str], constants: Dict[str, Any], parser: Parser,
+                 timeout_ms: int = 2000):
+        self.types = types
+        self.constants = constants
+        self.parser = parser
+        self.timeout_ms = timeout_ms
+        self.terms: Dict[str, z3.ExprRef] = {}      # 源码 → Z3 变量，同一方法内共享
+        self.nonneg: List[z3.ExprRef] = []          # 长度类变量的非负约束
+
+    # ---------------- 变量 ----------------
+    def _var(self, name: str, sort: str) -> z3.ExprRef:
+        v = self.terms.get(name)
+        if v is None:
+            if sort == "int":
+                v = z3.Int(name)
+            elif sort == "bool":
+                v = z3.Bool(name)
+            else:
+                v = z3.Real(name)
+            self.terms[name] = v
+        return v
+
+    def _length(self, name: str) -> z3.ExprRef:
+        fresh = name not in self.terms
+        v = self._var(name, "int")
+        if fresh:
+            self.nonneg.append(v >= 0)
+        return v
+
+    def _sort_of(self, ident: str) -> str:
+        t = _base_type(self.types.get(ident, ""))
+        if t in _INT_TYPES:
+            return "int"
+        if t in _BOOL_TYPES:
+            return "bool"
+        return "real"
+
+    def _text(self, n: Node, code: bytes) -> str:
+        return code[n.start_byte:n.end_byte].decode()
+
+    # ---------------- 数值项 ----------------
+    def _term(self, n: Node, code: bytes):
+        t = n.type
+        if t == "parenthesized_expression" and n.named_child_count == 1:
+            return self._term(n.named_children[0], code)
+        if t in ("decimal_integer_literal", "hex_integer_literal", "octal_integer_literal",
+                 "binary_integer_literal", "decimal_floating_point_literal"):
+            lit = _literal(n, code)
+            if lit is None:
+                raise _Unsupported(t)
+            return z3.IntVal(lit) if isinstance(lit, int) else z3.RealVal(lit)
+        if t == "character_literal":
+            text = self._text(n, code)[1:-1]
+            if len(text) != 1:
+                raise _Unsupported(t)
+            return z3.IntVal(ord(text))
+        text = self._text(n, code)
+        if text in ("Double.NaN", "Float.NaN"):
+            return _NAN
+        if text in _KNOWN_CONSTANTS:
+            value = _KNOWN_CONSTANTS[text]
+            return z3.IntVal(value) if isinstance(value, int) else z3.RealVal(value)
+        if t == "identifier":
+            if text in self.constants:
+                value = self.constants[text]
+                return z3.IntVal(value) if isinstance(value, int) else z3.RealVal(value)
+            sort = self._sort_of(text)
+            if sort == "bool":
+                raise _Unsupported(text)
+            return self._var(text, sort)
+        if t == "field_access":
+            field = n.child_by_field_name("field")
+            obj = n.child_by_field_name("object")
+            fname = self._text(field, code)
+            if fname == "length":
+                return self._length(text)
+            if obj is not None and obj.type == "this":
+                return self._term(field, code)      # this.x 与 x 共用一个变量
+            return self._var(text, "real")
+        if t == "method_invocation":
+            name = self._text(n.child_by_field_name("name"), code)
+            args = n.child_by_field_name("arguments")
+            if name in ("length", "size") and args is not None and args.named_child_count == 0:
+                return self._length(text)
+            return self._var(text, "real")
+        if t == "array_access":
+            return self._var(text, "real")
+        if t == "cast_expression":
+            inner = self._term(n.child_by_field_name("value"), code)
+            cast = _base_type(self._text(n.child_by_field_name("type"), code))
+            if inner is _NAN:
+                return inner
+            return z3.ToInt(inner) if cast in _INT_TYPES and z3.is_real(inner) else inner
+        if t == "unary_expression":
+            op = n.child_by_field_name("operator").type
+            arg = self._term(n.child_by_field_name("operand"), code)
+            if arg is _NAN or op not in ("-", "+"):
+                raise _Unsupported(text)
+            return -arg if op == "-" else arg
+        if t == "binary_expression":
+            op = n.child_by_field_name("operator").type
+            if op not in _ARITH_OPS:
+                raise _Unsupported(text)
+            a = self._term(n.child_by_field_name("left"), code)
+            b = self._term(n.child_by_field_name("right"), code)
+            if a is _NAN or b is _NAN:
+                return _NAN
+            if op == "+":
+                return a + b
+            if op == "-":
+                return a - b
+            if op == "*":
+                return a * b
+            if op == "/":
+                return a / b
+            if not (z3.is_int(a) and z3.is_int(b)):
+                raise _Unsupported(text)
+            return a % b
+        raise _Unsupported(text)
+
+    # ---------------- 原子 ----------------
+    def atom_constraint(self, atom: str) -> Optional[z3.BoolRef]:
+        code = f"{atom};".encode()
+        root = self.parser.parse(code).root_node
+        stmt = root.named_children[0] if root.named_child_count else None
+        if stmt is None or stmt.type != "expression_statement" or not stmt.named_child_count:
+            return None
+        n = stmt.named_children[0]
+        while n.type == "parenthesized_expression" and n.named_child_count == 1:
+            n = n.named_children[0]
+        try:
+            return self._atom(n, code)
+        except (_Unsupported, z3.Z3Exception, RecursionError):
+            return None
+
+    def _atom(self, n: Node, code: bytes) -> z3.BoolRef:
+        t = n.type
+        if t == "identifier":
+            text = self._text(n, code)
+            if self._sort_of(text) != "bool":
+                raise _Unsupported(text)
+            return self._var(text, "bool")
+        if t == "method_invocation":
+            name = self._text(n.child_by_field_name("name"), code)
+            obj = n.child_by_field_name("object")
+            args = n.child_by_field_name("arguments")
+            if name == "isEmpty" and obj is not None and args.named_child_count == 0:
+                # String 用 length()，其余按集合用 size()，与同一方法里的长度原子共享变量
+                otext = self._text(obj, code)
+                size = "length()" if _base_type(self.types.get(otext, "")) == "String" else "size()"
+                return self._length(f"{otext}.{size}") == 0
+            raise _Unsupported(name)
+        if t != "binary_expression":
+            raise _Unsupported(t)
+        op = n.child_by_field_name("operator").type
+        if op not in _COMPARE_OPS:
+            raise _Unsupported(op)
+        left, right = n.child_by_field_name("left"), n.child_by_field_name("right")
+        if op in ("==", "!=") and "null_literal" in (left.type, right.type):
+            other = right if left.type == "null_literal" else left
+            while other.type == "parenthesized_expression" and other.named_child_count == 1:
+                other = other.named_children[0]
+            if other.type == "null_literal":
+                return z3.BoolVal(op == "==")
+            is_null = self._var(f"{self._text(other, code)} == null", "bool")
+            return is_null if op == "==" else z3.Not(is_null)
+        a, b = self._term(left, code), self._term(right, code)
+        if a is _NAN or b is _NAN:
+            return z3.BoolVal(op == "!=")       # NaN 与任何数比较都为 false，!= 为 true
+        if op == "<":
+            return a < b
+        if op == "<=":
+            return a <= b
+        if op == ">":
+            return a > b
+        if op == ">=":
+            return a >= b
+        return a == b if op == "==" else a != b
+
+    # ---------------- 求解 ----------------
+    def _constraints(self, atoms: List[str]) -> Dict[str, Optional[z3.BoolRef]]:
+        return {f"AT{k}": self.atom_constraint(a) for k, a in enumerate(atoms)}
+
+    def _solve(self, constraints: Dict[str, Optional[z3.BoolRef]],
+               vec: Dict[str, bool]) -> Tuple[z3.CheckSatResult, Optional[Dict[str, Any]]]:
+        s = z3.Solver()
+        s.set("timeout", self.timeout_ms)
+        s.add(*self.nonneg)
+        used = []
+        for name, value in vec.items():
+            c = constraints.get(name)
+            if c is None:
+                continue
+            s.add(c if value else z3.Not(c))
+            used.append(c)
+        status = s.check()
+        return status, (self._values(s.model(), used) if status == z3.sat else None)
+
+    def synthesize(self, atoms: List[str], vectors: List[Dict[str, bool]]) -> Optional[List[Optional[Dict[str, Any]]]]:
+        """
+        atoms 与 AT0..ATn 一一对应；返回与 vectors 对齐的具体取值列表，
+        不可实现（或超时）的向量为 None；没有任何原子可以建模时返回 None
+        """
+        constraints = self._constraints(atoms)
+        if all(c is None for c in constraints.values()):
+            return None
+        return [self._solve(constraints, vec)[1] for vec in vectors]
+
+    def feasible_pairs(self, atoms: List[str], pairs: Dict[str, list]) -> Dict[str, list]:
+        """
+        去掉含不可实现向量的候选对，供向量精简在可实现的对里挑选；
+        某个原子的候选对全部不可实现时保留原样（超时按可实现处理）
+        """
+        constraints = self._constraints(atoms)
+        if all(c is None for c in constraints.values()):
+            return pairs
+        memo: Dict[tuple, bool] = {}
+
+        def ok(vec: Dict[str, bool]) -> bool:
+            key = tuple(sorted(vec.items()))
+            if key not in memo:
+                memo[key] = self._solve(constraints, vec)[0] != z3.unsat
+            return memo[key]
+
+        return {a: [p for p in found if ok(p[0]) and ok(p[1])] or found for a, found in pairs.items()}
+
+    def _values(self, model: z3.ModelRef, used: List[z3.BoolRef]) -> Dict[str, Any]:
+        names = set()
+        for c in used:
+            stack = [c]
+            while stack:
+                e = stack.pop()
+                if z3.is_const(e) and e.decl().kind() == z3.Z3_OP_UNINTERPRETED:
+                    names.add(e.decl().name())
+                stack.extend(e.children())
+        values: Dict[str, Any] = {}
+        for name in sorted(names):
+            v = model.eval(self.terms[name], model_completion=True)
+            if name.endswith(" == null"):
+                values[name[:-len(" == null")]] = None if z3.is_true(v) else "!= null"
+            elif z3.is_int_value(v):
+                values[name] = v.as_long()
+            elif z3.is_rational_value(v):
+                values[name] = v.numerator_as_long() / v.denominator_as_long()
+            elif z3.is_algebraic_value(v):
+                values[name] = float(v.approx(10).as_decimal(10).rstrip("?"))
+            else:
+                values[name] = z3.is_true(v)
+        return values
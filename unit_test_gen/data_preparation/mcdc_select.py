@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+MC/DC 测试向量精简
+- 求解器为每个原子给出若干候选独立影响对，任选其一即可覆盖该原子
+- 在候选对里挑一组向量，使每个原子至少有一对的两个向量都被选中，且向量总数尽量少
+- 贪心：从一个种子向量出发，优先加入能与已选向量配对覆盖最多原子的单个向量，
+  没有这样的向量时再加入覆盖最多的一整对；取度数最高的若干个种子各跑一遍，保留最小的结果
+- unique-cause 下向量数的下界为 原子数 + 1，贪心结果通常就在下界附近
+"""
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+Pair = Tuple[Dict[str, bool], Dict[str, bool]]
+Vector = Tuple[bool, ...]
+
+# 贪心尝试的种子个数
+SELECT_RESTARTS = 4
+
+
+def _key(ctx: Dict[str, bool], var_names: Sequence[str]) -> Vector:
+    return tuple(bool(ctx.get(a, False)) for a in var_names)
+
+
+def _greedy(cand: Dict[str, List[Tuple[Vector, Vector]]],
+            by_vec: Dict[Vector, List[Tuple[str, Vector]]], seed: Optional[Vector]) -> Set[Vector]:
+    chosen: Set[Vector] = set()
+    covered: Set[str] = set()
+
+    def add(v: Vector):
+        chosen.add(v)
+        for b, other in by_vec[v]:
+            if other in chosen:
+                covered.add(b)
+
+    if seed is not None:
+        add(seed)
+    while len(covered) < len(cand):
+        # 单个向量：与已选向量配对后能新覆盖的原子
+        gains: Dict[Vector, Set[str]] = defaultdict(set)
+        for v in chosen:
+            for b, other in by_vec[v]:
+                if b not in covered and other not in chosen:
+                    gains[other].add(b)
+        if gains:
+            add(max(sorted(gains), key=lambda o: len(gains[o])))
+            continue
+        # 没有可配对的单个向量时，加入覆盖原子最多的一整对
+        best, best_gain = None, -1
+        for a, found in cand.items():
+            if a in covered:
+                continue
+            for kt, kf in found:
+                hit = {b for v in (kt, kf) for b, other in by_vec[v]
+                       if b not in covered and (other in chosen or other in (kt, kf))}
+                if len(hit) > best_gain:
+                    best, best_gain = (kt, kf), len(hit)
+        for v in best:
+            add(v)
+    return chosen
+
+
+def select_vectors(pairs: Dict[str, List[Pair]], var_names: Sequence[str],
+                   restarts: int = SELECT_RESTARTS) -> List[Dict[str, bool]]:
+    """返回覆盖所有有候选对的原子的向量集合（按字典序排列）"""
+    cand: Dict[str, List[Tuple[Vector, Vector]]] = {}
+    by_vec: Dict[Vector, List[Tuple[str, Vector]]] = defaultdict(list)   # 向量 → (原子, 配对向量)
+    for a in var_names:
+        found = pairs.get(a) or []
+        if not found:
+            continue
+        cand[a] = []
+        for t, f in found:
+            kt, kf = _key(t, var_names), _key(f, var_names)
+            cand[a].append((kt, kf))
+            by_vec[kt].append((a, kf))
+            by_vec[kf].append((a, kt))
+    if not cand:
+        return []
+
+    # 种子：参与覆盖的原子最多的向量
+    seeds = sorted(by_vec, key=lambda v: (-len({a for a, _ in by_vec[v]}), v))[:max(1, restarts)]
+    best = min((_greedy(cand, by_vec, s) for s in seeds), key=len)
+    return [dict(zip(var_names, v)) for v in sorted(best)]
+
+
+def first_pair_vectors(pairs: Dict[str, List[Pair]], var_names: Sequence[str]) -> List[Dict[str, bool]]:
+    """不做精简时的输出：每个原子取第一组独立影响对，去重后的并集"""
+    seen = set()
+    for found in pairs.values():
+        if found:
+            seen.update(_key(ctx, var_names) for ctx in found[0])
+    return [dict(zip(var_names, v)) for v in sorted(seen)]
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+MC/DC 位并行真值表引擎
+- 把 to_z3 得到的 Z3 布尔表达式编译成一段后序指令（只编译一次）
+- 每个原子对应一列打包位向量（NumPy uint8，每字节 8 个赋值）
+- 一次性在全部 2^n 个赋值上求值，再把原子取真/取假的两半列做 XOR 找独立影响对
+- 表达式里出现非纯布尔结构时抛出 UnsupportedExpr，由调用方回退到 Z3 逐个求解
+"""
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import z3
+
+# 真值表最多支持的原子个数（2^22 行，每列 512KB）
+MAX_TRUTH_TABLE_ATOMS = 22
+
+# 第 k 位（k < 3）在一个字节内的取值模式，位序为 little（行 0 对应 bit0）
+_LOW_BIT_PATTERNS = (0xAA, 0xCC, 0xF0)
+# 第 k 位取 False 的行在字节内的掩码
+_LOW_BIT_ZERO_MASKS = (0x55, 0x33, 0x0F)
+
+
+class UnsupportedExpr(Exception):
+    """表达式中含有真值表引擎无法处理的节点"""
+
+
+# --------------------------------------------------
+# 编译：Z3 表达式 → 后序指令
+# 每条指令为 (op, args)，args 为前面指令的下标或变量下标
+# --------------------------------------------------
+def compile_expr(z3_expr: z3.BoolRef, var_names: Sequence[str]) -> List[Tuple[str, tuple]]:
+    var_index = {name: i for i, name in enumerate(var_names)}
+    program: List[Tuple[str, tuple]] = []
+    slot: Dict[int, int] = {}           # ast id → 指令下标
+
+    stack = [(z3_expr, False)]
+    while stack:
+        e, expanded = stack.pop()
+        eid = e.get_id()
+        if eid in slot:
+            continue
+        if not z3.is_bool(e):
+            raise UnsupportedExpr(f"非布尔子式: {e}")
+        kind = e.decl().kind() if z3.is_app(e) else None
+
+        if kind == z3.Z3_OP_TRUE:
+            slot[eid] = len(program); program.append(("const", (True,)))
+            continue
+        if kind == z3.Z3_OP_FALSE:
+            slot[eid] = len(program); program.append(("const", (False,)))
+            continue
+        if kind == z3.Z3_OP_UNINTERPRETED and e.num_args() == 0:
+            name = e.decl().name()
+            if name not in var_index:
+                raise UnsupportedExpr(f"未知原子: {name}")
+            slot[eid] = len(program); program.append(("var", (var_index[name],)))
+            continue
+
+        if kind == z3.Z3_OP_AND:
+            op = "and"
+        elif kind == z3.Z3_OP_OR:
+            op = "or"
+        elif kind == z3.Z3_OP_NOT:
+            op = "not"
+        elif kind == z3.Z3_OP_XOR:
+            op = "xor"
+        elif kind == z3.Z3_OP_IMPLIES:
+            op = "implies"
+        elif kind == z3.Z3_OP_ITE:
+            op = "ite"
+        elif kind == z3.Z3_OP_EQ and z3.is_bool(e.arg(0)):
+            op = "iff"
+        else:
+            raise UnsupportedExpr(f"不支持的运算: {e.decl()}")
+
+        children = [e.arg(i) for i in range(e.num_args())]
+        if not expanded:
+            stack.append((e, True))
+            stack.extend((c, False) for c in reversed(children))
+            continue
+        slot[eid] = len(program)
+        program.append((op, tuple(slot[c.get_id()] for c in children)))
+
+    return program
+
+
+# --------------------------------------------------
+# 求值：在给定的列（打包位向量）上执行指令
+# --------------------------------------------------
+def evaluate(program: List[Tuple[str, tuple]], columns: List[np.ndarray], nbytes: int) -> np.ndarray:
+    regs: List[np.ndarray] = []
+    for op, args in program:
+        if op == "var":
+            out = columns[args[0]]
+        elif op == "const":
+            out = np.full(nbytes, 0xFF if args[0] else 0x00, dtype=np.uint8)
+        elif op == "not":
+            out = np.invert(regs[args[0]])
+        elif op == "and":
+            out = regs[args[0]].copy()
+            for a in args[1:]:
+                np.bitwise_and(out, regs[a], out=out)
+        elif op == "or":
+            out = regs[args[0]].copy()
+            for a in args[1:]:
+                np.bitwise_or(out, regs[a], out=out)
+        elif op == "xor":
+            out = regs[args[0]].copy()
+            for a in args[1:]:
+                np.bitwise_xor(out, regs[a], out=out)
+        elif op == "implies":
+            out = np.invert(regs[args[0]]) | regs[args[1]]
+        elif op == "ite":
+            c = regs[args[0]]
+            out = (c & regs[args[1]]) | (np.invert(c) & regs[args[2]])
+        elif op == "iff":
+            out = np.invert(regs[args[0]] ^ regs[args[1]])
+        else:
+            raise UnsupportedExpr(op)
+        regs.append(out)
+    return regs[-1]
+
+
+# --------------------------------------------------
+# 真值表：第 i 个原子对应行号的第 (n-1-i) 位
+# 这样行号递增的顺序与 itertools.product(其余原子) 的枚举顺序一致
+# --------------------------------------------------
+def _var_column(n: int, i: int) -> np.ndarray:
+    rows = 1 << n
+    nbytes = max(1, rows >> 3)
+    k = n - 1 - i
+    if k < 3:
+        return np.full(nbytes, _LOW_BIT_PATTERNS[k], dtype=np.uint8)
+    run = 1 << (k - 3)                  # 连续 0x00 / 0xFF 的字节数
+    return np.tile(np.repeat(np.array([0x00, 0xFF], dtype=np.uint8), run), nbytes // (2 * run))
+
+
+def truth_table(z3_expr: z3.BoolRef, var_names: Sequence[str]) -> np.ndarray:
+    """返回表达式在全部 2^n 个赋值上的打包位向量"""
+    n = len(var_names)
+    if n > MAX_TRUTH_TABLE_ATOMS:
+        raise UnsupportedExpr(f"原子数 {n} 超过真值表上限 {MAX_TRUTH_TABLE_ATOMS}")
+    program = compile_expr(z3_expr, var_names)
+    columns = [_var_column(n, i) for i in range(n)]
+    return evaluate(program, columns, max(1, (1 << n) >> 3))
+
+
+def _diff_rows(table: np.ndarray, n: int, i: int, limit: int) -> np.ndarray:
+    """原子 i 取 False 的行中，翻转原子 i 会改变结果的行号（升序，最多 limit 个）"""
+    k = n - 1 - i
+    if k < 3:
+        diff = (table ^ (table >> (1 << k))) & _LOW_BIT_ZERO_MASKS[k]
+    else:
+        run = 1 << (k - 3)
+        t3 = table.reshape(-1, 2, run)
+        diff = np.zeros_like(t3)
+        np.bitwise_xor(t3[:, 0, :], t3[:, 1, :], out=diff[:, 0, :])
+        diff = diff.reshape(-1)
+
+    rows = 1 << n
+    nz = np.flatnonzero(diff)[:limit]
+    if nz.size == 0:
+        return nz
+    bits = np.unpackbits(diff[nz][:, None], axis=1, bitorder="little").astype(bool)
+    hits = (nz[:, None] * 8 + np.arange(8))[bits]
+    return hits[hits < rows][:limit]
+
+
+def _row_to_ctx(row: int, n: int, var_names: Sequence[str]) -> Dict[str, bool]:
+    return {name: bool((row >> (n - 1 - m)) & 1) for m, name in enumerate(var_names)}
+
+
+def independence_pairs(z3_expr: z3.BoolRef, var_names: Sequence[str],
+                       max_pairs: int = 1) -> Dict[str, List[Tuple[Dict[str, bool], Dict[str, bool]]]]:
+    """
+    对每个原子返回最多 max_pairs 个独立影响对 (原子取 True 的赋值, 原子取 False 的赋值)
+    每个原子内按其余原子的字典序排列，第一个即 Z3 逐个枚举时找到的那一组
+    """
+    n = len(var_names)
+    table = truth_table(z3_expr, var_names)
+    pairs = {}
+    for i, a in enumerate(var_names):
+        found = []
+        for row in _diff_rows(table, n, i, max_pairs):
+            ctx_false = _row_to_ctx(int(row), n, var_names)
+            ctx_true = {**ctx_false, a: True}
+            found.append((ctx_true, ctx_false))
+        pairs[a] = found
+    return pairs
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+MC/DC 结果的流式读写
+- 每算完一个方法就写出一条记录，不在内存里攒整份 summary 再一次性 json.dumps(indent=2)
+- 先写到临时文件，结束时 commit 原子替换；没有任何变化时 discard，保留原文件
+- 三种格式，读出来都是 {方法名: 方法记录}：
+    json   : 一个 JSON 对象，每个方法一行（默认，与原来的 *_mcdc_cfg.json 兼容）
+    ndjson : 每行一个 {"method": 方法名, ...方法记录}
+    bin    : pickle 记录流 (方法名, 方法记录)，体积小、读写最快，仅供 Python 端复用
+"""
+import json
+import os
+import pickle
+from pathlib import Path
+from typing import Any, Dict
+
+MCDC_FORMATS = ("json", "ndjson", "bin")
+_SUFFIX = {"json": ".json", "ndjson": ".ndjson", "bin": ".bin"}
+
+
+def summary_path(out_dir: Path, java_name: str, fmt: str = "json") -> Path:
+    return Path(out_dir) / f"{java_name}_mcdc_cfg{_SUFFIX[fmt]}"
+
+
+class SummaryWriter:
+    def __init__(self, path: Path, fmt: str = "json"):
+        if fmt not in MCDC_FORMATS:
+            raise ValueError(f"未知的输出格式: {fmt}")
+        self.path = Path(path)
+        self.fmt = fmt
+        self._tmp = self.path.with_name(self.path.name + f".{os.getpid()}.tmp")
+        self._f = open(self._tmp, "wb" if fmt == "bin" else "w", encoding=None if fmt == "bin" else "utf-8")
+        self._count = 0
+        if fmt == "json":
+            self._f.write("{")
+
+    def write(self, sig: str, entry: Dict[str, Any]):
+        if self.fmt == "json":
+            self._f.write(("," if self._count else "") + "\n" + json.dumps(sig, ensure_ascii=False)
+                          + ": " + json.dumps(entry, ensure_ascii=False))
+        elif self.fmt == "ndjson":
+            self._f.write(json.dumps({"method": sig, **entry}, ensure_ascii=False) + "\n")
+        else:
+            pickle.dump((sig, entry), self._f, protocol=pickle.HIGHEST_PROTOCOL)
+        self._count += 1
+
+    def commit(self):
+        if self.fmt == "json":
+            self._f.write("\n}\n")
+        self._f.close()
+        os.replace(self._tmp, self.path)
+
+    def discard(self):
+        self._f.close()
+        self._tmp.unlink(missing_ok=True)
+
+
+def load_summary(path: Path, fmt: str = "json") -> Dict[str, Any]:
+    """读取上次的结果；文件不存在或损坏时返回空字典"""
+    try:
+        if fmt == "json":
+            return json.loads(Path(path).read_text(encoding="utf-8"))
+        summary: Dict[str, Any] = {}
+        if fmt == "ndjson":
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        summary[entry.pop("method")] = entry
+            return summary
+        with open(path, "rb") as f:
+            while True:
+                try:
+                    sig, entry = pickle.load(f)
+                except EOFError:
+                    return summary
+                summary[sig] = entry
+    except (OSError, ValueError, KeyError, pickle.UnpicklingError):
+        return {}
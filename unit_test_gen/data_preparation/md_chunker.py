@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+流式 markdown 切块
+- 逐行读文件句柄，不把整份文件读成一个字符串；缓冲区最多一个 chunk 的内容，每个文件占用的内存恒定
+- 每个 chunk 带标题路径 tags = [父标题1, ..., 当前标题]，与原 parse_markdown 的输出格式一致
+- 超过 max_tokens 的章节按行切成多块，相邻块之间重叠约 overlap 个 token；单行过长时再按字符切开
+- 不足 min_tokens 的小块与后面同一父标题下的块合并（tags 取两者的公共前缀，小块的子标题写进正文）
+- max_tokens 包含拼在正文前面的 tags 行，保证整段送进 embedding 模型时不会被截断
+"""
+import re
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+HEADING_RE = re.compile(r"^(#{1,6})\s+(.*)")
+# 无 tokenizer 时的近似：一个汉字或一个标点算一个 token，字母数字串按每 4 个字符一个 token 计
+_TOKEN_RE = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]|[A-Za-z0-9_]+|[^\sA-Za-z0-9_]")
+# [CLS] / [SEP] 等特殊 token 以及 tags 与正文之间分隔符的余量
+_RESERVED_TOKENS = 4
+
+TokenCounter = Callable[[str], int]
+
+
+def approx_token_count(text: str) -> int:
+    return sum((len(t) + 3) // 4 for t in _TOKEN_RE.findall(text))
+
+
+def make_token_counter(model=None) -> TokenCounter:
+    """优先用 embedding 模型自带的 tokenizer 计数"""
+    tok = getattr(model, "tokenizer", None)
+    if tok is not None and callable(getattr(tok, "encode", None)):
+        return lambda text: len(tok.encode(text, add_special_tokens=False))
+    return approx_token_count
+
+
+def chunk_text(record: Dict) -> str:
+    """送进 embedding 模型的文本：tags 路径 + 正文"""
+    return f"{' / '.join(record['tags'])}\n\n{record['text']}"
+
+
+class MarkdownChunker:
+    __slots__ = ("max_tokens", "overlap", "min_tokens", "count")
+
+    def __init__(self, max_tokens: int = 512, overlap: int = 64, min_tokens: int = 32,
+                 count_tokens: TokenCounter = approx_token_count):
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+        self.min_tokens = min_tokens
+        self.count = count_tokens
+
+    def config(self) -> List[int]:
+        """写进 manifest，切块参数变了需要重新切块"""
+        return [self.max_tokens, self.overlap, self.min_tokens]
+
+    def _budget(self, tags: List[str]) -> int:
+        return max(16, self.max_tokens - self.count(" / ".join(tags)) - _RESERVED_TOKENS)
+
+    def _split_line(self, line: str, budget: int) -> Iterator[str]:
+        """单行超过 budget 时按字符切；每个 token 至少对应一个字符，所以 budget 个字符不会超过 budget 个 token"""
+        if self.count(line) <= budget:
+            yield line
+            return
+        for i in range(0, len(line), budget):
+            yield line[i:i + budget]
+
+    def chunks(self, lines: Iterable[str]) -> Iterator[Dict]:
+        """lines 可以直接是打开的文件句柄"""
+        stack: List[tuple] = []
+        buf: List[tuple] = []            # (行, token 数)
+        state = {"tokens": 0, "fresh": 0}
+        pending: List[Optional[Dict]] = [None]
+
+        def merge(chunk: Dict) -> Iterator[Dict]:
+            """小块先挂起，与下一块合并；合不进去时单独输出"""
+            prev = pending[0]
+            if prev is not None:
+                prefix = _common_prefix(prev["tags"], chunk["tags"])
+                tokens = prev["tokens"] + chunk["tokens"]
+                if prefix and tokens <= self._budget(prefix):
+                    chunk = {"text": _inline(prev, prefix) + "\n\n" + _inline(chunk, prefix),
+                             "tags": prefix, "tokens": tokens}
+                else:
+                    yield _public(prev)
+                pending[0] = None
+            if chunk["tokens"] < self.min_tokens:
+                pending[0] = chunk
+            else:
+                yield _public(chunk)
+
+        def emit(final: bool) -> Iterator[Dict]:
+            if not stack or not state["fresh"]:
+                if final:
+                    buf.clear()
+                    state["tokens"] = state["fresh"] = 0
+                return
+            text = "\n".join(line for line, _ in buf).strip()
+            if text:
+                yield from merge({"text": text, "tags": [t for _, t in stack], "tokens": state["tokens"]})
+            if final:
+                buf.clear()
+                state["tokens"] = 0
+            else:
+                # 保留末尾不超过 overlap 个 token 的行作为下一块的开头
+                kept, total = [], 0
+                for line, t in reversed(buf):
+                    if total + t > self.overlap:
+                        break
+                    kept.append((line, t))
+                    total += t
+                buf[:] = kept[::-1]
+                state["tokens"] = total
+            state["fresh"] = 0
+
+        for raw in lines:
+            line = raw.rstrip("\r\n")
+            m = HEADING_RE.match(line)
+            if m:
+                yield from emit(final=True)
+                level = len(m.group(1))
+                while stack and stack[-1][0] >= level:
+                    stack.pop()
+                stack.append((level, m.group(2).strip()))
+                continue
+            if not stack:
+                continue
+            budget = self._budget([t for _, t in stack])
+            for piece in self._split_line(line, budget):
+                t = self.count(piece)
+                if state["tokens"] + t > budget and state["fresh"]:
+                    yield from emit(final=False)
+                while buf and state["tokens"] + t > budget:      # 重叠部分放不下新行时丢掉
+                    state["tokens"] -= buf.pop(0)[1]
+                buf.append((piece, t))
+                state["tokens"] += t
+                state["fresh"] += 1
+        yield from emit(final=True)
+        if pending[0] is not None:
+            yield _public(pending[0])
+
+
+def _common_prefix(a: List[str], b: List[str]) -> List[str]:
+    prefix = []
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        prefix.append(x)
+    return prefix
+
+
+def _inline(chunk: Dict, prefix: List[str]) -> str:
+    rest = chunk["tags"][len(prefix):]
+    return f"{' / '.join(rest)}\n{chunk['text']}" if rest else chunk["text"]
+
+
+def _public(chunk: Dict) -> Dict:
+    return {"text": chunk["text"], "tags": chunk["tags"]}
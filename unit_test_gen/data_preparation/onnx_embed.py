@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+int8 量化的 ONNX embedding 后端（CPU）
+- 首次使用时把 SentenceTransformer 模型导出为 ONNX，再做动态 int8 量化，结果缓存在 onnx_models/<模型名>/ 下，
+  之后加载只需要 onnxruntime + tokenizer，不再初始化 PyTorch 模型
+- OnnxEmbedder 提供与 SentenceTransformer 相同的 encode / get_sentence_embedding_dimension / max_seq_length / tokenizer，
+  可直接替换 DataBaseConstructor 和 Retriever 里的模型
+- 池化方式（cls / mean）沿用原模型的 Pooling 配置，bge 系列为 cls
+- 量化会带来少量误差，换后端前先跑一遍校验：
+    python -m unit_test_gen.data_preparation.onnx_embed --check --index_dir unit_test_gen/data_preparation/db_data_nasa
+  比较 fp32 与 int8 向量的余弦相似度，以及在同一批 chunk 上检索的 top-k 重合率
+依赖 onnxruntime（可选依赖，只有选用该后端时才需要安装）
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+ONNX_MODEL_DIR = Path(__file__).resolve().parent / "onnx_models"
+ONNX_PREFIX = "onnx-int8:"
+DEFAULT_BATCH_SIZE = 32
+
+
+def model_spec(embed_model: str, embed_backend: str = "torch") -> str:
+    """后端与模型名合成一个字符串，用于模型缓存、embedding 缓存和 manifest（两种后端的向量不能混用）"""
+    if embed_backend == "torch":
+        return embed_model
+    if embed_backend == "onnx":
+        return ONNX_PREFIX + embed_model
+    raise ValueError(f"未知的 embedding 后端: {embed_backend}（可选 torch / onnx）")
+
+
+def split_spec(spec: str):
+    """返回 (后端, 模型名)"""
+    if spec.startswith(ONNX_PREFIX):
+        return "onnx", spec[len(ONNX_PREFIX):]
+    return "torch", spec
+
+
+def export_dir(model_name: str) -> Path:
+    return ONNX_MODEL_DIR / re.sub(r"[^\w.-]+", "_", model_name)
+
+
+def _require_onnxruntime():
+    try:
+        import onnxruntime
+    except ImportError as e:
+        raise ImportError("embed_backend=\"onnx\" 需要 onnxruntime，请先 pip install onnxruntime") from e
+    return onnxruntime
+
+
+def export_quantized(model_name: str, out_dir: Optional[Path] = None) -> Path:
+    """导出 fp32 ONNX → 动态 int8 量化，返回输出目录；已存在时直接返回"""
+    out_dir = Path(out_dir or export_dir(model_name))
+    if (out_dir / "model_int8.onnx").exists() and (out_dir / "config.json").exists():
+        return out_dir
+    _require_onnxruntime()
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(out_dir, exist_ok=True)
+    st = SentenceTransformer(model_name, device="cpu")
+    transformer, tokenizer = st[0].auto_model.eval(), st.tokenizer
+    pooling = st[1].get_pooling_mode_str() if len(st) > 1 and hasattr(st[1], "get_pooling_mode_str") else "cls"
+    input_names = list(tokenizer.model_input_names)
+
+    class _Wrapper(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs)))[0]
+
+    dummy = tokenizer(["导出用的示例文本"], return_tensors="pt")
+    fp32_path = out_dir / "model_fp32.onnx"
+    with torch.no_grad():
+        torch.onnx.export(_Wrapper(transformer), tuple(dummy[n] for n in input_names), str(fp32_path),
+                          input_names=input_names, output_names=["last_hidden_state"],
+                          dynamic_axes={n: {0: "batch", 1: "seq"} for n in input_names + ["last_hidden_state"]},
+                          opset_version=14)
+    quantize_dynamic(str(fp32_path), str(out_dir / "model_int8.onnx"), weight_type=QuantType.QInt8)
+    fp32_path.unlink()
+    tokenizer.save_pretrained(str(out_dir))
+    config = {"model": model_name, "pooling": pooling, "max_seq_length": st.max_seq_length,
+              "dim": st.get_sentence_embedding_dimension(), "input_names": input_names}
+    (out_dir / "config.json").write_text(json.dumps(config, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"✅ 已导出 int8 ONNX 模型: {out_dir}")
+    return out_dir
+
+
+class OnnxEmbedder:
+    """
+    model_name: 与 SentenceTransformer 相同的模型名，未导出时自动导出
+    threads   : onnxruntime 的 intra-op 线程数，None 表示由 onnxruntime 决定
+    batch_size: encode 未指定 batch_size 时的默认值
+    """
+
+    def __init__(self, model_name: str, threads: Optional[int] = None, batch_size: int = DEFAULT_BATCH_SIZE):
+        ort = _require_onnxruntime()
+        from transformers import AutoTokenizer
+
+        path = export_quantized(model_name)
+        self.config = json.loads((path / "config.json").read_text(encoding="utf-8"))
+        self.tokenizer = AutoTokenizer.from_pretrained(str(path))
+        self.max_seq_length = self.config["max_seq_length"]
+        self.batch_size = batch_size
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(str(path / "model_int8.onnx"), options, providers=["CPUExecutionProvider"])
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dim"]
+
+    def _pool(self, hidden: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        if self.config["pooling"] == "mean":
+            m = mask[..., None].astype(hidden.dtype)
+            return (hidden * m).sum(axis=1) / np.maximum(m.sum(axis=1), 1e-9)
+        return hidden[:, 0]
+
+    def encode(self, texts: List[str], batch_size: Optional[int] = None, convert_to_numpy: bool = True,
+               normalize_embeddings: bool = True, **_) -> np.ndarray:
+        batch_size = batch_size or self.batch_size
+        out = np.zeros((len(texts), self.get_sentence_embedding_dimension()), dtype="float32")
+        # 按长度排序后分批，减少 padding
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            enc = self.tokenizer([texts[i] for i in rows], padding=True, truncation=True,
+                                 max_length=self.max_seq_length, return_tensors="np")
+            feeds = {n: enc[n].astype("int64") for n in self.config["input_names"]}
+            hidden = self.session.run(None, feeds)[0]
+            out[rows] = self._pool(hidden, enc["attention_mask"])
+        if normalize_embeddings:
+            out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        return out
+
+
+# --------------------------------------------------
+# fp32 / int8 一致性校验
+# --------------------------------------------------
+def check_fidelity(model_name: str, texts: List[str], queries: List[str], top_k: int = 5,
+                   threads: Optional[int] = None) -> Dict[str, float]:
+    """texts 作为检索库，queries 作为查询；返回余弦相似度统计、top-k 重合率和两种后端的编码耗时"""
+    from sentence_transformers import SentenceTransformer
+
+    fp32 = SentenceTransformer(model_name, device="cpu")
+    int8 = OnnxEmbedder(model_name, threads=threads)
+    timing = {}
+    vecs = {}
+    for name, model in (("fp32", fp32), ("int8", int8)):
+        start = time.perf_counter()
+        vecs[name] = (np.asarray(model.encode(texts, convert_to_numpy=True, normalize_embeddings=True), dtype="float32"),
+                      np.asarray(model.encode(queries, convert_to_numpy=True, normalize_embeddings=True), dtype="float32"))
+        timing[name] = time.perf_counter() - start
+    cos = np.sum(vecs["fp32"][0] * vecs["int8"][0], axis=1)
+    k = min(top_k, len(texts))
+    top = {name: np.argsort(-(q @ d.T), axis=1)[:, :k] for name, (d, q) in vecs.items()}
+    overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(top["fp32"], top["int8"])])
+    return {"cos_mean": float(cos.mean()), "cos_min": float(cos.min()), "topk_overlap": float(overlap),
+            "fp32_s": timing["fp32"], "int8_s": timing["int8"]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="int8 ONNX embedding 后端")
+    parser.add_argument("--embed_model", default="BAAI/bge-small-zh-v1.5", help="embedding 模型")
+    parser.add_argument("--export", action="store_true", help="只导出并量化模型")
+    parser.add_argument("--check", action="store_true", help="与 fp32 模型比较 top-k 结果")
+    parser.add_argument("--index_dir", type=Path, default=Path(__file__).resolve().parent / "db_data_nasa",
+                        help="校验时用该知识库中的 chunk 作为检索库和查询")
+    parser.add_argument("--samples", type=int, default=200, help="校验使用的 chunk 数")
+    parser.add_argument("--top_k", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=0.1, help="允许的 top-k 不重合比例")
+    parser.add_argument("--threads", type=int, default=None, help="onnxruntime 线程数")
+    args = parser.parse_args()
+
+    if args.export:
+        export_quantized(args.embed_model)
+    if args.check:
+        from unit_test_gen.data_preparation.md_chunker import chunk_text
+        from unit_test_gen.data_preparation.record_store import RecordStore
+
+        store = RecordStore(args.index_dir)
+        records = [r for _, r in zip(range(args.samples), (r for _, r in store.items()))]
+        texts = [chunk_text(r) for r in records]
+        # 以每个 chunk 的标题路径作为查询，接近实际检索时的短查询
+        queries = [" ".join(r["tags"]) for r in records]
+        stats = check_fidelity(args.embed_model, texts, queries, args.top_k, args.threads)
+        print(f"余弦相似度 平均 {stats['cos_mean']:.4f} 最小 {stats['cos_min']:.4f}")
+        print(f"top-{args.top_k} 重合率 {stats['topk_overlap']:.3f}")
+        print(f"编码耗时 fp32 {stats['fp32_s']:.2f}s  int8 {stats['int8_s']:.2f}s")
+        if stats["topk_overlap"] < 1 - args.tolerance:
+            print(f"[warn] top-k 重合率低于 {1 - args.tolerance:.2f}，不建议切换到 int8 后端")
+            sys.exit(1)
+        print("✅ int8 后端与 fp32 结果一致")
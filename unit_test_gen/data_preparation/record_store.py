@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+知识库 chunk 的列式存储，取代 records.pkl / records.json / meta.json 三份重复数据
+    records.<版本>.blob : 所有 chunk 依次拼接的 UTF-8 字节，每条为 正文 + 元信息 JSON（tags、source 等正文以外的字段）
+    records.<版本>.idx  : .npy 结构化数组，按 id 升序，每行 (id, 偏移, 正文字节数, 元信息字节数)
+    records.current     : 当前版本号；重写时先写新版本的两个文件，再原子替换这一个指针文件，
+                          读者看到的 blob 和偏移表总是同一版本（没有指针文件时读旧布局 records.blob / records.idx）
+两者都以内存映射方式打开，检索时只解码返回的 top_k 条，内存和加载时间不随知识库增大
+records.json / records.pkl 只作为可选的导出视图（export_records），程序本身不再读取
+"""
+import json
+import mmap
+import os
+import pickle
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import numpy as np
+
+BLOB_NAME = "records.blob"
+TABLE_NAME = "records.idx"
+CURRENT_NAME = "records.current"
+_TABLE_DTYPE = np.dtype([("id", "<i8"), ("off", "<i8"), ("text_len", "<i4"), ("meta_len", "<i4")])
+# 旧版本的产物，写入新存储后删除，避免与新数据不一致
+LEGACY_FILES = ("records.pkl", "records.json", "meta.json")
+
+
+def _version_paths(index_dir: Path, version: str) -> Tuple[Path, Path]:
+    return index_dir / f"records.{version}.blob", index_dir / f"records.{version}.idx"
+
+
+def _current_version(index_dir: Path) -> Optional[str]:
+    try:
+        return (index_dir / CURRENT_NAME).read_text(encoding="utf-8").strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def current_files(index_dir: Path) -> Optional[Tuple[Path, Path]]:
+    """当前版本的 (blob, 偏移表) 路径，知识库里还没有记录时返回 None"""
+    index_dir = Path(index_dir)
+    version = _current_version(index_dir)
+    if version:
+        return _version_paths(index_dir, version)
+    blob, table = index_dir / BLOB_NAME, index_dir / TABLE_NAME
+    return (blob, table) if table.exists() else None
+
+
+def write_records(index_dir: Path, records: Dict[int, Dict[str, Any]]):
+    """
+    整体重写，records: {id: {"text": ..., "tags": [...], ...}}
+    新版本写到带版本号的文件名，写完后原子替换 records.current 切换过去；
+    上一个版本保留，刚读到旧指针、还没打开文件的读者仍能打开，更早的版本删除
+    """
+    index_dir = Path(index_dir)
+    previous = _current_version(index_dir)
+    version = uuid.uuid4().hex[:12]
+    blob_path, table_path = _version_paths(index_dir, version)
+    ids = sorted(records)
+    table = np.zeros(len(ids), dtype=_TABLE_DTYPE)
+    off = 0
+    with open(blob_path, "wb") as f:
+        for row, cid in enumerate(ids):
+            record = records[cid]
+            text = record.get("text", "").encode("utf-8")
+            meta = json.dumps({k: v for k, v in record.items() if k != "text"}, ensure_ascii=False).encode("utf-8")
+            f.write(text)
+            f.write(meta)
+            table[row] = (cid, off, len(text), len(meta))
+            off += len(text) + len(meta)
+    with open(table_path, "wb") as f:
+        np.save(f, table)
+    pointer_tmp = index_dir / (CURRENT_NAME + ".tmp")
+    pointer_tmp.write_text(version, encoding="utf-8")
+    os.replace(pointer_tmp, index_dir / CURRENT_NAME)
+
+    keep = {version, previous}
+    stale = [p for p in index_dir.glob("records.*.blob") if p.name.split(".")[1] not in keep]
+    stale += [p for p in index_dir.glob("records.*.idx") if p.name.split(".")[1] not in keep]
+    if previous is not None:
+        # 旧布局只在第一次切换到版本化文件时还有读者，之后一并清理
+        stale += [index_dir / BLOB_NAME, index_dir / TABLE_NAME]
+    stale += [index_dir / name for name in LEGACY_FILES]
+    for path in stale:
+        try:
+            path.unlink(missing_ok=True)
+        except OSError:
+            pass        # Windows 上仍被其他进程映射的文件删不掉，下次重写时再删
+
+
+class RecordStore:
+    """只读视图；按 id 随机访问，打开时不解码任何记录"""
+
+    def __init__(self, index_dir: Path):
+        index_dir = Path(index_dir)
+        if current_files(index_dir) is None and (index_dir / "records.pkl").exists():
+            migrate_legacy(index_dir)
+        for attempt in range(3):
+            files = current_files(index_dir)
+            if files is None:
+                raise FileNotFoundError(f"{index_dir} 下没有 records 存储")
+            blob_path, table_path = files
+            try:
+                self.table = np.load(table_path, mmap_mode="r")
+                self._f = open(blob_path, "rb")
+                break
+            except FileNotFoundError:
+                # 读到指针后这一版本又被连续两次重写清理掉了，重新读指针（同一版本的两个文件必须都打开成功）
+                if attempt == 2:
+                    raise
+        blob_size = os.fstat(self._f.fileno()).st_size
+        self.nbytes = blob_size + self.table.nbytes
+        # 空文件不能 mmap
+        self.blob = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ) if blob_size else b""
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def __contains__(self, cid: int) -> bool:
+        return self._row(cid) is not None
+
+    def _row(self, cid: int) -> Optional[int]:
+        ids = self.table["id"]
+        row = int(np.searchsorted(ids, cid))
+        return row if row < len(ids) and ids[row] == cid else None
+
+    def _decode(self, row: int) -> Dict[str, Any]:
+        _, off, text_len, meta_len = self.table[row]
+        off, text_len, meta_len = int(off), int(text_len), int(meta_len)
+        record = json.loads(self.blob[off + text_len:off + text_len + meta_len].decode("utf-8"))
+        return {"text": self.blob[off:off + text_len].decode("utf-8"), **record}
+
+    def get(self, cid: int) -> Optional[Dict[str, Any]]:
+        row = self._row(cid)
+        return None if row is None else self._decode(row)
+
+    def __getitem__(self, cid: int) -> Dict[str, Any]:
+        record = self.get(cid)
+        if record is None:
+            raise KeyError(cid)
+        return record
+
+    def items(self) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        for row in range(len(self.table)):
+            yield int(self.table["id"][row]), self._decode(row)
+
+    def to_dict(self) -> Dict[int, Dict[str, Any]]:
+        return dict(self.items())
+
+    def close(self):
+        if isinstance(self.blob, mmap.mmap):
+            self.blob.close()
+        self._f.close()
+
+
+def migrate_legacy(index_dir: Path):
+    """旧版知识库（records.pkl，列表或 {id: record}）就地转换为列式存储"""
+    with open(Path(index_dir) / "records.pkl", "rb") as f:
+        records = pickle.load(f)
+    if isinstance(records, list):
+        records = dict(enumerate(records))
+    write_records(index_dir, records)
+
+
+def export_records(index_dir: Path, fmt: str = "json"):
+    """导出视图：records.json（便于人工查看）或 records.pkl"""
+    index_dir = Path(index_dir)
+    store = RecordStore(index_dir)
+    try:
+        records = store.to_dict()
+    finally:
+        store.close()
+    if fmt == "json":
+        with open(index_dir / "records.json", "w", encoding="utf-8") as f:
+            json.dump(records, f, ensure_ascii=False, indent=2)
+    elif fmt == "pkl":
+        with open(index_dir / "records.pkl", "wb") as f:
+            pickle.dump(records, f)
+    else:
+        raise ValueError(f"未知的导出格式: {fmt}")
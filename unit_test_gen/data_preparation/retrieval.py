@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+常驻检索服务
+- 每个进程只加载一次 embedding 模型，索引和 record 存储都以内存映射方式只读打开，
+  查询时只解码返回的 top_k 条记录
+- 也可以作为本地守护进程运行，通过 Unix socket 提供服务，多个批处理进程共享同一份模型和索引：
+    python -m unit_test_gen.data_preparation.retrieval --serve --socket /tmp/utgen_retrieval.sock
+  设置环境变量 UTGEN_RETRIEVAL_SOCKET 后，search() 优先走守护进程，连不上时回退到进程内检索
+- 多项目：每个项目一个命名空间，输入为 reverse_data_<ns>/，知识库为 db_data_<ns>/（默认 nasa）；
+  知识库在第一次查询时才打开，常驻的知识库按 LRU 淘汰：总占用超过 UTGEN_KB_CACHE_MB，
+  或空闲超过 UTGEN_KB_IDLE_S 秒的先关闭，下次查询时重新打开
+- 协议：每行一个 JSON 请求 {"query": ..., "top_k": ...} 或 {"queries": [...], "top_k": ...}，可带 "namespace"
+  和 "embed_model"（客户端建库用的模型，与守护进程加载的不一致时拒绝，避免用别的模型的向量去查），
+  每行一个 JSON 响应 {"results": [...]}（批量时为每条查询一个列表）或 {"error": ...}
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import socket
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import faiss
+import numpy as np
+
+from unit_test_gen.data_preparation.embed_cache import get_embedding_cache
+from unit_test_gen.data_preparation.record_store import RecordStore
+from unit_test_gen.data_preparation.onnx_embed import DEFAULT_BATCH_SIZE, OnnxEmbedder, model_spec, split_spec
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path(__file__).resolve().parent
+DEFAULT_NAMESPACE = "nasa"
+DEFAULT_INDEX_DIR = DATA_DIR / f"db_data_{DEFAULT_NAMESPACE}"
+DEFAULT_EMBED_MODEL = "BAAI/bge-small-zh-v1.5"
+SOCKET_ENV = "UTGEN_RETRIEVAL_SOCKET"
+KB_CACHE_MB_ENV = "UTGEN_KB_CACHE_MB"
+KB_IDLE_S_ENV = "UTGEN_KB_IDLE_S"
+DEFAULT_KB_CACHE_MB = 2048
+DEFAULT_KB_IDLE_S = 1800
+
+
+def _check_namespace(namespace: str) -> str:
+    if not re.fullmatch(r"[\w-]+", namespace):
+        raise ValueError(f"非法的知识库命名空间: {namespace!r}")
+    return namespace
+
+
+def namespace_index_dir(namespace: str = DEFAULT_NAMESPACE) -> Path:
+    """命名空间对应的知识库目录"""
+    return DATA_DIR / f"db_data_{_check_namespace(namespace)}"
+
+
+def namespace_source_dir(namespace: str = DEFAULT_NAMESPACE) -> Path:
+    """命名空间对应的 markdown 输入目录（FileGenerator 的输出）"""
+    return DATA_DIR / f"reverse_data_{_check_namespace(namespace)}"
+
+class EmbedModelMismatch(ValueError):
+    """守护进程加载的 embedding 模型与客户端知识库使用的不一致"""
+
+
+_MODELS: Dict[str, Any] = {}
+_MODEL_LOCK = threading.Lock()
+
+
+def get_embed_model(name: str = DEFAULT_EMBED_MODEL, threads: Optional[int] = None,
+                    batch_size: Optional[int] = None):
+    """
+    进程内共享的 embedding 模型，同名模型只加载一次
+    name 带 onnx-int8: 前缀（见 onnx_embed.model_spec）时使用 int8 ONNX 后端，threads / batch_size 仅在首次加载时生效
+    """
+    with _MODEL_LOCK:
+        model = _MODELS.get(name)
+        if model is None:
+            backend, model_name = split_spec(name)
+            if backend == "onnx":
+                model = OnnxEmbedder(model_name, threads=threads, batch_size=batch_size or DEFAULT_BATCH_SIZE)
+            else:
+                from sentence_transformers import SentenceTransformer
+                model = SentenceTransformer(model_name)
+            _MODELS[name] = model
+        return model
+
+
+class Retriever:
+    """
+    index_dir  : construct_faiss 的输出目录（index.faiss + records.current 指向的 blob / 偏移表）
+    embed_model: 必须与建库时使用的模型一致（int8 ONNX 后端建的库用 model_spec(模型名, "onnx")）
+    """
+
+    def __init__(self, index_dir: Path = DEFAULT_INDEX_DIR, embed_model: str = DEFAULT_EMBED_MODEL):
+        self.index_dir = Path(index_dir)
+        self.embed_model_name = embed_model
+        self.model = get_embed_model(embed_model)
+        self.embed_cache = get_embedding_cache(embed_model, self.model.get_sentence_embedding_dimension())
+        self._lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.reload()
+
+    def reload(self):
+        """重新打开索引和 records（知识库重建后调用）"""
+        index = faiss.read_index(str(self.index_dir / "index.faiss"), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        # 旧的 RecordStore 可能仍被进行中的查询使用，不主动关闭，随引用释放
+        records = RecordStore(self.index_dir)
+        # 按文件大小估计常驻后的占用，用于 LRU 淘汰
+        nbytes = (self.index_dir / "index.faiss").stat().st_size + records.nbytes
+        with self._lock:
+            self.index, self.records, self.nbytes = index, records, nbytes
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(texts, convert_to_numpy=True, normalize_embeddings=True).astype("float32")
+
+    def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        """返回 top_k 条记录，每条附带相似度 score"""
+        return self.search_many([query], top_k)[0]
+
+    def search_many(self, queries: List[str], top_k: int = 5) -> List[List[Dict[str, Any]]]:
+        """批量检索：一次前向编码全部查询，一次 FAISS 检索，结果与 queries 一一对应"""
+        if not queries:
+            return []
+        self.last_used = time.monotonic()
+        vectors = self.embed_cache.encode_queries(queries, self.encode)
+        with self._lock:
+            index, records = self.index, self.records
+        distances, indices = index.search(vectors, top_k)
+        results = []
+        for row_d, row_i in zip(distances, indices):
+            hits = []
+            for score, idx in zip(row_d, row_i):
+                if idx < 0:
+                    break
+                hits.append({**records[int(idx)], "score": float(score)})
+            results.append(hits)
+        return results
+
+
+_RETRIEVERS: "OrderedDict[tuple, Retriever]" = OrderedDict()
+_RETRIEVER_LOCK = threading.Lock()
+
+
+def _evict(keep: tuple):
+    """先关空闲超时的，再按 LRU 关到总占用不超过上限；刚用到的 keep 不淘汰。调用方持有 _RETRIEVER_LOCK"""
+    budget = float(os.getenv(KB_CACHE_MB_ENV, DEFAULT_KB_CACHE_MB)) * 2 ** 20
+    idle_s = float(os.getenv(KB_IDLE_S_ENV, DEFAULT_KB_IDLE_S))
+    now = time.monotonic()
+    for key in [k for k, r in _RETRIEVERS.items() if k != keep and idle_s > 0 and now - r.last_used > idle_s]:
+        del _RETRIEVERS[key]
+    total = sum(r.nbytes for r in _RETRIEVERS.values())
+    for key in list(_RETRIEVERS):
+        if total <= budget:
+            break
+        if key != keep:
+            # 进行中的查询仍持有引用，可以安全地从表里移除
+            total -= _RETRIEVERS.pop(key).nbytes
+
+
+def get_retriever(index_dir: Path = DEFAULT_INDEX_DIR, embed_model: str = DEFAULT_EMBED_MODEL) -> Retriever:
+    """懒加载：第一次查询某个知识库时才打开，之后按 LRU 常驻"""
+    key = (str(Path(index_dir).resolve()), embed_model)
+    with _RETRIEVER_LOCK:
+        r = _RETRIEVERS.get(key)
+        if r is None:
+            r = _RETRIEVERS[key] = Retriever(index_dir, embed_model)
+        else:
+            _RETRIEVERS.move_to_end(key)
+        r.last_used = time.monotonic()
+        _evict(keep=key)
+        return r
+
+
+def loaded_knowledge_bases() -> List[str]:
+    """当前常驻的知识库目录，按最近使用排序（最近的在后）"""
+    with _RETRIEVER_LOCK:
+        return [k[0] for k in _RETRIEVERS]
+
+
+def invalidate_retriever(index_dir: Path):
+    """知识库重建后丢弃该目录的常驻 Retriever，下次查询时重新打开"""
+    prefix = str(Path(index_dir).resolve())
+    with _RETRIEVER_LOCK:
+        for key in [k for k in _RETRIEVERS if k[0] == prefix]:
+            del _RETRIEVERS[key]
+
+
+# --------------------------------------------------
+# Unix socket 守护进程
+# --------------------------------------------------
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                req = json.loads(line)
+                index_dir = namespace_index_dir(req["namespace"]) if req.get("namespace") else self.server.index_dir
+                if req.get("reload"):
+                    invalidate_retriever(index_dir)
+                    resp = {"results": []}
+                elif req.get("embed_model") and req["embed_model"] != self.server.embed_model:
+                    resp = {"error": f"embedding 模型不一致：请求 {req['embed_model']}，守护进程为 {self.server.embed_model}",
+                            "embed_model": self.server.embed_model}
+                else:
+                    retriever = get_retriever(index_dir, self.server.embed_model)
+                    if "queries" in req:
+                        resp = {"results": retriever.search_many(list(req["queries"]), int(req.get("top_k", 5)))}
+                    else:
+                        resp = {"results": retriever.search(req["query"], int(req.get("top_k", 5)))}
+            except Exception as e:
+                resp = {"error": f"{type(e).__name__}: {e}"}
+            self.wfile.write((json.dumps(resp, ensure_ascii=False) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+def serve(socket_path: str, index_dir: Path = DEFAULT_INDEX_DIR, embed_model: str = DEFAULT_EMBED_MODEL):
+    if not hasattr(socket, "AF_UNIX"):
+        raise RuntimeError("当前平台不支持 Unix socket，请使用进程内的 get_retriever()")
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    with Server(socket_path, _Handler) as server:
+        # 默认知识库预先打开，其余命名空间在第一次查询时打开
+        server.index_dir, server.embed_model = Path(index_dir), embed_model
+        retriever = get_retriever(index_dir, embed_model)
+        logger.info("检索服务已启动: %s（默认知识库 %d 个 chunk）", socket_path, retriever.index.ntotal)
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(socket_path)
+
+
+class RetrievalClient:
+    """守护进程的客户端，保持一条长连接"""
+
+    def __init__(self, socket_path: str, timeout: float = 30.0):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(socket_path)
+        self._r = self.sock.makefile("rb")
+
+    def _call(self, req: Dict[str, Any]) -> List[Dict[str, Any]]:
+        self.sock.sendall((json.dumps(req, ensure_ascii=False) + "\n").encode("utf-8"))
+        resp = json.loads(self._r.readline())
+        if "error" in resp:
+            raise (EmbedModelMismatch if "embed_model" in resp else RuntimeError)(resp["error"])
+        return resp["results"]
+
+    def search(self, query: str, top_k: int = 5, namespace: Optional[str] = None,
+               embed_model: Optional[str] = None) -> List[Dict[str, Any]]:
+        return self._call({"query": query, "top_k": top_k, "namespace": namespace, "embed_model": embed_model})
+
+    def search_many(self, queries: List[str], top_k: int = 5, namespace: Optional[str] = None,
+                    embed_model: Optional[str] = None) -> List[List[Dict[str, Any]]]:
+        return self._call({"queries": list(queries), "top_k": top_k, "namespace": namespace,
+                           "embed_model": embed_model})
+
+    def reload(self, namespace: Optional[str] = None):
+        self._call({"reload": True, "namespace": namespace})
+
+    def close(self):
+        self._r.close()
+        self.sock.close()
+
+
+_CLIENT: Optional[RetrievalClient] = None
+
+
+def search(query: str, top_k: int = 5, index_dir: Path = DEFAULT_INDEX_DIR,
+           embed_model: str = DEFAULT_EMBED_MODEL, namespace: Optional[str] = None) -> List[Dict[str, Any]]:
+    """检索入口：配置了守护进程 socket 时走守护进程，否则在本进程内检索"""
+    return search_many([query], top_k, index_dir, embed_model, namespace)[0]
+
+
+def search_many(queries: List[str], top_k: int = 5, index_dir: Path = DEFAULT_INDEX_DIR,
+                embed_model: str = DEFAULT_EMBED_MODEL, namespace: Optional[str] = None) -> List[List[Dict[str, Any]]]:
+    """
+    批量检索入口，不打印；返回值与 queries 一一对应，每条命中附带 score
+    namespace 指定项目知识库（db_data_<namespace>），优先于 index_dir
+    """
+    global _CLIENT
+    queries = list(queries)
+    if namespace:
+        index_dir = namespace_index_dir(namespace)
+    socket_path = os.getenv(SOCKET_ENV)
+    if queries and socket_path and hasattr(socket, "AF_UNIX"):
+        try:
+            if _CLIENT is None:
+                _CLIENT = RetrievalClient(socket_path)
+            # 守护进程只认命名空间；未指定时按目录名推出，否则用守护进程的默认知识库
+            if not namespace and Path(index_dir).name.startswith("db_data_"):
+                namespace = Path(index_dir).name[len("db_data_"):]
+            return _CLIENT.search_many(queries, top_k, namespace, embed_model)
+        except EmbedModelMismatch as e:
+            # 连接本身没问题，保留；只是这个知识库要用本进程的模型检索
+            logger.warning("%s，改为进程内检索", e)
+        except (OSError, ValueError) as e:
+            logger.warning("检索服务不可用（%s），改为进程内检索", e)
+            _CLIENT = None
+    return get_retriever(index_dir, embed_model).search_many(queries, top_k)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="知识库检索服务")
+    parser.add_argument("--serve", action="store_true", help="以守护进程方式运行")
+    parser.add_argument("--socket", default=os.getenv(SOCKET_ENV, "/tmp/utgen_retrieval.sock"), help="Unix socket 路径")
+    parser.add_argument("--index_dir", type=Path, default=DEFAULT_INDEX_DIR, help="知识库目录（守护进程的默认知识库）")
+    parser.add_argument("--namespace", default=None, help="项目命名空间，等价于 --index_dir db_data_<namespace>")
+    parser.add_argument("--embed_model", default=DEFAULT_EMBED_MODEL, help="embedding 模型")
+    parser.add_argument("--embed_backend", choices=["torch", "onnx"], default="torch", help="embedding 后端，须与建库时一致")
+    parser.add_argument("--embed_threads", type=int, default=None, help="onnx 后端的推理线程数")
+    parser.add_argument("--query", default=None, help="不启动服务，直接检索一次")
+    parser.add_argument("--top_k", type=int, default=5)
+    parser.add_argument("--log_level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="日志级别")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format="[%(levelname)s] %(message)s")
+    args.embed_model = model_spec(args.embed_model, args.embed_backend)
+    if args.namespace:
+        args.index_dir = namespace_index_dir(args.namespace)
+    get_embed_model(args.embed_model, threads=args.embed_threads)
+    if args.serve:
+        serve(args.socket, args.index_dir, args.embed_model)
+    else:
+        start = time.time()
+        for hit in search(args.query or "如何根据历史轨迹数据，预测未来的轨迹？", args.top_k, args.index_dir, args.embed_model):
+            print(f"{hit['score']:.4f}  {' / '.join(hit['tags'])}")
+        print(f"耗时 {time.time() - start:.3f}s")
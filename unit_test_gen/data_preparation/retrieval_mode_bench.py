@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+检索模式对比：abs（CODE_ABS 摘要检索）vs code / summary（由源码直接构造查询）
+- 延迟：abs 为 LLM 摘要耗时 + 检索耗时；code / summary 为本地构造查询耗时 + 检索耗时
+- 重合率：code / summary 的 top-k 结果与 abs 的 top-k 结果的交集比例
+    python -m unit_test_gen.data_preparation.retrieval_mode_bench --java_dir java_project/src/main/java/org/example
+--abs_file 保存 LLM 摘要及其耗时，再次运行时直接复用，不重复调用 LLM
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from dotenv import load_dotenv
+
+from unit_test_gen.data_preparation.code_query import build_query
+from unit_test_gen.data_preparation.retrieval import DEFAULT_INDEX_DIR, search
+from unit_test_gen.llm_gateway import complete, get_gateway
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _key(hit: Dict) -> tuple:
+    return hit.get("source"), tuple(hit["tags"]), hit["text"]
+
+
+def llm_abstract(model: str, template: str, code: str) -> Dict:
+    start = time.perf_counter()
+    # 不走 LLM 缓存，测的是真实的摘要耗时
+    content = complete(model, [{"role": "user", "content": template.format(code=code)}], cache=False,
+                       temperature=0.9)
+    return {"abs": content.strip(), "seconds": time.perf_counter() - start}
+
+
+def bench(java_files: List[Path], abstracts: Dict[str, Dict], top_k: int, index_dir: Path):
+    rows = []
+    for path in java_files:
+        code = path.read_text(encoding="utf-8")
+        start = time.perf_counter()
+        base = search(abstracts[path.name]["abs"], top_k, index_dir)
+        row = {"file": path.name, "abs_s": abstracts[path.name]["seconds"] + time.perf_counter() - start}
+        base_keys = {_key(h) for h in base}
+        for mode in ("code", "summary"):
+            start = time.perf_counter()
+            hits = search(build_query(code, mode), top_k, index_dir)
+            row[f"{mode}_s"] = time.perf_counter() - start
+            row[f"{mode}_overlap"] = len(base_keys & {_key(h) for h in hits}) / max(1, len(base_keys))
+        rows.append(row)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="检索模式的延迟与结果重合率对比")
+    parser.add_argument("--java_dir", type=Path, default=ROOT.parent / "java_project" / "src" / "main" / "java" / "gov" / "nasa" / "alsUtility", help="待测 Java 源码目录")
+    parser.add_argument("--index_dir", type=Path, default=DEFAULT_INDEX_DIR, help="知识库目录")
+    parser.add_argument("--abs_file", type=Path, default=Path("retrieval_mode_abs.json"), help="LLM 摘要缓存文件")
+    parser.add_argument("--model", default="kimi-latest", help="生成摘要的 LLM")
+    parser.add_argument("--top_k", type=int, default=5)
+    args = parser.parse_args()
+
+    load_dotenv()
+    import yaml
+    with open(ROOT / "prompt_template.yaml", "r", encoding="utf-8") as f:
+        template = yaml.safe_load(f)["CODE_ABS"]
+    abstracts = json.loads(args.abs_file.read_text(encoding="utf-8")) if args.abs_file.exists() else {}
+    java_files = sorted(args.java_dir.glob("*.java"))
+    missing = [p for p in java_files if p.name not in abstracts]
+    if missing:
+        for p in missing:
+            abstracts[p.name] = llm_abstract(args.model, template, p.read_text(encoding="utf-8"))
+        get_gateway().report()
+        args.abs_file.write_text(json.dumps(abstracts, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    rows = bench(java_files, abstracts, args.top_k, args.index_dir)
+    print(f"{'文件':<36}{'abs s':>8}{'code s':>8}{'重合':>6}{'summary s':>11}{'重合':>6}")
+    for r in rows:
+        print(f"{r['file']:<36}{r['abs_s']:>8.2f}{r['code_s']:>8.3f}{r['code_overlap']:>6.2f}{r['summary_s']:>11.3f}{r['summary_overlap']:>6.2f}")
+    if rows:
+        mean = {k: sum(r[k] for r in rows) / len(rows) for k in rows[0] if k != "file"}
+        print(f"{'平均':<36}{mean['abs_s']:>8.2f}{mean['code_s']:>8.3f}{mean['code_overlap']:>6.2f}{mean['summary_s']:>11.3f}{mean['summary_overlap']:>6.2f}")
@@ -1,5 +1,6 @@
 from unit_test_gen.data_preparation.db_construct import DataBaseConstructor
 from unit_test_gen.data_preparation.file_generator import FileGenerator
+from unit_test_gen.llm_gateway import get_gateway
 from pathlib import Path
 import argparse
 
@@ -7,12 +8,26 @@ import argparse
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="构建向量数据库")
     parser.add_argument("--src_proj_dir", type=str, default=None, help="待测项目根目录（不包含test目录）")
+    parser.add_argument("--full", action="store_true", help="忽略上次的构建记录，全量重建知识库")
+    parser.add_argument("--namespace", type=str, default="nasa", help="项目命名空间，知识库输出到 db_data_<namespace>")
+    parser.add_argument("--concurrency", type=int, default=1, help="生成接口文档时并发的 LLM 请求数")
+    parser.add_argument("--rpm", type=int, default=None, help="每分钟最多发出的 LLM 请求数")
+    parser.add_argument("--no_llm_cache", action="store_true", help="不读写 LLM 响应缓存，每次都重新请求")
+    parser.add_argument("--req_mode", choices=["single", "map_reduce"], default="single", help="需求文档生成方式，map_reduce 按包分别生成后合并，适合大项目")
+    parser.add_argument("--stream", action="store_true", help="流式请求，接口文档边生成边写入文件")
+    parser.add_argument("--req_part_tokens", type=int, default=16000, help="map_reduce 模式下每部分接口文档的 token 上限")
+    parser.add_argument("--embed_backend", choices=["torch", "onnx"], default="torch", help="embedding 后端，onnx 为 int8 量化的 CPU 后端")
+    parser.add_argument("--embed_threads", type=int, default=None, help="onnx 后端的推理线程数")
+    parser.add_argument("--export", choices=["json", "pkl"], default=None, help="构建后额外导出 records.json / records.pkl 供查看")
     
     args = parser.parse_args()
     if not args.src_proj_dir:
         args.src_proj_dir = Path(__file__).resolve().parent.parent.parent / "java_project" / "src" / "main" / "java" / "gov" / "nasa" / "alsUtility"
 
-    fg = FileGenerator(src_proj_dir=args.src_proj_dir)
+    fg = FileGenerator(src_proj_dir=args.src_proj_dir, namespace=args.namespace, concurrency=args.concurrency, rpm=args.rpm,
+                       llm_cache=not args.no_llm_cache, req_mode=args.req_mode, req_part_tokens=args.req_part_tokens,
+                       stream=args.stream)
     fg.begin_file_gen()
-    db = DataBaseConstructor()
-    db.construct_faiss()
\ No newline at end of file
+    get_gateway().report()
+    db = DataBaseConstructor(embed_backend=args.embed_backend, embed_threads=args.embed_threads, namespace=args.namespace)
+    db.construct_faiss(full=args.full, export=args.export)
\ No newline at end of file
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+LLM 响应缓存，各阶段共用（接口文档、需求文档、CODE_ABS、用例生成、MC/DC 评估）
+- 键为 (模型, messages, 采样参数, salt) 的 sha256，prompt / 模型 / 参数任何一项变化都不会命中
+- 磁盘上用 SQLite 持久化（默认 unit_test_gen/llm_cache/llm_cache.sqlite），批处理中断后重跑，
+  没有变化的请求全部直接复用
+- 超过 TTL 的条目视为失效；总大小超过上限时按最近使用时间淘汰
+- 通过 llm_gateway.complete() 使用；需要每次都重新采样的调用传 cache=False，错误修复的多轮重试、自洽性投票之类的多次采样用 salt 区分
+- 采样生成（用例生成、错误修复、自洽性投票）的 salt 经 sample_salt() 带上运行 id，每次运行重新采样；
+  UTGEN_LLM_RUN_ID 设为之前某次运行的 id 时复用那次的样本（如批处理崩溃后续跑）
+- 环境变量 UTGEN_LLM_CACHE=off 整体关闭，或指定其他 SQLite 路径；
+  UTGEN_LLM_CACHE_TTL_DAYS / UTGEN_LLM_CACHE_MB 调整 TTL 和大小上限
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+DEFAULT_LLM_CACHE_PATH = Path(__file__).resolve().parent / "llm_cache" / "llm_cache.sqlite"
+LLM_CACHE_ENV = "UTGEN_LLM_CACHE"
+TTL_ENV = "UTGEN_LLM_CACHE_TTL_DAYS"
+SIZE_ENV = "UTGEN_LLM_CACHE_MB"
+RUN_ID_ENV = "UTGEN_LLM_RUN_ID"
+DEFAULT_TTL_DAYS = 30
+DEFAULT_MAX_MB = 512
+
+
+def request_key(model: str, messages: List[Dict[str, Any]], salt: Any = None, **params: Any) -> str:
+    raw = json.dumps({"model": model, "messages": messages, "params": params, "salt": salt},
+                     ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def run_id() -> str:
+    """
+    本次运行的 id：优先读 UTGEN_LLM_RUN_ID，没有时生成一个并写回环境变量，
+    这样批处理脚本启动的子进程共用同一个 id
+    """
+    with _RUN_ID_LOCK:
+        value = os.getenv(RUN_ID_ENV)
+        if not value:
+            value = os.environ[RUN_ID_ENV] = uuid.uuid4().hex[:12]
+            print(f"采样生成的运行 id：{value}（重跑时设置 {RUN_ID_ENV}={value} 复用这次的样本）")
+        return value
+
+
+def sample_salt(salt: Any = None) -> Any:
+    """采样生成用的 salt：同一次运行内按 salt 区分，不同运行之间互不命中"""
+    return [run_id(), salt]
+
+
+class LLMCache:
+    def __init__(self, path: Path = DEFAULT_LLM_CACHE_PATH, ttl_days: float = DEFAULT_TTL_DAYS,
+                 max_mb: float = DEFAULT_MAX_MB):
+        self.ttl_s = ttl_days * 86400
+        self.max_bytes = int(max_mb * 2 ** 20)
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # 多线程共用一个连接（加锁），多进程并发写时等待锁
+        self._db = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, model TEXT, content TEXT NOT NULL, "
+                         "created REAL NOT NULL, last_used REAL NOT NULL, size INTEGER NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache (last_used)")
+        self._db.execute("DELETE FROM llm_cache WHERE created < ?", (time.time() - self.ttl_s,))
+        self._db.commit()
+        self._total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT content, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] < now - self.ttl_s:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, model: str, content: str):
+        now = time.time()
+        size = len(content.encode("utf-8"))
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO llm_cache (key, model, content, created, last_used, size) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", (key, model, content, now, now, size))
+            self._db.commit()
+            self._total += size
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """按最近使用时间删到上限的 90%；调用方持有 _lock"""
+        self._total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        target = self.max_bytes * 0.9
+        doomed = []
+        for key, size in self._db.execute("SELECT key, size FROM llm_cache ORDER BY last_used"):
+            if self._total <= target:
+                break
+            doomed.append((key,))
+            self._total -= size
+        self._db.executemany("DELETE FROM llm_cache WHERE key = ?", doomed)
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_DEFAULT_CACHE: Optional[LLMCache] = None
+_DEFAULT_PID: Optional[int] = None
+_DEFAULT_LOCK = threading.Lock()
+_RUN_ID_LOCK = threading.Lock()
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    """进程内共享的默认缓存，UTGEN_LLM_CACHE=off 时返回 None；fork 出的子进程重新打开"""
+    global _DEFAULT_CACHE, _DEFAULT_PID
+    setting = os.getenv(LLM_CACHE_ENV, "")
+    if setting.lower() in ("0", "off", "false", "no"):
+        return None
+    with _DEFAULT_LOCK:
+        if _DEFAULT_CACHE is None or _DEFAULT_PID != os.getpid():
+            _DEFAULT_CACHE = LLMCache(Path(setting) if setting else DEFAULT_LLM_CACHE_PATH,
+                                      float(os.getenv(TTL_ENV, DEFAULT_TTL_DAYS)),
+                                      float(os.getenv(SIZE_ENV, DEFAULT_MAX_MB)))
+            _DEFAULT_PID = os.getpid()
+        return _DEFAULT_CACHE
+
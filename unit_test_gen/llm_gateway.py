@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+LLM 调用网关，所有模块的聊天请求都经过这里
+- 每个进程只建一个 OpenAI 客户端（底层 HTTP 连接池复用），fork 出的子进程重新创建
+- 429 / 5xx / 超时 / 连接错误自动重试：指数退避加随机抖动，服务端给了 Retry-After 时至少等这么久
+- 请求超时、整个进程的请求数 / token 预算，超出预算抛 BudgetExceeded，不再发请求
+- 记录每次调用的耗时、重试次数和 token 用量，report() 打印汇总
+- complete() 先查 LLM 响应缓存（见 llm_cache.py），命中时不发请求、不计预算
+- stream() 以 stream=True 请求，文本片段到达时交给回调（如 CodeBlockWriter 边收边写文件），
+  回调返回 True 时立即断开、不再生成（这样截断的响应不写入缓存）；记录并打印首 token 延迟，
+  请求服务端返回用量，没有返回（如提前断开）时按文本估算，同样计入 token 预算
+环境变量：
+    MOONSHOT_API_KEY           API key
+    UTGEN_LLM_BASE_URL         接口地址，默认 Moonshot
+    UTGEN_LLM_TIMEOUT          单次请求超时秒数，默认 600
+    UTGEN_LLM_RETRIES          最多重试次数，默认 5
+    UTGEN_LLM_MAX_REQUESTS     进程内最多发出的请求数，默认不限
+    UTGEN_LLM_MAX_TOKENS       进程内最多消耗的 token 数，默认不限
+    UTGEN_LLM_STATS_FILE       每次调用的统计追加写入该 jsonl 文件
+"""
+import email.utils
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+import openai
+from dotenv import load_dotenv
+from openai import OpenAI
+
+from unit_test_gen.data_preparation.md_chunker import approx_token_count
+from unit_test_gen.llm_cache import get_llm_cache, request_key
+
+load_dotenv()
+
+DEFAULT_BASE_URL = "https://api.moonshot.cn/v1"
+DEFAULT_TIMEOUT_S = 600.0
+DEFAULT_RETRIES = 5
+BACKOFF_BASE_S = 1.0
+BACKOFF_MAX_S = 60.0
+# 内存中保留的最近调用记录数，汇总计数不受影响
+STATS_HISTORY = 10000
+_RETRY_STATUS = {408, 409, 429}
+
+
+class BudgetExceeded(RuntimeError):
+    pass
+
+
+class RateLimiter:
+    """每分钟最多 rpm 个请求：相邻两个请求的发出时间至少间隔 60/rpm 秒，多线程共用"""
+
+    def __init__(self, rpm=None):
+        self.interval = 60.0 / rpm if rpm else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class CodeBlockWriter:
+    """
+    流式写出响应中第一个 ```java 代码块的内容，写出的结果与 resp.split("```java")[1].split("```")[0] 相同
+    作为 stream() 的回调：代码块闭合时返回 True，结束生成
+    """
+
+    def __init__(self, path: Path, fence: str = "```java"):
+        self.path = Path(path)
+        self.fence = fence
+        self.found = self.closed = False
+        self._pending = ""
+        self._file = open(self.path, "w", encoding="utf-8")
+
+    def __call__(self, delta: str) -> bool:
+        if self.closed:
+            return True
+        self._pending += delta
+        if not self.found:
+            idx = self._pending.find(self.fence)
+            if idx < 0:
+                # 开头标记可能被切在两个片段之间，保留末尾几个字符
+                self._pending = self._pending[-(len(self.fence) - 1):]
+                return False
+            self.found = True
+            self._pending = self._pending[idx + len(self.fence):]
+        idx = self._pending.find("```")
+        if idx >= 0:
+            self._file.write(self._pending[:idx])
+            self.close()
+            return True
+        keep = 2            # 结束标记同理
+        self._file.write(self._pending[:-keep])
+        self._file.flush()
+        self._pending = self._pending[-keep:]
+        return False
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._file.close()
+
+    def finish(self):
+        """响应结束后调用；没有代码块时报错，代码块没闭合时把剩下的内容写完"""
+        if not self.closed:
+            if self.found:
+                self._file.write(self._pending)
+            self.close()
+        if not self.found:
+            raise ValueError(f"响应中没有 {self.fence} 代码块，已写出空文件 {self.path}")
+
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+def _retry_after(err: Exception) -> Optional[float]:
+    """从响应头读取服务端要求的等待秒数（retry-after-ms / retry-after，后者可以是秒数或 HTTP 日期）"""
+    response = getattr(err, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _retryable(err: Exception) -> bool:
+    if isinstance(err, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError,
+                        openai.InternalServerError)):
+        return True
+    return isinstance(err, openai.APIStatusError) and (err.status_code in _RETRY_STATUS or err.status_code >= 500)
+
+
+class LLMGateway:
+    """
+    api_key / base_url: 默认读 MOONSHOT_API_KEY / UTGEN_LLM_BASE_URL
+    timeout           : 单次请求超时秒数
+    max_retries       : 单个请求最多重试次数
+    max_requests      : 进程内最多发出的请求数（重试也计入），None 表示不限
+    max_tokens        : 进程内最多消耗的 token 数，None 表示不限
+    stats_file        : 每次调用的统计追加写入的 jsonl 文件
+    """
+
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 timeout: float = DEFAULT_TIMEOUT_S, max_retries: int = DEFAULT_RETRIES,
+                 max_requests: Optional[int] = None, max_tokens: Optional[int] = None,
+                 stats_file: Optional[Path] = None):
+        # 重试由网关负责，SDK 自带的重试关掉，避免两层重试叠加
+        self.client = OpenAI(api_key=api_key or os.getenv("MOONSHOT_API_KEY"),
+                             base_url=base_url or os.getenv("UTGEN_LLM_BASE_URL", DEFAULT_BASE_URL),
+                             timeout=timeout, max_retries=0)
+        self.max_retries = max_retries
+        self.max_requests = max_requests
+        self.max_tokens = max_tokens
+        self.stats_file = Path(stats_file) if stats_file else None
+        self._lock = threading.Lock()
+        self.requests = self.retries = self.failures = 0
+        self.prompt_tokens = self.completion_tokens = 0
+        self.history: deque = deque(maxlen=STATS_HISTORY)
+
+    # --------------------------------------------------
+    # 预算与统计
+    # --------------------------------------------------
+    def _reserve(self):
+        """发请求前占用一个请求名额；token 预算在响应返回后结算，已用完时拒绝新请求"""
+        with self._lock:
+            if self.max_requests is not None and self.requests >= self.max_requests:
+                raise BudgetExceeded(f"LLM 请求数已达上限 {self.max_requests}")
+            if self.max_tokens is not None and self.prompt_tokens + self.completion_tokens >= self.max_tokens:
+                raise BudgetExceeded(f"LLM token 用量已达上限 {self.max_tokens}")
+            self.requests += 1
+
+    def _record(self, model: str, seconds: float, attempts: int, usage=None, error: Optional[str] = None,
+                ttft: Optional[float] = None):
+        stat = {"time": time.time(), "model": model, "seconds": round(seconds, 3), "attempts": attempts,
+                "prompt_tokens": getattr(usage, "prompt_tokens", None) or 0,
+                "completion_tokens": getattr(usage, "completion_tokens", None) or 0}
+        if ttft is not None:
+            stat["ttft"] = round(ttft, 3)
+        if error:
+            stat["error"] = error
+        with self._lock:
+            self.retries += attempts - 1
+            self.failures += bool(error)
+            self.prompt_tokens += stat["prompt_tokens"]
+            self.completion_tokens += stat["completion_tokens"]
+            self.history.append(stat)
+            if self.stats_file is not None:
+                self.stats_file.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.stats_file, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(stat, ensure_ascii=False) + "\n")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(s["seconds"] for s in self.history if "error" not in s)
+            ttfts = [s["ttft"] for s in self.history if "ttft" in s]
+            summary = {"requests": self.requests, "retries": self.retries, "failures": self.failures,
+                       "prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens}
+        if latencies:
+            summary.update(latency_mean=sum(latencies) / len(latencies),
+                           latency_p50=latencies[len(latencies) // 2],
+                           latency_p95=latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))])
+        if ttfts:
+            summary["ttft_mean"] = sum(ttfts) / len(ttfts)
+        return summary
+
+    def report(self):
+        s = self.stats()
+        if not s["requests"]:
+            return
+        line = (f"LLM 调用 {s['requests']} 次（重试 {s['retries']}，失败 {s['failures']}），"
+                f"token 输入 {s['prompt_tokens']} / 输出 {s['completion_tokens']}")
+        if "latency_mean" in s:
+            line += f"，耗时 平均 {s['latency_mean']:.2f}s p50 {s['latency_p50']:.2f}s p95 {s['latency_p95']:.2f}s"
+        if "ttft_mean" in s:
+            line += f"，流式首 token 平均 {s['ttft_mean']:.2f}s"
+        print(line)
+
+    # --------------------------------------------------
+    # 调用
+    # --------------------------------------------------
+    @staticmethod
+    def _backoff(attempt: int, err: Exception):
+        # full jitter：在 [0, 指数退避上限] 内随机，服务端要求的等待时间作为下限
+        delay = random.uniform(0, min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** (attempt - 1)))
+        delay = max(delay, _retry_after(err) or 0.0)
+        print(f"[warn] LLM 请求失败（{type(err).__name__}），{delay:.1f}s 后第 {attempt} 次重试")
+        time.sleep(delay)
+
+    def chat(self, model: str, messages: List[Dict[str, Any]], rate_limiter: Optional[RateLimiter] = None,
+             **params: Any):
+        """带重试的 chat.completions.create，返回原始响应；rate_limiter 对每次尝试（包括重试）生效"""
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            attempt += 1
+            self._reserve()
+            if rate_limiter is not None:
+                rate_limiter.wait()
+            try:
+                resp = self.client.chat.completions.create(model=model, messages=messages, **params)
+            except Exception as e:
+                if not _retryable(e) or attempt > self.max_retries:
+                    self._record(model, time.perf_counter() - start, attempt, error=type(e).__name__)
+                    raise
+                self._backoff(attempt, e)
+                continue
+            self._record(model, time.perf_counter() - start, attempt, usage=getattr(resp, "usage", None))
+            return resp
+
+    def complete(self, model: str, messages: List[Dict[str, Any]], cache: bool = True, salt: Any = None,
+                 rate_limiter: Optional[RateLimiter] = None, **params: Any) -> str:
+        """
+        返回 message.content；先查 LLM 响应缓存
+        cache=False 时既不读也不写缓存；salt 用于区分同一请求的多次独立采样
+        """
+        store = get_llm_cache() if cache else None
+        key = request_key(model, messages, salt, **params)
+        if store is not None:
+            content = store.get(key)
+            if content is not None:
+                return content
+        resp = self.chat(model, messages, rate_limiter=rate_limiter, **params)
+        content = resp.choices[0].message.content or ""
+        if store is not None and content:
+            store.put(key, model, content)
+        return content
+
+    def stream(self, model: str, messages: List[Dict[str, Any]], on_text: Callable[[str], Optional[bool]],
+               cache: bool = True, salt: Any = None, rate_limiter: Optional[RateLimiter] = None,
+               **params: Any) -> str:
+        """
+        流式版本的 complete()，返回收到的全部文本
+        on_text 依次收到每个文本片段，返回 True 时断开连接、结束生成（后面的内容不再计费）
+        命中缓存时把整段缓存内容一次交给 on_text；还没收到任何片段时出错照常重试，收到片段后出错直接抛出
+        只有完整生成的响应才写入缓存：提前断开的响应与 complete() 共用同一个缓存键，写进去会被当成完整结果
+        请求时带 stream_options.include_usage 让服务端在最后一个 chunk 给出用量；提前断开或服务端没给时
+        按 messages 和已收到的文本估算，流式调用同样计入 token 预算
+        """
+        store = get_llm_cache() if cache else None
+        key = request_key(model, messages, salt, **params)
+        if store is not None:
+            content = store.get(key)
+            if content is not None:
+                on_text(content)
+                return content
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            attempt += 1
+            self._reserve()
+            if rate_limiter is not None:
+                rate_limiter.wait()
+            parts: List[str] = []
+            ttft = usage = None
+            stopped = False
+            try:
+                resp = self.client.chat.completions.create(model=model, messages=messages, stream=True,
+                                                           **{"stream_options": {"include_usage": True}, **params})
+                try:
+                    for chunk in resp:
+                        choice = chunk.choices[0] if chunk.choices else None
+                        # OpenAI 在最后一个 chunk 上给 usage，Moonshot 放在 choices[0].usage
+                        usage = getattr(chunk, "usage", None) or getattr(choice, "usage", None) or usage
+                        if isinstance(usage, dict):     # choices[0] 上的额外字段不会被解析成对象
+                            usage = SimpleNamespace(**usage)
+                        delta = choice.delta.content if choice is not None and choice.delta is not None else None
+                        if not delta:
+                            continue
+                        if ttft is None:
+                            ttft = time.perf_counter() - start
+                            print(f"首 token 延迟 {ttft:.2f}s")
+                        parts.append(delta)
+                        if on_text(delta):
+                            stopped = True
+                            break
+                finally:
+                    resp.close()
+            except Exception as e:
+                if parts or not _retryable(e) or attempt > self.max_retries:
+                    self._record(model, time.perf_counter() - start, attempt, error=type(e).__name__, ttft=ttft,
+                                 usage=usage or (_estimate_usage(messages, parts) if parts else None))
+                    raise
+                self._backoff(attempt, e)
+                continue
+            self._record(model, time.perf_counter() - start, attempt, usage=usage or _estimate_usage(messages, parts),
+                         ttft=ttft)
+            content = "".join(parts)
+            if store is not None and content and not stopped:
+                store.put(key, model, content)
+            return content
+
+
+def _estimate_usage(messages: List[Dict[str, Any]], parts: List[str]) -> SimpleNamespace:
+    """服务端没有返回用量时的估算值，字段与 usage 对象一致"""
+    prompt = sum(approx_token_count(str(m.get("content") or "")) for m in messages)
+    return SimpleNamespace(prompt_tokens=prompt, completion_tokens=approx_token_count("".join(parts)))
+
+
+_GATEWAY: Optional[LLMGateway] = None
+_GATEWAY_PID: Optional[int] = None
+_GATEWAY_LOCK = threading.Lock()
+
+
+def get_gateway() -> LLMGateway:
+    """进程内共享的网关，配置取自环境变量"""
+    global _GATEWAY, _GATEWAY_PID
+    with _GATEWAY_LOCK:
+        if _GATEWAY is None or _GATEWAY_PID != os.getpid():
+            stats_file = os.getenv("UTGEN_LLM_STATS_FILE")
+            _GATEWAY = LLMGateway(timeout=float(os.getenv("UTGEN_LLM_TIMEOUT", DEFAULT_TIMEOUT_S)),
+                                  max_retries=int(os.getenv("UTGEN_LLM_RETRIES", DEFAULT_RETRIES)),
+                                  max_requests=_env_int("UTGEN_LLM_MAX_REQUESTS"),
+                                  max_tokens=_env_int("UTGEN_LLM_MAX_TOKENS"),
+                                  stats_file=Path(stats_file) if stats_file else None)
+            _GATEWAY_PID = os.getpid()
+        return _GATEWAY
+
+
+def complete(model: str, messages: List[Dict[str, Any]], cache: bool = True, salt: Any = None,
+             rate_limiter: Optional[RateLimiter] = None, **params: Any) -> str:
+    return get_gateway().complete(model, messages, cache=cache, salt=salt, rate_limiter=rate_limiter, **params)
+
+
+def stream(model: str, messages: List[Dict[str, Any]], on_text: Callable[[str], Optional[bool]], cache: bool = True,
+           salt: Any = None, rate_limiter: Optional[RateLimiter] = None, **params: Any) -> str:
+    return get_gateway().stream(model, messages, on_text, cache=cache, salt=salt, rate_limiter=rate_limiter, **params)
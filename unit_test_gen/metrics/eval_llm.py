@@ -4,16 +4,14 @@ from typing import Optional,Dict, List, Tuple
 from dotenv import load_dotenv
 import javalang
 import os
-from openai import OpenAI
 import glob
 import re
 from collections import defaultdict
+from unit_test_gen.llm_cache import sample_salt
+from unit_test_gen.llm_gateway import complete, get_gateway
+from unit_test_gen.data_preparation.mcdc_case_gen import all_methods, get_parser
 load_dotenv()
 
-client = OpenAI(
-            api_key="sk-jcK260y9Z40an9itPpM3AHUA9hHfHzmzjVaYfe6s5SBGVWAq",
-            base_url="https://api.moonshot.cn/v1"
-        )
 
 def split_test_cases(java_file: Path) -> list[str]:
     java_file = Path(java_file)
@@ -243,6 +241,20 @@ def begin_search(test_file: Path, src_file: Path):
         })
     return res
 
+def _mcdc_entry(mcdc_info: dict, func_name: str, src_code: str) -> dict:
+    """
+    MC/DC 结果按 方法名(参数类型) 区分重载：先由源码片段算出方法键精确匹配，
+    匹配不到（如旧结果文件只有方法名）时取同名的第一个方法
+    """
+    code = ("class Dummy { " + src_code + " }").encode("utf-8")
+    for key, _ in all_methods(get_parser().parse(code).root_node, code):
+        if key in mcdc_info:
+            return mcdc_info[key]
+    for key, entry in mcdc_info.items():
+        if key.split("(", 1)[0] == func_name:
+            return entry
+    return {}
+
 def begin_eval(test_file: Path, src_file: Path, mcdc_file: Path):
 
     src_to_cases = begin_search(test_file, src_file)
@@ -256,7 +268,7 @@ def begin_eval(test_file: Path, src_file: Path, mcdc_file: Path):
         src_code = item['src']
         if src_code == '':
             continue
-        mcdc_nodes = mcdc_info.get(item['function_name'], {}).get('cfg_nodes', [])
+        mcdc_nodes = _mcdc_entry(mcdc_info, item['function_name'], src_code).get('cfg_nodes', [])
         if not mcdc_nodes:
             print(f"⚠️ {item['function_name']} 缺失 mcdc 配置，跳过")
             continue
@@ -321,13 +333,15 @@ def send_request(test_code: str, src_code: str, mcdc: list):
     ans = []
     flag = True
     for i in range(self_consistency):
-        resp = client.chat.completions.create(
+        # 每次投票用 salt 区分，同一轮内是独立采样；salt 带上运行 id，重跑评估时重新投票
+        content = complete(
             model=model,
             messages=[{"role": "user", "content": prompt.format(src_code=src_code, test_code=test_code, mcdc=mcdc)}],
+            salt=sample_salt(i),
             temperature=0.2,
             max_tokens=256
         )
-        ans.append(resp.choices[0].message.content.strip())
+        ans.append(content.strip())
         if '否' in ans[i]:
             flag = False
             break
@@ -411,6 +425,7 @@ def run_all():
     print(f'all_skip: {all_skip}')
 
     print(f'all_accuracy: {all_count}/{all_skip}/{all_total}')
+    get_gateway().report()
     
     
 
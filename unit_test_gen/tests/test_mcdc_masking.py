@@ -0,0 +1,40 @@
+"""masking MC/DC：每个独立影响对里，两个向量的结果都只由被测原子决定"""
+import pytest
+import z3
+
+from unit_test_gen.data_preparation.mcdc_case_gen import mcdc_solve, to_z3
+
+EXPRS = [
+    "(a && b) || c",
+    "a && (b || c)",
+    "(a || b) && (c || d)",
+    "(a && b) || (!a && c)",
+    "(a && b) || (c && d) || (e && !b)",
+    "a ^ (b && c)",
+]
+
+
+def _eval(z3_expr, z3_vars, ctx):
+    subst = [(z3_vars[name], z3.BoolVal(val)) for name, val in ctx.items()]
+    return z3.is_true(z3.simplify(z3.substitute(z3_expr, *subst)))
+
+
+@pytest.mark.parametrize("solver", ["bdd", "auto"])
+@pytest.mark.parametrize("expr", EXPRS)
+def test_masking_pairs_are_independent(expr, solver):
+    z3_expr, _, z3_vars = to_z3(expr)
+    res = mcdc_solve(expr, solver, "masking", max_pairs=3)
+    assert res.complete
+    for atom, pairs in res.pairs.items():
+        for on, off in pairs:
+            assert on[atom] and not off[atom]
+            assert _eval(z3_expr, z3_vars, on) != _eval(z3_expr, z3_vars, off)
+            # 两个向量里单独翻转被测原子都会改变结果，即其他原子都被屏蔽
+            for ctx in (on, off):
+                flipped = {**ctx, atom: not ctx[atom]}
+                assert _eval(z3_expr, z3_vars, ctx) != _eval(z3_expr, z3_vars, flipped)
+
+
+def test_masking_covers_every_observable_atom():
+    res = mcdc_solve("(a && b) || c", "bdd", "masking")
+    assert all(res.pairs[atom] for atom in res.atoms)
@@ -1,15 +1,18 @@
 import csv
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import shutil
 import subprocess
 import time
-from openai import OpenAI
 from dotenv import load_dotenv
 import os
 
 import yaml
-from unit_test_gen.data_preparation.db_construct import DataBaseConstructor
+from unit_test_gen.data_preparation.retrieval import search as kb_search
+from unit_test_gen.data_preparation.code_query import RETRIEVAL_MODES, build_query
 from unit_test_gen.prompt_management import save_prompt
+from unit_test_gen.llm_cache import sample_salt
+from unit_test_gen.llm_gateway import CodeBlockWriter, complete, stream
 from unit_test_gen.data_preparation.mcdc_case_gen import solve_mcdc
 from unit_test_gen.ut_case_generation.code_structure_extract import calc_structure
 load_dotenv()
@@ -28,6 +31,11 @@ class UnitTestGenerator:
                  max_retry: int = 3,
                  ablation: bool = False,
                  case_gen: bool = True,
+                 mcdc_concrete: bool = False,
+                 retrieval_mode: str = "abs",
+                 kb_namespace: str = "nasa",
+                 llm_cache: bool = True,
+                 stream: bool = False,
 
                  ):
         self.repo_root = java_repo_root 
@@ -40,6 +48,14 @@ class UnitTestGenerator:
         self.fix_info_dir = log_info_dir / "fix"
         self.ablation_dir = log_info_dir / "ablation"
         self.case_gen_enable = case_gen
+        self.mcdc_concrete = mcdc_concrete     # MC/DC 向量附带求解出的具体输入
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"未知的检索模式: {retrieval_mode}（可选 {', '.join(RETRIEVAL_MODES)}）")
+        # abs: 以 CODE_ABS 摘要检索；code / summary: 由源码直接构造查询，CODE_ABS 与检索并行
+        self.retrieval_mode = retrieval_mode
+        self.kb_namespace = kb_namespace       # 检索使用的项目知识库 db_data_<kb_namespace>
+        self.llm_cache = llm_cache             # 相同请求复用 LLM 响应缓存（见 llm_cache.py）
+        self.stream = stream                   # 生成测试用例时流式请求，代码块边收边写，闭合后立即结束生成
         os.makedirs(self.fix_info_dir, exist_ok=True)
         os.makedirs(self.log_info_dir, exist_ok=True)
         os.makedirs(self.error_info_dir, exist_ok=True)
@@ -49,10 +65,6 @@ class UnitTestGenerator:
         self.max_retry = max_retry
         self.file_name = file_name
         self.model = model
-        self.client = OpenAI(
-            api_key=os.getenv("MOONSHOT_API_KEY"),
-            base_url="https://api.moonshot.cn/v1"
-        )
         self.ablation = ablation
         if self.ablation:
             print("启用消融实验...")
@@ -122,18 +134,43 @@ class UnitTestGenerator:
                 f.write(code)
 
 
-    def send_request(self, prompt: str) -> str:
-        """调用聊天接口"""
-        resp = self.client.chat.completions.create(
+    def send_request(self, prompt: str, salt=None) -> str:
+        """
+        调用聊天接口；prompt 不变时直接复用缓存的响应，salt 区分同一 prompt 的多次独立采样。
+        用例生成、错误修复这类采样生成传 sample_salt(...)，每次运行重新采样
+        """
+        content = complete(
             model=self.model,
             messages=[
                 {"role": "user",   "content": prompt}
             ],
+            cache=self.llm_cache,
+            salt=salt,
             temperature=0.9,
             max_tokens=32768
         )
-        return resp.choices[0].message.content.strip()
+        return content.strip()
+
+    def write_cases(self, prompt: str, out_path: Path):
+        """请求生成测试用例，把响应中 ```java 代码块的内容写到 out_path"""
+        if self.stream:
+            writer = CodeBlockWriter(out_path)
+            try:
+                stream(model=self.model, messages=[{"role": "user", "content": prompt}], on_text=writer,
+                       cache=self.llm_cache, salt=sample_salt(), temperature=0.9, max_tokens=32768)
+            except BaseException:
+                writer.close()
+                raise
+            writer.finish()
+            return
+        resp = self.send_request(prompt=prompt, salt=sample_salt())
+        with open(out_path, "w", encoding="utf-8") as f:
+            f.write(resp.split("```java")[1].split("```")[0])
     
+    def retrieve(self, query: str):
+        # 模型和索引在进程内只加载一次（或由 UTGEN_RETRIEVAL_SOCKET 指定的检索守护进程提供）
+        return [{k: v for k, v in hit.items() if k != "score"} for hit in kb_search(query, namespace=self.kb_namespace)]
+
     def case_gen(self):
         print("读取配置信息中...")
         # 获取代码目录的代码结构
@@ -141,59 +178,54 @@ class UnitTestGenerator:
 
         with open(self.java_code_dir, "r", encoding="utf-8") as f:
             code = f.read()
-        abs = self.send_request(prompt=self.prompt_template["CODE_ABS"].format(code=code))
-        ref = DataBaseConstructor().search_index(query=abs)
-        with open(self.boundary_dir, "r", encoding="utf-8") as f:
-            boundary = f.read()
-        with open(self.mock_dir, "r", encoding="utf-8") as f:
-            mock_cond = f.read()
-        mcdc_constraints = solve_mcdc(self.java_code_dir)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            # CODE_ABS 摘要是 prompt 的一部分，在后台请求，与下面的本地步骤重叠
+            abs_future = pool.submit(self.send_request, self.prompt_template["CODE_ABS"].format(code=code))
+            if self.retrieval_mode != "abs":
+                ref = self.retrieve(build_query(code, self.retrieval_mode))
+            with open(self.boundary_dir, "r", encoding="utf-8") as f:
+                boundary = f.read()
+            with open(self.mock_dir, "r", encoding="utf-8") as f:
+                mock_cond = f.read()
+            mcdc_constraints = solve_mcdc(self.java_code_dir, concrete=self.mcdc_concrete)
+            abs = abs_future.result()
+        if self.retrieval_mode == "abs":
+            ref = self.retrieve(abs)
         print("正在生成测试用例...")
         cases_path = []
-        resp = self.send_request(prompt=self.prompt_template['SYS_PROMPT'] + self.prompt_template['UT_GEN'].format(structure=structure, code=code, abs=abs, mock_cond=mock_cond, boundary=boundary, ref=ref, mcdc=mcdc_constraints))
         # 将 '''java... ''' 中的内容保存到文件
-        with open(self.ablation_dir / f"{self.file_name}_all_Test.java", "w", encoding="utf-8") as f:
-            f.write(resp.split("```java")[1].split("```")[0])
+        self.write_cases(self.prompt_template['SYS_PROMPT'] + self.prompt_template['UT_GEN'].format(structure=structure, code=code, abs=abs, mock_cond=mock_cond, boundary=boundary, ref=ref, mcdc=mcdc_constraints),
+                         self.ablation_dir / f"{self.file_name}_all_Test.java")
         cases_path.append(self.ablation_dir / f"{self.file_name}_all_Test.java")
         if self.ablation:
             print("单变量消融实验开始...")
             # 消融abs
             out_path = self.ablation_dir / f"{self.file_name}_abs_Test.java"
-            resp = self.send_request(prompt=self.prompt_template['SYS_PROMPT'] + self.prompt_template['UT_GEN_NO_ABS'].format(structure=structure, code=code, mock_cond=mock_cond, boundary=boundary, ref=ref, mcdc=mcdc_constraints))
-            with open(out_path, "w", encoding="utf-8") as f:
-                f.write(resp.split("```java")[1].split("```")[0])
-                print(f"已保存消融abs的测试用例到 {out_path}")
+            self.write_cases(self.prompt_template['SYS_PROMPT'] + self.prompt_template['UT_GEN_NO_ABS'].format(structure=structure, code=code, mock_cond=mock_cond, boundary=boundary, ref=ref, mcdc=mcdc_constraints), out_path)
+            print(f"已保存消融abs的测试用例到 {out_path}")
             cases_path.append(out_path)
             # 消融mock_cond
             out_path = self.ablation_dir / f"{self.file_name}_mock_Test.java"
-            resp = self.send_request(prompt=self.prompt_template['SYS_PROMPT'] + self.prompt_template['UT_GEN_NO_MOCK'].format(structure=structure, code=code, abs=abs, boundary=boundary, ref=ref, mcdc=mcdc_constraints))
-            with open(out_path, "w", encoding="utf-8") as f:
-                f.write(resp.split("```java")[1].split("```")[0])
-                print(f"已保存消融mock_cond的测试用例到 {out_path}")
+            self.write_cases(self.prompt_template['SYS_PROMPT'] + self.prompt_template['UT_GEN_NO_MOCK'].format(structure=structure, code=code, abs=abs, boundary=boundary, ref=ref, mcdc=mcdc_constraints), out_path)
+            print(f"已保存消融mock_cond的测试用例到 {out_path}")
             cases_path.append(out_path)
 
             # 消融boundary
             out_path = self.ablation_dir / f"{self.file_name}_boundary_Test.java"
 
-            resp = self.send_request(prompt=self.prompt_template['SYS_PROMPT'] + self.prompt_template['UT_GEN_NO_BOUNDARY'].format(structure=structure, code=code, abs=abs, mock_cond=mock_cond, ref=ref, mcdc=mcdc_constraints))
-            with open(out_path, "w", encoding="utf-8") as f:
-                f.write(resp.split("```java")[1].split("```")[0])
-                print(f"已保存消融boundary的测试用例到 {out_path}")
+            self.write_cases(self.prompt_template['SYS_PROMPT'] + self.prompt_template['UT_GEN_NO_BOUNDARY'].format(structure=structure, code=code, abs=abs, mock_cond=mock_cond, ref=ref, mcdc=mcdc_constraints), out_path)
+            print(f"已保存消融boundary的测试用例到 {out_path}")
             cases_path.append(out_path)
             # 消融mcdc
             out_path = self.ablation_dir / f"{self.file_name}_mcdc_Test.java"
 
-            resp = self.send_request(prompt=self.prompt_template['SYS_PROMPT'] + self.prompt_template['UT_GEN_NO_MCDC'].format(structure=structure, code=code, abs=abs, mock_cond=mock_cond, boundary=boundary, ref=ref))
-            with open(out_path, "w", encoding="utf-8") as f:
-                f.write(resp.split("```java")[1].split("```")[0])
-                print(f"已保存消融mcdc的测试用例到 {out_path}")
+            self.write_cases(self.prompt_template['SYS_PROMPT'] + self.prompt_template['UT_GEN_NO_MCDC'].format(structure=structure, code=code, abs=abs, mock_cond=mock_cond, boundary=boundary, ref=ref), out_path)
+            print(f"已保存消融mcdc的测试用例到 {out_path}")
             cases_path.append(out_path)
             # 消融ref
             out_path = self.ablation_dir / f"{self.file_name}_ref_Test.java"
-            resp = self.send_request(prompt=self.prompt_template['SYS_PROMPT'] + self.prompt_template['UT_GEN_NO_REF'].format(structure=structure, code=code, abs=abs, mock_cond=mock_cond, boundary=boundary, mcdc=mcdc_constraints))
-            with open(out_path, "w", encoding="utf-8") as f:
-                f.write(resp.split("```java")[1].split("```")[0])
-                print(f"已保存消融ref的测试用例到 {out_path}")
+            self.write_cases(self.prompt_template['SYS_PROMPT'] + self.prompt_template['UT_GEN_NO_REF'].format(structure=structure, code=code, abs=abs, mock_cond=mock_cond, boundary=boundary, mcdc=mcdc_constraints), out_path)
+            print(f"已保存消融ref的测试用例到 {out_path}")
             cases_path.append(out_path)
         print("测试用例生成完毕，已保存到", self.ablation_dir)
         return cases_path
@@ -297,7 +329,8 @@ class UnitTestGenerator:
             error_info = f.read()
         with open(self.java_test_dir / f"{self.file_name}Test.java", "r", encoding="utf-8") as f:
             test_code = f.read()
-        resp = self.send_request(prompt=self.prompt_template["ERROR_FIX"].format(code=code, test_code=test_code, error_info=error_info))
+        # 每轮修复独立采样，避免同样的报错在下一轮拿到同一份缓存的修复
+        resp = self.send_request(prompt=self.prompt_template["ERROR_FIX"].format(code=code, test_code=test_code, error_info=error_info), salt=sample_salt(f"fix-{round}"))
         print("正在修复错误...")
         if "```java" not in resp:
             print("Error: 修复后的代码中不包含 ```java 标记，错误可能来自于源码。")
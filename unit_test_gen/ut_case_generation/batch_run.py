@@ -2,6 +2,7 @@
 import os
 import subprocess
 from pathlib import Path
+from unit_test_gen.llm_cache import run_id
 
 # 1. 配置：把 A_DIR 换成你的实际目录
 A_DIR = Path(__file__).resolve().parent.parent.parent / "java_project" / "src" / "main" / "java" / "org" / "example"    
@@ -12,6 +13,9 @@ if not java_files:
     print("A 目录下未找到任何 .java 文件！")
     exit(0)
 
+# 所有子进程共用同一个运行 id；崩溃后带上打印出的 UTGEN_LLM_RUN_ID 重跑，复用已经采样过的响应
+run_id()
+
 # 3. 逐个执行
 for file_name in java_files:
     if file_name == "DataCleaner":
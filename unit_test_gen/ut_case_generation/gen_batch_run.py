@@ -2,6 +2,7 @@
 import os
 import subprocess
 from pathlib import Path
+from unit_test_gen.llm_cache import run_id
 import time
 
 # 1. 配置：把 A_DIR 换成你的实际目录
@@ -15,6 +16,13 @@ if not java_files:
 
 print(f'java_files: {java_files}')
 
+# 所有子进程共用同一个运行 id；崩溃后带上打印出的 UTGEN_LLM_RUN_ID 重跑，复用已经采样过的响应
+run_id()
+
+# 先并行求解整个包的 MC/DC。SRC_DIR 下直接存放的类输出到 mcdc_output/，与之后每个文件的 solve_mcdc
+# 写的是同一份结果，方法未改动时直接复用；子目录里的类输出到 mcdc_output/<子目录>/，逐文件求解时只共享形状缓存
+subprocess.run(["python", "-m", "unit_test_gen.data_preparation.mcdc_case_gen", "--src_dir", str(SRC_DIR)], check=False)
+
 # java_files = ['AmericanWireGauge', 'And', 'Brick3d', 'Brick3dWithSegments', 'CircularIntQueue', 'ComparativeStatistics', 'Compatible', 'Constants', 'DataTable', 'Distribution', 'DoubleInterval', 'DoublesList', 'EasyFile', 'Error', 'ExtendedTreeSet', 'ExtendedVector', 'FieldRecordText', 'GrowOnlyArray', 'IO', 'IncrementIterator', 'IndexIterator', 'IntegerInterval', 'IsEqual', 'IsInstanceOf', 'IsMarked', 'Iterator', 'KeyCounter', 'LogComparisons', 'LogFile', 'ManySamples', 'Mark', 'MarkIsSet', 'MathUtility', 'Matrix3d', 'MinMaxes', 'Not', 'ObjectCache', 'ObjectCompatible', 'ObjectEquals', 'Or', 'Predicate', 'PrintTabSeparatedData', 'Procedure', 'PropertiesList', 'Quat4d', 'RandomDistribution', 'RandomGaussianDistribution', 'RandomNumber', 'ReinitializableFloat', 'ReinitializableFloatWithFactor', 'ReinitializableInt', 'RootMeanSquares', 'Sample', 'Saver', 'SetMark', 'Tanimoto', 'Timer', 'Utility', 'VRMLUtility', 'Vector3d', 'VectorIterator', 'WeightedStatistics', 'integer']
 # 3. 逐个执行
 for file_name in java_files[30:]:
@@ -1,4 +1,6 @@
 from unit_test_gen.ut_case_generation.auto_gen_single import UnitTestGenerator
+from unit_test_gen.data_preparation.code_query import RETRIEVAL_MODES
+from unit_test_gen.llm_gateway import get_gateway
 from pathlib import Path
 import argparse
     # def __init__(self, 
@@ -26,6 +28,11 @@ if __name__ == "__main__":
     argparser.add_argument("--max_retry", type=int, default=2, help="最大重试次数")
     argparser.add_argument("--ablation",action="store_true",help="是否启用消融实验") 
     argparser.add_argument("--case_gen",action="store_true",help="是否启用用例生成")
+    argparser.add_argument("--kb_namespace", type=str, default="nasa", help="检索使用的项目知识库命名空间")
+    argparser.add_argument("--no_llm_cache", action="store_true", help="不读写 LLM 响应缓存，每次都重新请求")
+    argparser.add_argument("--stream", action="store_true", help="流式生成测试用例，边收边写文件，代码块结束即停止生成")
+    argparser.add_argument("--mcdc_concrete", action="store_true", help="MC/DC 向量附带求解出的具体参数/字段取值")
+    argparser.add_argument("--retrieval_mode", choices=RETRIEVAL_MODES, default="abs", help="知识库检索查询：abs 为 LLM 摘要，code / summary 由源码直接构造")
 
     args = argparser.parse_args()
 
@@ -40,11 +47,17 @@ if __name__ == "__main__":
         max_retry=args.max_retry,
         file_name=args.file_name,
         ablation=args.ablation,
-        case_gen=args.case_gen
+        case_gen=args.case_gen,
+        mcdc_concrete=args.mcdc_concrete,
+        retrieval_mode=args.retrieval_mode,
+        kb_namespace=args.kb_namespace,
+        llm_cache=not args.no_llm_cache,
+        stream=args.stream
     )
     ut.begin_gen_single_file()
     if args.ablation:
         ut.begin_ablation()
+    get_gateway().report()
 
 
 